@@ -0,0 +1,8 @@
+"""
+benchmarks for exipicrename
+
+Generates synthetic JPEG corpora (with raw and xmp sidecar files) and
+measures the phases of exipicrename on them, results are written as JSON.
+
+usage: python -m benchmarks --help
+"""
@@ -0,0 +1,127 @@
+"""
+run the exipicrename benchmark:
+generate a synthetic corpus, time the phases read, organize and rename
+(in a dry run and in a real run), print the results as JSON
+"""
+
+import argparse
+import importlib
+import json
+import os
+import platform
+import sys
+from tempfile import TemporaryDirectory
+
+from . import corpus
+
+# the package exports the function exipicrename under the name of the module
+core = importlib.import_module('exipicrename.exipicrename')
+
+PHASES = ('read', 'organize', 'rename')
+
+
+def __parse_args():
+    """read and interpret commandline arguments"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=1000,
+                        help="number of pictures in the corpus (default: 1000)")
+    parser.add_argument("--burst-ratio", type=float, default=0.1,
+                        help="part of pictures with the same second as the one before")
+    parser.add_argument("--raw-ratio", type=float, default=0.5,
+                        help="part of pictures with a raw file")
+    parser.add_argument("--xmp-ratio", type=float, default=0.2,
+                        help="part of pictures with a xmp sidecar file")
+    parser.add_argument("--fanout", type=int, default=1000,
+                        help="pictures per directory")
+    parser.add_argument("--jobs", type=int,
+                        help="worker threads (default: exipicrename default)")
+    parser.add_argument("--datedir", action="store_true",
+                        help="rename into date directories")
+    parser.add_argument("--short", action="store_true",
+                        help="use short names")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="repeat every measurement, the fastest run counts")
+    parser.add_argument("--tmpdir",
+                        help="create the corpus below this directory (default: system tmp)")
+    parser.add_argument("-o", "--output",
+                        help="write JSON to this file (default: stdout)")
+    return parser.parse_args()
+
+
+def __renamer(args, dry_run):
+    """a renamer with the options of one run"""
+    renamer = core.Renamer()
+    renamer.set_silent(True)
+    renamer.set_dry_run(dry_run)
+    renamer.set_use_date_dir(args.datedir)
+    renamer.set_short_names(args.short)
+    renamer.set_jobs(args.jobs)
+    return renamer
+
+
+def run_once(args, dry_run):
+    """generate a corpus and time the phases on it,
+    returns dict phase -> seconds"""
+    with TemporaryDirectory(dir=args.tmpdir) as directory:
+        jpegs = corpus.generate(
+            directory, files=args.files, burst_ratio=args.burst_ratio,
+            raw_ratio=args.raw_ratio, xmp_ratio=args.xmp_ratio, fanout=args.fanout)
+        renamer = __renamer(args, dry_run)
+        renamer.exipicrename(jpegs)
+        phases = renamer.get_profile_stats()['phases']
+    return {phase: phases[phase] for phase in PHASES}
+
+
+def run(args):
+    """run all measurements, returns the result dict"""
+    results = {}
+    for mode, dry_run in (('dry_run', True), ('real', False)):
+        runs = [run_once(args, dry_run) for _ in range(max(1, args.repeat))]
+        results[mode] = {}
+        for phase in PHASES:
+            seconds = min(run[phase] for run in runs)
+            results[mode][phase] = {
+                'seconds': round(seconds, 6),
+                'files_per_second': round(args.files / seconds, 1) if seconds else None,
+            }
+        total = min(sum(run.values()) for run in runs)
+        results[mode]['total'] = {
+            'seconds': round(total, 6),
+            'files_per_second': round(args.files / total, 1) if total else None,
+        }
+
+    return {
+        'exipicrename_version': core.version,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'corpus': {
+            'files': args.files,
+            'burst_ratio': args.burst_ratio,
+            'raw_ratio': args.raw_ratio,
+            'xmp_ratio': args.xmp_ratio,
+            'fanout': args.fanout,
+        },
+        'settings': {
+            'jobs': core.Renamer().get_jobs() if args.jobs is None else args.jobs,
+            'datedir': args.datedir,
+            'short': args.short,
+            'repeat': args.repeat,
+        },
+        'phases': results,
+    }
+
+
+def main():
+    """entry point"""
+    args = __parse_args()
+    result = json.dumps(run(args), indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            output.write(result + '\n')
+    else:
+        sys.stdout.write(result + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+synthetic JPEG corpus for benchmarks
+
+Every picture is a tiny JPEG with an exif APP1 segment holding the tags
+exipicrename uses, optionally with raw (.orf) and xmp sidecar files.
+"""
+
+import io
+import os
+import random
+import struct
+from functools import lru_cache
+
+import PIL.Image
+
+CAMERAS = ('E-520', 'GT-I9195', 'E-M5MarkIII', 'iPhone 6', 'NIKON D750')
+
+# tiff field types
+ASCII = 2
+SHORT = 3
+LONG = 4
+RATIONAL = 5
+
+
+@lru_cache(maxsize=1)
+def image_data():
+    """JPEG data (without SOI marker) of a tiny grey picture"""
+    buf = io.BytesIO()
+    PIL.Image.new('RGB', (8, 8), (128, 128, 128)).save(buf, 'JPEG', quality=10)
+    return buf.getvalue()[2:]
+
+
+def __ifd(entries, offset):
+    """little endian tiff ifd at offset, entries are (tag, type, value)
+    returns the ifd with its data area"""
+    entries = sorted(entries)
+    data_offset = offset + 2 + 12 * len(entries) + 4
+    ifd = struct.pack('<H', len(entries))
+    data = b''
+    for tag, field_type, value in entries:
+        if field_type == ASCII:
+            raw = value.encode('ascii') + b'\0'
+            count = len(raw)
+        elif field_type == RATIONAL:
+            raw = struct.pack('<LL', *value)
+            count = 1
+        elif field_type == SHORT:
+            raw = struct.pack('<HH', value, 0)
+            count = 1
+        else:
+            raw = struct.pack('<L', value)
+            count = 1
+        if len(raw) <= 4:
+            ifd += struct.pack('<HHL', tag, field_type, count) + raw.ljust(4, b'\0')
+        else:
+            ifd += struct.pack('<HHLL', tag, field_type, count, data_offset + len(data))
+            data += raw + b'\0' * (len(raw) % 2)
+    return ifd + struct.pack('<L', 0) + data
+
+
+def exif_segment(model, datetime_original, *,  # pylint: disable=too-many-arguments
+                 exposure_time=(1, 125), f_number=(28, 10), iso=200, focal_length=(25, 1)):
+    """APP1 segment (with marker) with the exif tags exipicrename reads"""
+    # the size of ifd0 does not depend on the value of the exif ifd pointer
+    exif_offset = 8 + len(__ifd([(0x0110, ASCII, model), (0x8769, LONG, 0)], 8))
+    ifd0 = __ifd([(0x0110, ASCII, model), (0x8769, LONG, exif_offset)], 8)
+    exif_ifd = __ifd([
+        (0x829A, RATIONAL, exposure_time),
+        (0x829D, RATIONAL, f_number),
+        (0x8827, SHORT, iso),
+        (0x9003, ASCII, datetime_original),
+        (0x920A, RATIONAL, focal_length),
+    ], exif_offset)
+    payload = b'Exif\0\0' + b'II*\0' + struct.pack('<L', 8) + ifd0 + exif_ifd
+    return b'\xff\xe1' + struct.pack('>H', len(payload) + 2) + payload
+
+
+def write_jpeg(filepath, **exif):
+    """write a tiny JPEG file with exif data"""
+    with open(filepath, 'wb') as jpeg:
+        jpeg.write(b'\xff\xd8' + exif_segment(**exif) + image_data())
+
+
+def generate(directory, *,  # pylint: disable=too-many-arguments,too-many-locals
+             files=1000, burst_ratio=0.1, raw_ratio=0.5, xmp_ratio=0.2, fanout=1000, seed=1):
+    """generate a corpus of files pictures in directory,
+    burst_ratio: part of pictures with the same second as the picture before
+    raw_ratio / xmp_ratio: part of pictures with a raw / xmp sidecar file
+    fanout: pictures per sub-directory
+    returns the list of JPEG file names (in generation order)"""
+    rnd = random.Random(seed)
+    jpegs = []
+    second = 0
+    subdir = None
+    for number in range(files):
+        if number % fanout == 0:
+            subdir = os.path.join(directory, f"dir{number // fanout:05d}")
+            os.makedirs(subdir, exist_ok=True)
+        if number == 0 or rnd.random() >= burst_ratio:
+            second += rnd.randint(1, 30)
+        day, rest = divmod(second, 86400)
+        hour, rest = divmod(rest, 3600)
+        minute, sec = divmod(rest, 60)
+        basename = os.path.join(subdir, f"P{number:07d}")
+        write_jpeg(
+            basename + '.jpg',
+            model=CAMERAS[number % len(CAMERAS)],
+            datetime_original=f"2019:{1 + day // 28 % 12:02d}:{1 + day % 28:02d}"
+                              f" {hour:02d}:{minute:02d}:{sec:02d}",
+            iso=100 * (1 + number % 16),
+        )
+        jpegs.append(basename + '.jpg')
+        if rnd.random() < raw_ratio:
+            with open(basename + '.orf', 'wb') as raw:
+                raw.write(b'IIRO')
+        if rnd.random() < xmp_ratio:
+            with open(basename + '.xmp', 'w', encoding='utf-8') as xmp:
+                xmp.write('<x:xmpmeta xmlns:x="adobe:ns:meta/"/>\n')
+    return jpegs
@@ -0,0 +1,83 @@
+"""
+micro-benchmark for parsing DateTimeOriginal:
+time.strptime + time.strftime twice (format_datetime and format_date)
+compared with the single pass parse_exif_datetime, printed as JSON
+
+usage: python -m benchmarks.exif_datetime --help
+"""
+
+import argparse
+import importlib
+import json
+import platform
+import sys
+import timeit
+
+# the package exports the function exipicrename under the name of the module
+core = importlib.import_module('exipicrename.exipicrename')
+
+VALUES = (
+    '2009:06:04 18:44:53',
+    '2017:11:23 16:40:06',
+    '2024:02:29 23:59:59',
+    '2019:12:31 00:00:00',
+)
+
+
+def __parse_args():
+    """read and interpret commandline arguments"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=20000,
+                        help="parses per measurement (default: 20000)")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="repeat every measurement, the fastest run counts")
+    return parser.parse_args()
+
+
+def strptime_twice():
+    """the way DateTimeOriginal was parsed before"""
+    for value in VALUES:
+        core.format_datetime(value)
+        core.format_date(value)
+
+
+def single_pass():
+    """one parse for timestamp and date"""
+    for value in VALUES:
+        core.parse_exif_datetime(value)
+
+
+def run(args):
+    """run the measurements, returns the result dict"""
+    for value in VALUES:
+        assert core.parse_exif_datetime(value) == (
+            core.format_datetime(value), core.format_date(value))
+
+    results = {}
+    parses = args.number * len(VALUES)
+    for name, function in (('strptime_twice', strptime_twice), ('single_pass', single_pass)):
+        seconds = min(timeit.repeat(function, number=args.number, repeat=max(1, args.repeat)))
+        results[name] = {
+            'seconds': round(seconds, 6),
+            'parses_per_second': round(parses / seconds, 1),
+        }
+    results['speedup'] = round(
+        results['strptime_twice']['seconds'] / results['single_pass']['seconds'], 1)
+
+    return {
+        'exipicrename_version': core.version,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parses': parses,
+        'results': results,
+    }
+
+
+def main():
+    """entry point"""
+    args = __parse_args()
+    sys.stdout.write(json.dumps(run(args), indent=2) + '\n')
+
+
+if __name__ == '__main__':
+    main()
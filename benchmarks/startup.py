@@ -0,0 +1,95 @@
+"""
+startup benchmark: seconds of `exipicrename --version` (a new interpreter every run)
+and the import time of the module (python -X importtime), printed as JSON,
+exits with 1 if Pillow is imported at the start or the import takes longer than --max-ms
+
+usage: python -m benchmarks.startup --help
+"""
+
+import argparse
+import importlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+# the package exports the function exipicrename under the name of the module
+core = importlib.import_module('exipicrename.exipicrename')
+
+# modules which should not be imported at the start
+LAZY_MODULES = ('PIL', 'sqlite3', 'cProfile', 'ctypes', 'concurrent')
+
+
+def __parse_args():
+    """read and interpret commandline arguments"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=10,
+                        help="repeat every measurement, the fastest run counts")
+    parser.add_argument("--max-ms", type=float,
+                        help="fail if the import of exipicrename takes longer (milliseconds)")
+    return parser.parse_args()
+
+
+def time_version():
+    """seconds of one `exipicrename.py --version`"""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, core.__file__, '--version'],
+                   check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def import_times():
+    """python -X importtime of the package,
+    returns microseconds of the whole import and the imported modules"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(core.__file__)))
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import exipicrename'],
+                            check=True, cwd=root, capture_output=True, text=True).stderr
+    microseconds = None
+    modules = []
+    for line in output.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not cumulative.strip().isdigit():
+            continue    # header
+        modules.append(name.strip())
+        if name.strip() == 'exipicrename':
+            microseconds = int(cumulative)
+    return microseconds, modules
+
+
+def run(args):
+    """run the measurements, returns the result dict"""
+    repeat = max(1, args.repeat)
+    version_seconds = min(time_version() for _ in range(repeat))
+    imports = [import_times() for _ in range(repeat)]
+    import_ms = min(microseconds for microseconds, _ in imports) / 1000
+    lazy_imported = sorted(name for name in imports[0][1]
+                           if name.split('.')[0] in LAZY_MODULES)
+
+    return {
+        'exipicrename_version': core.version,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'version_seconds': round(version_seconds, 4),
+        'import_ms': round(import_ms, 2),
+        'imported_modules': len(imports[0][1]),
+        'lazy_modules_imported': lazy_imported,
+        'ok': not lazy_imported and (args.max_ms is None or import_ms <= args.max_ms),
+    }
+
+
+def main():
+    """entry point"""
+    args = __parse_args()
+    result = run(args)
+    sys.stdout.write(json.dumps(result, indent=2) + '\n')
+    if not result['ok']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
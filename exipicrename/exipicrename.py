@@ -14,32 +14,51 @@ Used exif tags are:
 * Model
 * ISOSpeedRatings
 
+Exif data of JPEG files is read directly from the APP1 header segment,
+Pillow is only used (and imported) as fallback for files the built-in reader can't handle.
+Tiff based raw files are read through mmap (see set_raw_primary).
+
 """
 
 # Copyright (c) 2019 Hella Breitkopf, https://www.unixwitch.de
 # MIT License -> see LICENSE file
 
+# pylint: disable=too-many-lines
+
 import os
 from os.path import splitext as splitext_last
 import sys
 import re
+import select
 import csv
+import errno
+import hashlib
+import mmap
 import time
-import glob
 import argparse
-import copy
+import functools
+import heapq
+import collections
+import collections.abc
+import contextlib
+import itertools
+import json
+import shutil
+import struct
+import string
+import tempfile
+import threading
 import logging
-# PIL from Pillow
-import PIL
-import PIL.Image
-import PIL.ExifTags
+try:
+    import fcntl
+except ImportError:  # not on windows
+    fcntl = None  # pylint: disable=invalid-name
 
 version_info = (0, 0, 1, 1)  # pylint: disable=invalid-name
 version = '.'.join(str(digit) for digit in version_info)  # pylint: disable=invalid-name
 
-__CAMERADICT = {}       # how to rename certain camera names (load from csv)
-__PIC_DICT = {}         # main storage for file meta data
-__CONF = {
+# default settings of a new renamer (see the set_... methods)
+_DEFAULT_CONF = {
     'date_dir': False,
     'verbose': False,
     'debug': False,
@@ -49,9 +68,22 @@ __CONF = {
     'use_duplicate': True,
     'ooc': False,
     'ooc_extension': '.ooc',
+    'raw_primary': False,
     'short_names': False,
+    'template': None,   # None: default template (see get_template)
+    'verify': False,
     'clean_data_after_run': True,
     'serial_length': 3,
+    'jobs': None,   # None: depending on the number of cpus
+    'memory_budget': None,  # None: all pictures in memory
+    'cache_file': None,
+    'cache_max_entries': 1000000,
+    'profile': False,
+    'duplicate_action': 'number',
+    'target_root': None,    # None: rename in place
+    'transfer': 'move',
+    'duplicate_marker': 'DUPLICATE',
+    'duplicate_dir': 'duplicates',
     'camera_rename_csv_file': os.path.join(os.path.dirname(__file__), "camera-model-rename.csv"),
     'zero_value_ersatz': 'x',
     'unwanted_character_ersatz': '-',
@@ -82,316 +114,367 @@ __CONF = {
 }
 
 
-def set_raw_extensions(ext_set: set):
-    """this set of extension we use to recognize raw files
-    (please don't forget the delimiter)
-    HINT: use only if neccessary, the default is rather inclusive
-    """
-    __CONF['raw_extensions'] = ext_set
-
-
-def get_raw_extensions():
-    """get set of extension to recognize input raw files
-    (should include the delimiter (.)"""
-    return __CONF['raw_extensions']
-
-
-def set_jpg_input_extensions(ext_set: set):
-    """this set of extension we use to recognize JPEG files
-    (please don't forget the delimiter)"""
-    __CONF['jpg_input_extensions'] = ext_set
-
-
-def get_jpg_input_extensions():
-    """get set of extension to recognize input JGEG files
-    (should include the delimiter (.)"""
-    return __CONF['jpg_input_extensions']
-
-
-def set_jpg_out_extension(ext: str = ".jpg"):
-    """this extension we use as output for JPEG files
-    please don't forget the delimiter (.)"""
-    __CONF['jpg_out_extension'] = ext
-
-
-def get_jpg_out_extension():
-    """get extension for output JGEG files
-    (should include the delimiter (.)"""
-    return __CONF['jpg_out_extension']
-
-
-def set_ooc_extension(ext: str = ".jpg"):
-    """additional extension to mark 'out of cam' pictures
-    comes before the jpg_out_extension
-    please don't forget the delimiter (.)"""
-    # we don't trust commandline-arguments, so we clean it ...
-    newext = re.sub(r'[^a-zA-Z0-9._-]+', '', ext.strip().lower())
-    __CONF['ooc_extension'] = newext
-
-
-def get_ooc_extension():
-    """additional extension to mark 'out of cam' pictures
-    comes before the jpg_out_extension
-    (should include the delimiter (.)"""
-    return __CONF['ooc_extension']
-
-
-def set_decimal_delimiter_ersatz(dds: str):
-    """which symbol should be used instead
-    of the decimal delimiter '.'
-    e.g. for aperture (blende)
-    (since a dot is not good in file names we use something else)"""
-    __CONF['decimal_delimiter_ersatz'] = dds
-
-
-def get_decimal_delimiter_ersatz():
-    """return substitution string for decimal delimiter"""
-    return __CONF['decimal_delimiter_ersatz']
-
-
-def set_unwanted_character_ersatz(ucs: str):
-    """if the lens is analog, the value for aperture or length might be zero
-    which string should be written instead?"""
-    __CONF['unwanted_character_ersatz'] = ucs
-
-
-def get_unwanted_character_ersatz():
-    """return substitution string for zero aperture or length values"""
-    return __CONF['unwanted_character_ersatz']
-
-
-def set_zero_value_ersatz(zvs: str):
-    """if the lens is analog, the value for aperture or length might be zero
-    which string should be written instead?"""
-    __CONF['zero_value_ersatz'] = zvs
-
-
-def get_zero_value_ersatz():
-    """return substitution string for zero aperture or length values"""
-    return __CONF['zero_value_ersatz']
-
-
-def set_camera_rename_csv_name(filename: str):
-    """set name for the 'camera-name-translation'"""
-    __CONF['camera_rename_csv_file'] = filename
-
-
-def get_camera_rename_csv_name():
-    """get name for the 'camera-name-translation'"""
-    return __CONF['camera_rename_csv_file']
-
-
-def set_serial_length(serial_length: int = 3):
-    """set the length of the serial number (to be included in the file name) """
-    __CONF['serial_length'] = serial_length
-
-
-def get_serial_length():
-    """get the length of the serial number (to be included in the file name) """
-    return __CONF['serial_length']
-
+DUPLICATE_ACTIONS = ('number', 'skip', 'mark', 'move')
+TRANSFER_MODES = ('move', 'copy', 'hardlink', 'reflink')
 
-def set_clean_data_after_run(__clean: bool = True):
-    """for tests we wan't to analyze the dict,
-    but if used as a module, it needs to be cleaned up"""
-    __CONF['clean_data_after_run'] = __clean
-
-
-def do_clean_data_after_run():
-    """for tests we wan't to analyze the dict,
-    but if used as a module, it needs to be cleaned up"""
-    return __CONF['clean_data_after_run']
-
-
-def set_use_date_dir(_use_date_dir: bool = True):
-    """write files to separate directory?"""
-    __CONF['date_dir'] = _use_date_dir
-
-
-def use_date_dir():
-    """write files to separate directory?"""
-    return __CONF['date_dir']
-
-
-def set_verbose(verbose: bool = True):
-    """set verbosity (bool)"""
-    __CONF['verbose'] = verbose
-
-
-def is_verbose():
-    """get verbosity (bool)"""
-    return __CONF['verbose']
 
+def verboseprint(*msg):
+    """print verbose messages"""
+    for message in msg:
+        logging.info(str(message))
 
-def set_debug(debug: bool = True):
-    """set debug (bool)"""
-    __CONF['debug'] = debug
 
+def errorprint(*args):
+    """print error messages"""
+    for argument in args:
+        logging.error(str(argument))
 
-def is_debug():
-    """get debug status (bool)"""
-    return __CONF['debug']
 
+# exif tags we need, tag id -> tag name (names as in PIL.ExifTags.TAGS)
+EXIF_TAGS = {
+    0x0110: 'Model',
+    0x829A: 'ExposureTime',
+    0x829D: 'FNumber',
+    0x8827: 'ISOSpeedRatings',
+    0x9003: 'DateTimeOriginal',
+    0x920A: 'FocalLength',
+    0x9291: 'SubsecTimeOriginal',
+    0xA431: 'BodySerialNumber',
+    0xA434: 'LensModel',
+}
+_EXIF_IFD_POINTER = 0x8769
+# tiff field type -> (struct format character, size in bytes)
+_TIFF_TYPES = {
+    1: ('B', 1),    # BYTE
+    2: ('s', 1),    # ASCII
+    3: ('H', 2),    # SHORT
+    4: ('L', 4),    # LONG
+    5: ('L', 8),    # RATIONAL (two LONG)
+    6: ('b', 1),    # SBYTE
+    7: ('s', 1),    # UNDEFINED
+    8: ('h', 2),    # SSHORT
+    9: ('l', 4),    # SLONG
+    10: ('l', 8),   # SRATIONAL (two SLONG)
+}
+# the APP1 segment length is a 16 bit value, so exif data can't be larger
+_JPEG_MAX_SEGMENT = 0xFFFF
+
+
+def _tiff_value(buf, base, endian, entry_pos):
+    """read the value of one tiff ifd entry
+    (values up to 4 bytes are stored in the entry itself, bigger ones at an offset)"""
+    field_type, count = struct.unpack_from(endian + 'HL', buf, entry_pos + 2)
+    value_offset_pos = entry_pos + 8
+    fmt, size = _TIFF_TYPES[field_type]
+    if size * count > 4:
+        pos = base + struct.unpack_from(endian + 'L', buf, value_offset_pos)[0]
+    else:
+        pos = value_offset_pos
+    if pos + size * count > len(buf):
+        raise ValueError("tiff value outside of exif data")
+
+    if fmt == 's':
+        raw = bytes(buf[pos:pos + count])
+        if field_type == 7:
+            return raw
+        # like Pillow: ascii ends at the first NUL
+        return raw.split(b'\0', 1)[0].decode('latin-1', 'replace')
+
+    if field_type in (5, 10):
+        values = struct.unpack_from(f"{endian}{2 * count}{fmt}", buf, pos)
+        values = tuple(zip(values[::2], values[1::2]))
+    else:
+        values = struct.unpack_from(f"{endian}{count}{fmt}", buf, pos)
+    if count == 1:
+        return values[0]
+    return values
+
+
+def _read_tiff_ifd(buf, base, endian, ifd_offset, wanted):
+    """read the wanted tags of one ifd,
+    return them (dict) and the offset of the exif sub ifd (or None)"""
+    pos = base + ifd_offset
+    entries = struct.unpack_from(endian + 'H', buf, pos)[0]
+    exif = {}
+    sub_ifd = None
+    for entry in range(entries):
+        entry_pos = pos + 2 + entry * 12
+        tag, field_type = struct.unpack_from(endian + 'HH', buf, entry_pos)
+        if tag == _EXIF_IFD_POINTER:
+            sub_ifd = struct.unpack_from(endian + 'L', buf, entry_pos + 8)[0]
+        elif tag in wanted and field_type in _TIFF_TYPES:
+            exif[wanted[tag]] = _tiff_value(buf, base, endian, entry_pos)
+    return exif, sub_ifd
+
+
+def parse_tiff_exif(buf, base=0, wanted=None):
+    """parse exif tags from a tiff structure (starting at base in buf)
+    only IFD0 and the exif sub ifd are read, wanted is a dict tag id -> tag name
+    returns a dict tag name -> value, rationals are (numerator, denominator) tuples"""
+    if wanted is None:
+        wanted = EXIF_TAGS
+    byte_order = bytes(buf[base:base + 2])
+    if byte_order == b'II':
+        endian = '<'
+    elif byte_order == b'MM':
+        endian = '>'
+    else:
+        raise ValueError("no tiff header")
+    ifd_offset = struct.unpack_from(endian + 'L', buf, base + 4)[0]
+
+    exif, sub_ifd = _read_tiff_ifd(buf, base, endian, ifd_offset, wanted)
+    if sub_ifd and len(exif) < len(wanted):
+        exif.update(_read_tiff_ifd(buf, base, endian, sub_ifd, wanted)[0])
+    return exif
+
+
+def read_jpeg_exif(filepath, wanted=None):
+    """read exif tags from a JPEG file without decoding the picture
+    only the APP1 segment is read, the scan ends at the first image data
+    returns a dict tag name -> value or None if there is no exif segment"""
+    with open(filepath, 'rb') as jpeg:
+        return _scan_jpeg_exif(jpeg, wanted)
+
+
+def _scan_jpeg_exif(jpeg, wanted):
+    """read exif tags from an open JPEG file (see read_jpeg_exif)"""
+    if jpeg.read(2) != b'\xff\xd8':
+        return None
+    while True:
+        marker = jpeg.read(2)
+        while marker[:1] == b'\xff' and marker[1:] == b'\xff':
+            # fill bytes
+            marker = marker[1:] + jpeg.read(1)
+        if len(marker) < 2 or marker[0] != 0xFF or marker[1] in (0xD9, 0xDA):
+            # end of file, end of image or start of scan (image data)
+            return None
+        length_bytes = jpeg.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length = struct.unpack('>H', length_bytes)[0] - 2
+        if marker[1] == 0xE1:
+            segment = jpeg.read(min(length, _JPEG_MAX_SEGMENT))
+            if segment[:6] == b'Exif\0\0':
+                return parse_tiff_exif(segment, 6, wanted)
+        else:
+            jpeg.seek(length, os.SEEK_CUR)
 
-def set_silent(silent: bool = True):
-    """set silence (bool)"""
-    __CONF['silent'] = silent
 
+# tiff based raw files: plain tiff (NEF, ARW, CR2, DNG, PEF, ...),
+# olympus ORF and panasonic RW2 use own magic numbers
+_TIFF_MAGICS = (b'II*\0', b'MM\0*', b'IIRO', b'IIRS', b'MMOR', b'IIU\0')
 
-def is_silent():
-    """get silence (bool)"""
-    return __CONF['silent']
 
+def read_tiff_exif(filepath, wanted=None):
+    """read exif tags from a tiff based raw file without reading the picture
+    returns a dict tag name -> value or None if the file is not tiff based"""
+    with open(filepath, 'rb') as raw:
+        return _map_tiff_exif(raw, wanted)
 
-def set_dry_run(dry_run: bool = True):
-    """set dry-run (simulation-mode status)"""
-    __CONF['dry_run'] = dry_run
 
+def _map_tiff_exif(raw, wanted):
+    """read exif tags from an open tiff based raw file (see read_tiff_exif),
+    the file is memory mapped, so only the pages of the ifds are read from disk"""
+    if raw.read(4) not in _TIFF_MAGICS:
+        return None
+    with mmap.mmap(raw.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        return parse_tiff_exif(buf, 0, wanted)
 
-def is_dry_run():
-    """get dry-run (simulation-mode status)"""
-    return __CONF['dry_run']
 
+# the formats Pillow has to open (the fallback reads exif data of JPEG files)
+_PILLOW_FORMATS = ('JPEG', 'TIFF')
 
-def set_use_serial(bool_use_serial: bool = True):
-    """include a serial number"""
-    __CONF['use_serial'] = bool_use_serial
 
+@functools.lru_cache(maxsize=None)
+def _pillow():
+    """import Pillow when it is needed the first time (it isn't for --help, --version,
+    plans, raw files, ...), only with the plugins of _PILLOW_FORMATS
+    (PIL.Image.open gets formats=_PILLOW_FORMATS, so it needs no others)
+    returns PIL.Image and PIL.ExifTags.TAGS"""
+    # pylint: disable=import-outside-toplevel
+    import PIL.Image
+    import PIL.ExifTags
+    import PIL.JpegImagePlugin
+    import PIL.TiffImagePlugin
+    return PIL.Image, PIL.ExifTags.TAGS
 
-def use_serial():
-    """should we include serial number?"""
-    return __CONF['use_serial']
 
+# stands for the serial number in new basenames until the serial is known,
+# it can't be part of a file name (see _picdict_set_serial_once)
+_SERIAL_MARK = '\x00'
 
-def set_use_duplicate(bool_use_duplicate: bool = True):
-    """include a duplicate number if the same timestamp occurs"""
-    __CONF['use_duplicate'] = bool_use_duplicate
+# settings of a renamer the formatters depend on (part of their cache keys)
+_FormatSettings = collections.namedtuple('_FormatSettings', (
+    'zero_value_ersatz', 'unwanted_character_ersatz',
+    'decimal_delimiter_ersatz', 'camera_rename_csv_file', 'camera_rename_csv_signature'))
 
 
-def use_duplicate():
-    """should we include a duplicate number?"""
-    return __CONF['use_duplicate']
+def _field_camera(exif, _parsed, settings):
+    """template field {camera}"""
+    return _format_camera_name(
+        exif['Model'], settings.unwanted_character_ersatz, settings.camera_rename_csv_file,
+        settings.camera_rename_csv_signature)
 
 
-def set_use_ooc(_use_ooc: bool = True):
-    """set use of ooc extension"""
-    __CONF['ooc'] = _use_ooc
+def _field_focal(exif, _parsed, settings):
+    """template field {focal}"""
+    return _format_focal_length(*_rational(exif['FocalLength']), settings.zero_value_ersatz)
 
 
-def use_ooc():
-    """get use of ooc extension"""
-    return __CONF['ooc']
+def _field_aperture(exif, _parsed, settings):
+    """template field {aperture}"""
+    return _format_aperture(*_rational(exif['FNumber']), settings.zero_value_ersatz,
+                            settings.decimal_delimiter_ersatz)
 
 
-def set_short_names(short_names: bool = True):
-    """use short names (without camera exif)"""
-    __CONF['short_names'] = short_names
+def _field_exposure(exif, _parsed, _settings):
+    """template field {exposure}"""
+    return _format_exposuretime(*_rational(exif['ExposureTime']))
 
 
-def use_short_names():
-    """get usage of short names (without camera exif)"""
-    return __CONF['short_names']
+def _field_optional(tag):
+    """formatter for a name tag many cameras don't write (zero value ersatz if missing)"""
+    def field(exif, _parsed, settings):
+        if tag in exif:
+            return _format_name(exif[tag], settings.unwanted_character_ersatz)
+        return settings.zero_value_ersatz
+    return field
 
 
-def export_pic_dict():
-    """for tests"""
-    return copy.deepcopy(__PIC_DICT)
+# template fields: name -> (exif tag ids,
+#                           formatter of (exif dict, parsed DateTimeOriginal, format settings))
+TEMPLATE_FIELDS = {
+    'datetime': ((), lambda exif, parsed, settings: parsed[0]),
+    'date': ((), lambda exif, parsed, settings: parsed[1]),
+    'serial': ((), lambda exif, parsed, settings: _SERIAL_MARK),
+    'camera': ((0x0110,), _field_camera),
+    'focal': ((0x920A,), _field_focal),
+    'aperture': ((0x829D,), _field_aperture),
+    'exposure': ((0x829A,), _field_exposure),
+    'iso': ((0x8827,), lambda exif, parsed, settings: exif['ISOSpeedRatings']),
+    'lens': ((0xA434,), _field_optional('LensModel')),
+    'subsec': ((0x9291,), _field_optional('SubsecTimeOriginal')),
+    'body_serial': ((0xA431,), _field_optional('BodySerialNumber')),
+}
 
 
-def verboseprint(*msg):
-    """print verbose messages"""
-    for message in msg:
-        logging.info(str(message))
+# regular expressions of the template fields in new names,
+# fields which are not listed here match anything (see _name_pattern)
+_FIELD_PATTERNS = {
+    'datetime': r'\d{8}_\d{6}',
+    'date': r'\d{4}-\d{2}-\d{2}',
+    'serial': r'\d+',
+    'iso': r'\d+',
+}
 
 
-def errorprint(*args):
-    """print error messages"""
-    for argument in args:
-        logging.error(str(argument))
+@functools.lru_cache(maxsize=16)
+def _name_pattern(template, with_serial, suffix):
+    """regular expression of new basenames made with template
+    (followed by suffix, e.g. the duplicate number),
+    datetime, serial and duplicate are named groups"""
+    parts = []
+    named = set()
+    for literal, field, _format_spec, _conversion in string.Formatter().parse(template):
+        parts.append(re.escape(literal))
+        if field is None or (field == 'serial' and not with_serial):
+            continue
+        if field in named:
+            parts.append(f"(?P={field})")
+        elif field in ('datetime', 'serial'):
+            named.add(field)
+            parts.append(f"(?P<{field}>{_FIELD_PATTERNS[field]})")
+        else:
+            parts.append(_FIELD_PATTERNS.get(field, r'[^/]+?'))
+    return re.compile(''.join(parts) + suffix)
+
+
+@functools.lru_cache(maxsize=16)
+def compile_template(template):
+    """compile a template for new file names (once per template)
+    returns (format string, field formatters, wanted exif tags)
+    raises ValueError for unknown fields and path separators"""
+    if _SERIAL_MARK in template:
+        raise ValueError("template contains a NUL character")
+    if '/' in template or os.sep in template or (os.altsep and os.altsep in template):
+        raise ValueError("template contains a path separator (use --datedir for directories)")
+    format_parts = []
+    formatters = []
+    wanted = {0x9003: EXIF_TAGS[0x9003]}    # DateTimeOriginal is always needed
+    for literal, field, format_spec, conversion in string.Formatter().parse(template):
+        format_parts.append(literal.replace('{', '{{').replace('}', '}}'))
+        if field is None:
+            continue
+        if field not in TEMPLATE_FIELDS or format_spec or conversion:
+            raise ValueError(
+                f"unknown template field {{{field}}}, use one of {tuple(TEMPLATE_FIELDS)}")
+        tags, formatter = TEMPLATE_FIELDS[field]
+        format_parts.append(f"{{{len(formatters)}}}")
+        formatters.append(formatter)
+        wanted.update((tag, EXIF_TAGS[tag]) for tag in tags)
+    return ''.join(format_parts), tuple(formatters), wanted
 
 
-def __create_new_basename(img):
-    """create a new filename based on exif data"""
-    # fetch tagging from https://stackoverflow.com/a/4765242
-    try:
-        exif = {
-            PIL.ExifTags.TAGS[k]: v
-            for k, v in img._getexif().items()  # pylint: disable=protected-access
-            if k in PIL.ExifTags.TAGS
-        }
-    except AttributeError:
-        if is_verbose():
-            errorprint('NO exif info in ' + img.filename)
-        return None, None, None
+# the formatters are called with the same values again and again
+# (one camera, few lenses, few exposure settings), so they are cached
+# (shared by all renamers), the settings are part of the cache key
+_FORMAT_CACHE_SIZE = 4096
 
-    try:
-        _datetime = format_datetime(exif['DateTimeOriginal'])
-        _date = format_date(exif['DateTimeOriginal'])
-        if not use_short_names():
-            _aperture = __format_aperture_tuple(exif['FNumber'])
-            _exposure_time = __format_exposuretime_tuple(exif['ExposureTime'])
-            _focal_len = __format_focal_length_tuple(exif['FocalLength'])
-            _camera = __format_camera_name(exif['Model'])
-            _iso = exif['ISOSpeedRatings']
-    except KeyError as err:
-        if is_verbose():
-            errorprint('(Some) exif tags missing in ' + img.filename, err)
-        return None, None, None
-
-    if not use_short_names():
-        _new_basename = f"{_datetime}{{}}__{_camera}__{_focal_len}" + \
-            f"__{_aperture}__t{_exposure_time}__iso{_iso}"
-    else:
-        _new_basename = f"{_datetime}{{}}"
 
-    return _datetime, _new_basename, _date
+def _rational(value):
+    """(numerator, divisor) of an exif rational
+    new pillow might not return tuple, so check first"""
+    if isinstance(value, tuple):
+        return value[0], value[1]
+    return value.numerator, value.denominator
 
 
-def __format_camera_name(_name):
+@functools.lru_cache(maxsize=_FORMAT_CACHE_SIZE)
+def _format_camera_name(_name, unwanted_character_ersatz, csv_file, csv_signature):
     """format camera name - substitute unwanted characters, lower case
-    if available, read translations for camera models from csv and apply them """
-    _newname = re.sub(r'[^a-zA-Z0-9]+', get_unwanted_character_ersatz(), _name.strip().lower())
-    __read_camera_rename_csv()
+    if available, read translations for camera models from csv and apply them
+    (csv_signature: see _camera_rules)"""
+    _newname = re.sub(r'[^a-zA-Z0-9]+', unwanted_character_ersatz, _name.strip().lower())
+
+    names, matcher, patterns, _error = _camera_rules(csv_file, csv_signature)
+    if _newname in names:
+        return names[_newname]
 
-    if _newname in __CAMERADICT:
-        return __CAMERADICT[_newname]
+    if matcher:
+        match = matcher.fullmatch(_newname)
+        if match:
+            return patterns[match.lastgroup]
 
     return _newname
 
 
-def __format_aperture_tuple(_ap):
-    """format aperture tuple to short printable string
-    new pillow might not return tuple, so check first"""
+@functools.lru_cache(maxsize=_FORMAT_CACHE_SIZE)
+def _format_name(_name, unwanted_character_ersatz):
+    """format other names (lens, serial numbers) - substitute unwanted characters, lower case"""
+    return re.sub(r'[^a-z0-9]+', unwanted_character_ersatz,
+                  str(_name).strip('\x00 ').lower()).strip(unwanted_character_ersatz)
 
-    if isinstance(_ap, tuple):
-        numerator = _ap[0]  # numerator = zaehler
-        divisor = _ap[1]    # divisor = nenner
-    else:
-        numerator = _ap.numerator
-        divisor = _ap.denominator
 
+@functools.lru_cache(maxsize=_FORMAT_CACHE_SIZE)
+def _format_aperture(numerator, divisor, zero_value_ersatz, decimal_delimiter_ersatz):
+    """format aperture (FNumber) to short printable string
+    numerator = zaehler, divisor = nenner"""
     if numerator == 0:
-        return get_zero_value_ersatz()
+        return zero_value_ersatz
     if numerator % divisor == 0:
         return "f" + str(numerator // divisor)
     # else:
-    return "f" + str(numerator / divisor).replace('.', get_decimal_delimiter_ersatz())
+    return "f" + str(numerator / divisor).replace('.', decimal_delimiter_ersatz)
 
 
-def __format_focal_length_tuple(_tuple):
-    """format FocalLenght tuple to short printable string
+@functools.lru_cache(maxsize=_FORMAT_CACHE_SIZE)
+def _format_focal_length(numerator, divisor, zero_value_ersatz):
+    """format FocalLenght to short printable string
     we ignore the position after the decimal point
     because it is usually not very essential for focal length
     """
-    if isinstance(_tuple, tuple):
-        numerator = _tuple[0]
-        divisor = _tuple[1]
-    else:
-        numerator = _tuple.numerator
-        divisor = _tuple.denominator
-
     if numerator == 0:
-        return get_zero_value_ersatz()
+        return zero_value_ersatz
 
     if numerator % 10 == 0 and divisor % 10 == 0:
         # example: change 110/10  -> 11
@@ -409,19 +492,14 @@ def __format_focal_length_tuple(_tuple):
     return _string
 
 
-def __format_exposuretime_tuple(_time):
-    """format ExposureTime tuple to short printable string
+@functools.lru_cache(maxsize=_FORMAT_CACHE_SIZE)
+def _format_exposuretime(numerator, divisor):
+    """format ExposureTime to short printable string
     fractions over or equal 1 second are marked with s, e.g. 8s
     fractions below 1 second are broken down to the divisor,
     this is a bit incorrect but short and common e.g. in cameras
     (and we want to have a short string)
     """
-    if isinstance(_time, tuple):
-        numerator = _time[0]
-        divisor = _time[1]
-    else:
-        numerator = _time.numerator
-        divisor = _time.denominator
     if numerator % 10 == 0 and divisor % 10 == 0:
         # change 10/1250 to 1/125
         numerator = numerator // 10
@@ -437,6 +515,56 @@ def __format_exposuretime_tuple(_time):
     return _string
 
 
+# fallback formats for time.strptime (not zero padded fields, no seconds)
+_EXIF_DATETIME_FORMATS = ("%Y:%m:%d %H:%M:%S", "%Y:%m:%d %H:%M")
+
+
+def _days_in_month(year, month):
+    """number of days of a month (like calendar.monthrange, without importing calendar)"""
+    if month == 2:
+        return 29 if year % 4 == 0 and (year % 100 != 0 or year % 400 == 0) else 28
+    return 30 if month in (4, 6, 9, 11) else 31
+
+
+def parse_exif_datetime(_datetime):
+    """parse exif date time string (YYYY:MM:DD HH:MM:SS) in one pass
+    returns (YYYYmmdd_HHMMSS, YYYY-mm-dd),
+    None if the camera did not set the date (0000:00:00 00:00:00 or empty),
+    raises ValueError if the string is no valid date
+
+    the fixed width layout is checked and sliced directly, everything else
+    (e.g. fields which are not zero padded) goes through time.strptime,
+    trailing NULs / blanks are removed, missing seconds count as 00"""
+    _datetime = _datetime.replace('\x00', '').strip()
+    if len(_datetime) == 16 and _datetime[10] == ' ' and _datetime[13] == ':':
+        # no seconds
+        _datetime += ':00'
+    if not _datetime.strip(': 0'):
+        return None
+
+    if len(_datetime) == 19 and _datetime[4:17:3] == ':: ::':
+        year, month, day = _datetime[0:4], _datetime[5:7], _datetime[8:10]
+        hour, minute, second = _datetime[11:13], _datetime[14:16], _datetime[17:19]
+        digits = year + month + day + hour + minute + second
+        if digits.isdigit() and digits.isascii():
+            _month, _day = int(month), int(day)
+            if (not 0 < _month <= 12 or not 0 < _day <= 31
+                    or (_day > 28 and _day > _days_in_month(int(year), _month))):
+                raise ValueError(f"date out of range: {_datetime!r}")
+            if int(hour) > 23 or int(minute) > 59 or int(second) > 61:
+                raise ValueError(f"time out of range: {_datetime!r}")
+            return f"{year}{month}{day}_{hour}{minute}{second}", f"{year}-{month}-{day}"
+
+    for _format in _EXIF_DATETIME_FORMATS:
+        try:
+            _time_struct = time.strptime(_datetime, _format)
+        except ValueError:
+            continue
+        return (time.strftime("%Y%m%d_%H%M%S", _time_struct),
+                time.strftime("%Y-%m-%d", _time_struct))
+    raise ValueError(f"no exif date time: {_datetime!r}")
+
+
 def format_datetime(_datetime):
     """format time string -> YYYYmmdd_HHMMSS"""
     _time_struct = time.strptime(_datetime, "%Y:%m:%d %H:%M:%S")
@@ -449,19 +577,52 @@ def format_date(_datetime):
     return time.strftime("%Y-%m-%d", _time_struct)
 
 
-def __read_camera_rename_csv():
-    """read the model translate csv - if available (only once)"""
-    if __CAMERADICT:
-        # we've read the csv already
-        return
+@functools.lru_cache(maxsize=16)
+def _camera_rules(csv_file, _csv_signature):
+    """read the model translate csv - if available (only once per csv file
+    and signature (see _file_signature, an edited csv is read again),
+    also if it is not there, shared by all renamers)
+    returns (names, matcher, patterns, error message or None)
+
+    rows are: cleaned camera name,new name
+    rows starting with # are comments,
+    rows with re:regular expression,new name are pattern rules,
+    they are used if no name matches exactly"""
+    names = {}          # cleaned camera name -> new name
+    patterns = {}       # regex group name -> new name
+    pattern_rules = []
+    error = None
+    try:
+        with open(csv_file, encoding="utf-8") as csvfile:
+            for row in csv.reader(csvfile, delimiter=','):
+                if len(row) < 2 or row[0].lstrip().startswith('#'):
+                    continue
+                if row[0].startswith('re:'):
+                    group = f"rule{len(patterns)}"
+                    pattern_rules.append(f"(?P<{group}>{row[0][3:]})")
+                    patterns[group] = row[1]
+                else:
+                    names[row[0]] = row[1]
+    except OSError:
+        error = f"camera translation csv not found: {csv_file}"
+
+    # all pattern rules compiled into one regex
+    matcher = None
+    if pattern_rules:
+        try:
+            matcher = re.compile('|'.join(pattern_rules))
+        except re.error as err:
+            error = f"wrong pattern in camera translation csv {csv_file}: {err}"
+    return names, matcher, patterns, error
+
+
+def _file_signature(filename):
+    """size and mtime of a file (changes if the file is edited), None if it isn't there"""
     try:
-        with open(get_camera_rename_csv_name(), encoding="utf-8") as csvfile:
-            camera_model_translate = csv.reader(csvfile, delimiter=',')
-            for row in camera_model_translate:
-                __CAMERADICT[row[0]] = row[1]
+        stat = os.stat(filename)
     except OSError:
-        if is_verbose():
-            verboseprint("camera translation csv not found: ", get_camera_rename_csv_name())
+        return None
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
 
 
 def splitext_all(_filename):
@@ -472,94 +633,2183 @@ def splitext_all(_filename):
     return (_name, "." + _extensions)
 
 
-def __picdict_set_serial_once(_pic, _serial, _serial_length):
-    """set serial number in a global __PIC_DICT dictionary entry (if not set yet or if empty)"""
-    # make a string out of "_serial", fill it up with 0 up to _serial_length
-    # include it into the new file base name
+class FileRecord:  # pylint: disable=too-many-instance-attributes,too-few-public-methods
+    """record of one file in the picture store (a picture, its raw file or another associated file)
+
+    with __slots__ and shared (interned) directory names, dates and extensions
+    the store needs about 40% less memory than with a dict per file
+    (10000 pictures with raw files, including keys and indexes:
+    1812 -> 1054 bytes per picture)"""
+
+    __slots__ = (
+        'kind',             # 'jpg', 'raw' or 'sidecar'
+        'timestamp', 'duplicate', 'date', 'serial',
+        'orig_dirname', 'orig_basename', 'orig_extension',
+        'new_dirname', 'new_basename', 'new_extension',
+        'duplicate_of',     # key of the picture with the same content
+    )
+
+    def __init__(self, kind, orig_dirname, orig_basename, orig_extension, **fields):
+        self.kind = kind
+        self.orig_dirname = sys.intern(orig_dirname)
+        self.orig_basename = orig_basename
+        self.orig_extension = sys.intern(orig_extension)
+        for field in self.__slots__[1:]:
+            if not hasattr(self, field):
+                setattr(self, field, fields.pop(field, None))
+        if fields:
+            raise TypeError(f"unknown file record fields: {', '.join(fields)}")
+
+    def as_dict(self):
+        """the record as dictionary (like the records in the picture store used to be)"""
+        return {
+            field: getattr(self, field)
+            for field in self.__slots__[1:]
+            if getattr(self, field) is not None
+        }
+
+
+def iter_files_from(filename: str):
+    """yield the file names listed in file filename ('-' for stdin),
+    the names are separated by NUL (like find -print0) or by newlines"""
+    if filename == '-':
+        stream = sys.stdin.buffer
+    else:
+        stream = open(filename, 'rb')  # pylint: disable=consider-using-with
+    try:
+        delimiter = None
+        rest = b''
+        for chunk in iter(lambda: stream.read(65536), b''):
+            rest += chunk
+            if delimiter is None:
+                delimiter = b'\0' if b'\0' in rest else b'\n'
+            *names, rest = rest.split(delimiter)
+            for name in names:
+                if delimiter == b'\n':
+                    name = name.rstrip(b'\r')
+                if name:
+                    yield os.fsdecode(name)
+        if delimiter == b'\n':
+            rest = rest.rstrip(b'\r')
+        if rest:
+            yield os.fsdecode(rest)
+    finally:
+        if stream is not sys.stdin.buffer:
+            stream.close()
+
+
+def _map_in_order(func, iterable, jobs):
+    """yield (item, func(item)) for every item in iterable,
+    func runs in a pool of jobs worker threads, results are yielded in
+    input order, only a bounded number of items is fetched ahead from iterable"""
+    if jobs <= 1:
+        for item in iterable:
+            yield item, func(item)
+        return
+
+    import concurrent.futures  # pylint: disable=import-outside-toplevel
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = collections.deque()
+        for item in iterable:
+            pending.append((item, executor.submit(func, item)))
+            if len(pending) >= jobs * 4:
+                item, future = pending.popleft()
+                yield item, future.result()
+        while pending:
+            item, future = pending.popleft()
+            yield item, future.result()
+
+
+# inotify events of new or changed files (linux/inotify.h)
+_IN_MODIFY = 0x2
+_IN_CLOSE_WRITE = 0x8
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_Q_OVERFLOW = 0x4000
+_INOTIFY_EVENT = struct.Struct('iIII')  # wd, mask, cookie, len (of the name)
+
+
+def _scan_files(directory):
+    """file names in directory -> (size, mtime), directories are left out"""
+    files = {}
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            try:
+                if entry.is_file(follow_symlinks=False):
+                    stat = entry.stat(follow_symlinks=False)
+                    files[entry.name] = (stat.st_size, stat.st_mtime_ns)
+            except OSError:
+                # gone since the scan
+                continue
+    return files
+
+
+class _ScandirWatcher:
+    """new or changed files in a directory: difference of two scans"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._files = None
+
+    def changes(self, timeout):
+        """names of the files which are new or changed since the last call
+        (all files at the first call), waits timeout seconds"""
+        if self._files is not None:
+            time.sleep(timeout)
+        files = _scan_files(self.directory)
+        old_files = self._files or {}
+        self._files = files
+        return [name for name, signature in files.items() if old_files.get(name) != signature]
+
+    def close(self):
+        """nothing to clean up"""
+
+
+class _InotifyWatcher:
+    """new or changed files in a directory: linux inotify (through ctypes),
+    raises OSError if inotify can't be used"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._first = True
+        import ctypes  # pylint: disable=import-outside-toplevel
+        libc = ctypes.CDLL(None, use_errno=True)
+        self._fd = libc.inotify_init()
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init failed")
+        if libc.inotify_add_watch(
+                self._fd, os.fsencode(directory),
+                _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE) < 0:
+            errno_value = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno_value, f"inotify_add_watch failed for {directory}")
+
+    def changes(self, timeout):
+        """names of the files which are new or changed since the last call
+        (all files at the first call), waits up to timeout seconds for events"""
+        if self._first:
+            self._first = False
+            return list(_scan_files(self.directory))
+        if not select.select([self._fd], [], [], timeout)[0]:
+            return []
+        buf = os.read(self._fd, 64 * 1024)
+        names = set()
+        pos = 0
+        while pos < len(buf):
+            _, mask, _, length = _INOTIFY_EVENT.unpack_from(buf, pos)
+            pos += _INOTIFY_EVENT.size
+            if mask & _IN_Q_OVERFLOW:
+                # events are lost, look at all files
+                return list(_scan_files(self.directory))
+            if length:
+                names.add(os.fsdecode(buf[pos:pos + length].rstrip(b'\0')))
+            pos += length
+        return list(names)
+
+    def close(self):
+        """stop watching"""
+        os.close(self._fd)
+
+
+def _directory_watcher(directory):
+    """watcher of new or changed files in directory:
+    inotify on linux, scans of the directory otherwise"""
+    if sys.platform.startswith('linux'):
+        try:
+            return _InotifyWatcher(directory)
+        except (OSError, AttributeError):
+            # no inotify (AttributeError: no such function in the libc)
+            pass
+    return _ScandirWatcher(directory)
+
+
+# content hashes: only the first and last part of a file are compared first,
+# the whole file only if these are the same
+_HASH_PART_SIZE = 64 * 1024
+_HASH_BUFFER_SIZE = 1024 * 1024
+
+
+def _record_paths(record):
+    """(old path, new path) of a file record"""
+    return (f"{record.orig_dirname}/{record.orig_basename}{record.orig_extension}",
+            f"{record.new_dirname}/{record.new_basename}{record.new_extension}")
+
+
+# copies: buffer size if the kernel can't copy, ioctl to share the data blocks
+# of a file on btrfs, xfs, ... (FICLONE of linux/fs.h)
+_COPY_BUFFER_SIZE = 1024 * 1024
+_FICLONE = 0x40049409
+# errors of copy_file_range and sendfile if they can't copy these files
+_NO_KERNEL_COPY = (errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EBADF,
+                   errno.ENOTSUP, errno.EOPNOTSUPP, errno.ENOTSOCK)
+
+
+def _copy_data(src_fd, dst_fd, size):
+    """copy size bytes from src_fd to dst_fd (both at position 0)
+    in the kernel if possible (copy_file_range, sendfile), else with a large buffer
+    returns the number of copied bytes"""
+    copied = 0
+    kernel_copies = []
+    if hasattr(os, 'copy_file_range'):
+        kernel_copies.append(os.copy_file_range)
+    if hasattr(os, 'sendfile'):
+        kernel_copies.append(lambda src, dst, count: os.sendfile(dst, src, copied, count))
+    for kernel_copy in kernel_copies:
+        try:
+            while copied < size:
+                sent = kernel_copy(src_fd, dst_fd, size - copied)
+                if not sent:
+                    break
+                copied += sent
+        except OSError as err:
+            if copied or err.errno not in _NO_KERNEL_COPY:
+                raise
+            continue
+        if copied >= size:
+            return copied
+        # the kernel copy ended early (some file systems report 0 bytes),
+        # the buffer copies the rest
+        os.lseek(src_fd, copied, os.SEEK_SET)
+        os.lseek(dst_fd, copied, os.SEEK_SET)
+        break
+
+    while True:
+        buf = os.read(src_fd, _COPY_BUFFER_SIZE)
+        if not buf:
+            return copied
+        view = memoryview(buf)
+        while view:
+            view = view[os.write(dst_fd, view):]
+        copied += len(buf)
+
+
+def _reflink(src_fd, dst_fd):
+    """share the data blocks of src_fd with dst_fd (copy on write),
+    returns False if the file system (or the os) can't do it"""
+    if fcntl is None:
+        return False
     try:
-        _ = __PIC_DICT[_pic]['serial']
+        fcntl.ioctl(dst_fd, _FICLONE, src_fd)
+    except OSError:
         return False
-    except KeyError:
-        pass
+    return True
 
-    __PIC_DICT[_pic]['serial'] = _serial
-    if use_serial():
-        __PIC_DICT[_pic]['new_basename'] = \
-            __PIC_DICT[_pic]['new_basename'].format("__" + str(_serial).zfill(_serial_length))
+
+def copy_file(src, dst, reflink=False):
+    """copy file src to dst with its modification time and mode,
+    dst must not exist (it is never overwritten),
+    reflink: share the data blocks if the file system can, copy otherwise
+    returns the number of copied bytes (0 if the blocks are shared)
+    raises OSError (and removes dst) if fewer bytes than the size of src were copied"""
+    with open(src, 'rb') as source:
+        dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0),
+                         0o666)
+        try:
+            try:
+                if reflink and _reflink(source.fileno(), dst_fd):
+                    copied = 0
+                else:
+                    size = os.fstat(source.fileno()).st_size
+                    copied = _copy_data(source.fileno(), dst_fd, size)
+                    if copied < size:
+                        raise OSError(errno.EIO, f"short copy ({copied} of {size} bytes)", src)
+            finally:
+                os.close(dst_fd)
+            shutil.copystat(src, dst)
+        except BaseException:
+            os.unlink(dst)
+            raise
+    return copied
+
+
+def _split_groups(groups, value):
+    """split every group (list of keys) by value(key),
+    return the new groups with more than one key"""
+    new_groups = []
+    for group in groups:
+        buckets = {}
+        for key in group:
+            key_value = value(key)
+            if key_value is not None:
+                buckets.setdefault(key_value, []).append(key)
+        new_groups.extend(bucket for bucket in buckets.values() if len(bucket) > 1)
+    return new_groups
+
+
+# one planned rename (see Renamer.iter_plan),
+# kind is 'jpg', 'raw' or 'sidecar', serial and duplicate are the ones of the picture
+RenameOperation = collections.namedtuple(
+    'RenameOperation', ('old', 'new', 'kind', 'serial', 'duplicate'))
+
+
+def write_plan(operations, stream):
+    """write a rename plan (RenameOperation, e.g. from iter_plan()) to stream
+    as newline delimited JSON, one operation per line, as it comes in,
+    returns the number of written operations"""
+    number = 0
+    for number, operation in enumerate(operations, 1):
+        # ascii only: file names which are no valid utf-8 survive as escapes
+        stream.write(json.dumps(operation._asdict()) + '\n')
+    return number
+
+
+def read_plan(filename: str):
+    """yield the RenameOperations of a plan written by write_plan() ('-' for stdin),
+    relative paths (e.g. of a hand-edited plan) are made absolute
+    raises ValueError for lines which are no rename operation"""
+    if filename == '-':
+        stream = sys.stdin
     else:
-        __PIC_DICT[_pic]['new_basename'] = \
-            __PIC_DICT[_pic]['new_basename'].format("")
-    return True
+        stream = open(filename, encoding='utf-8')  # pylint: disable=consider-using-with
+    try:
+        for line_number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                operation = RenameOperation(**json.loads(line))
+            except (ValueError, TypeError) as err:
+                raise ValueError(f"{filename}:{line_number}: no rename operation: {err}") from err
+            if not isinstance(operation.old, str) or not isinstance(operation.new, str):
+                raise ValueError(f"{filename}:{line_number}: old and new have to be file names")
+            yield operation._replace(
+                old=os.path.abspath(operation.old), new=os.path.abspath(operation.new))
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+# with a memory budget only the indexes of the recently used directories are kept
+_DIR_INDEX_CACHE_SIZE = 64
+
 
+class Renamer:  # pylint: disable=too-many-public-methods,too-many-instance-attributes
+    """renames pictures and associated files (raw, xmp, ...) based on exif data
 
-def __picdict_has_orig_filepath(filepath):
-    """search if this filename is already recorded in global __PIC_DICT"""
+    every renamer has its own settings, picture store and caches,
+    renamers can run in parallel threads (one run at a time per renamer),
+    the module level functions (set_verbose(), exipicrename(), ...) use a default renamer
+    """
 
-    _dir, _ = os.path.split(filepath)
-    _basename, _ext = os.path.splitext(_)
+    def __init__(self):
+        self._conf = dict(_DEFAULT_CONF)
+        self._lock = threading.RLock()  # one run at a time
+        self._pic_dict = {}             # main storage for file meta data
+        # (orig_dirname, orig_basename, orig_extension) of all records
+        self._orig_path_index = set()
+        # directory -> {basename: [(file name, is directory)]}, least recently used first
+        self._dir_indexes = collections.OrderedDict()
+        self._duplicate_counter = {}    # timestamp -> next free duplicate number
+        self._known_dirs = set()        # target directories which exist (or were created)
+        self._last_serial = 0           # highest serial of the pictures named already
+        self._spill = None              # sorted runs being written (with a memory budget)
+        self._camera_csv_signature = None   # of the current run (see _file_signature)
+        self._stats = {                 # timing and counters of the last run (see --profile)
+            'lock': threading.Lock(),
+            'phases': {},       # phase -> seconds
+            'counters': {},     # e.g. files_opened, stat_calls -> number
+        }
+        self._cache = {                 # persistent exif metadata cache (sqlite)
+            'db': None,
+            'lock': threading.Lock(),
+            'used': [],         # keys of entries used in this run (to update last_used)
+            'settings': None,   # _cache_settings() of this run
+            'stats': {'hits': 0, 'misses': 0, 'stale': 0, 'stored': 0, 'evictions': 0},
+        }
 
-    for filerecord in __PIC_DICT.values():
+    def set_raw_extensions(self, ext_set: set):
+        """this set of extension we use to recognize raw files
+        (please don't forget the delimiter)
+        HINT: use only if neccessary, the default is rather inclusive
+        """
+        self._conf['raw_extensions'] = ext_set
+
+    def get_raw_extensions(self):
+        """get set of extension to recognize input raw files
+        (should include the delimiter (.)"""
+        return self._conf['raw_extensions']
+
+    def set_jpg_input_extensions(self, ext_set: set):
+        """this set of extension we use to recognize JPEG files
+        (please don't forget the delimiter)"""
+        self._conf['jpg_input_extensions'] = ext_set
+
+    def get_jpg_input_extensions(self):
+        """get set of extension to recognize input JGEG files
+        (should include the delimiter (.)"""
+        return self._conf['jpg_input_extensions']
+
+    def set_jpg_out_extension(self, ext: str = ".jpg"):
+        """this extension we use as output for JPEG files
+        please don't forget the delimiter (.)"""
+        self._conf['jpg_out_extension'] = ext
+
+    def get_jpg_out_extension(self):
+        """get extension for output JGEG files
+        (should include the delimiter (.)"""
+        return self._conf['jpg_out_extension']
+
+    def set_ooc_extension(self, ext: str = ".jpg"):
+        """additional extension to mark 'out of cam' pictures
+        comes before the jpg_out_extension
+        please don't forget the delimiter (.)"""
+        # we don't trust commandline-arguments, so we clean it ...
+        newext = re.sub(r'[^a-zA-Z0-9._-]+', '', ext.strip().lower())
+        self._conf['ooc_extension'] = newext
+
+    def get_ooc_extension(self):
+        """additional extension to mark 'out of cam' pictures
+        comes before the jpg_out_extension
+        (should include the delimiter (.)"""
+        return self._conf['ooc_extension']
+
+    def set_decimal_delimiter_ersatz(self, dds: str):
+        """which symbol should be used instead
+        of the decimal delimiter '.'
+        e.g. for aperture (blende)
+        (since a dot is not good in file names we use something else)"""
+        self._conf['decimal_delimiter_ersatz'] = dds
+
+    def get_decimal_delimiter_ersatz(self):
+        """return substitution string for decimal delimiter"""
+        return self._conf['decimal_delimiter_ersatz']
+
+    def set_unwanted_character_ersatz(self, ucs: str):
+        """if the lens is analog, the value for aperture or length might be zero
+        which string should be written instead?"""
+        self._conf['unwanted_character_ersatz'] = ucs
+
+    def get_unwanted_character_ersatz(self):
+        """return substitution string for zero aperture or length values"""
+        return self._conf['unwanted_character_ersatz']
+
+    def set_zero_value_ersatz(self, zvs: str):
+        """if the lens is analog, the value for aperture or length might be zero
+        which string should be written instead?"""
+        self._conf['zero_value_ersatz'] = zvs
+
+    def get_zero_value_ersatz(self):
+        """return substitution string for zero aperture or length values"""
+        return self._conf['zero_value_ersatz']
+
+    def set_camera_rename_csv_name(self, filename: str):
+        """set name for the 'camera-name-translation'"""
+        self._conf['camera_rename_csv_file'] = filename
+
+    def get_camera_rename_csv_name(self):
+        """get name for the 'camera-name-translation'"""
+        return self._conf['camera_rename_csv_file']
+
+    def set_serial_length(self, serial_length: int = 3):
+        """set the length of the serial number (to be included in the file name) """
+        self._conf['serial_length'] = serial_length
+
+    def get_serial_length(self):
+        """get the length of the serial number (to be included in the file name) """
+        return self._conf['serial_length']
+
+    def set_jobs(self, jobs: int = None):
+        """set the number of worker threads to read exif data
+        (None: depending on the number of cpus of this machine)"""
+        self._conf['jobs'] = jobs
+
+    def get_jobs(self):
+        """get the number of worker threads to read exif data"""
+        if self._conf['jobs'] is None:
+            # reading exif data waits mostly for the disk, so more threads than cpus
+            # (same default as concurrent.futures.ThreadPoolExecutor)
+            return min(32, (os.cpu_count() or 1) + 4)
+        return max(1, self._conf['jobs'])
+
+    def set_memory_budget(self, pictures: int = None):
+        """keep at most this number of pictures in memory: the pictures are
+        written in sorted runs to temporary files and merged in timestamp order,
+        renamed in steps of this number of files (None: all pictures in memory)"""
+        if pictures is not None and pictures < 1:
+            raise ValueError("memory budget needs at least 1 picture")
+        self._conf['memory_budget'] = pictures
+
+    def get_memory_budget(self):
+        """get the maximal number of pictures in memory (None: no limit)"""
+        return self._conf['memory_budget']
+
+    def set_duplicate_action(self, action: str = 'number'):
+        """what to do with pictures which have the same timestamp and the same content:
+        'number': nothing special, they get a duplicate number like all pictures
+                  with the same timestamp (content is not compared)
+        'skip':   don't rename them
+        'mark':   add the duplicate marker string to the name
+        'move':   move them to the duplicate sub-directory
+        the oldest file (mtime) is the original, it is not marked"""
+        if action not in DUPLICATE_ACTIONS:
+            raise ValueError(f"unknown duplicate action {action}, use one of {DUPLICATE_ACTIONS}")
+        self._conf['duplicate_action'] = action
+
+    def get_duplicate_action(self):
+        """what to do with pictures with same timestamp and same content"""
+        return self._conf['duplicate_action']
+
+    def set_duplicate_marker(self, marker: str = 'DUPLICATE'):
+        """string added to the name of a picture with the same content as an other one"""
+        self._conf['duplicate_marker'] = re.sub(r'[^a-zA-Z0-9_-]+', '', marker)
+
+    def get_duplicate_marker(self):
+        """string added to the name of a picture with the same content as an other one"""
+        return self._conf['duplicate_marker']
+
+    def set_duplicate_dir(self, dirname: str = 'duplicates'):
+        """sub-directory (of the target directory) for pictures with the same content"""
+        self._conf['duplicate_dir'] = dirname
+
+    def get_duplicate_dir(self):
+        """sub-directory for pictures with the same content"""
+        return self._conf['duplicate_dir']
+
+    def set_target_root(self, dirname: str = None):
+        """put the renamed pictures (and their associated files) into this directory
+        (and its date directories) instead of their own directory, None: rename in place"""
+        if dirname is not None:
+            dirname = os.path.abspath(os.path.expanduser(dirname))
+        self._conf['target_root'] = dirname
+
+    def get_target_root(self):
+        """get the directory for the renamed pictures (None: their own directory)"""
+        return self._conf['target_root']
+
+    def set_transfer(self, mode: str = 'move'):
+        """how the files get their new names: move (rename), copy,
+        hardlink or reflink (copy which shares the data blocks, a copy if the
+        file system can't do it), see TRANSFER_MODES"""
+        if mode not in TRANSFER_MODES:
+            raise ValueError(f"unknown transfer mode {mode!r}, "
+                             f"use one of {', '.join(TRANSFER_MODES)}")
+        self._conf['transfer'] = mode
+
+    def get_transfer(self):
+        """get the transfer mode (see set_transfer)"""
+        return self._conf['transfer']
+
+    def set_cache_file(self, filename: str = None):
+        """use a sqlite file to cache the exif data of already known pictures
+        (None: don't use a cache)"""
+        self._conf['cache_file'] = filename
+
+    def get_cache_file(self):
+        """get name of the exif metadata cache file (None: no cache)"""
+        return self._conf['cache_file']
+
+    def set_cache_max_entries(self, max_entries: int = 1000000):
+        """how many pictures should be kept in the exif metadata cache
+        (the least recently used are removed first)"""
+        self._conf['cache_max_entries'] = max_entries
+
+    def get_cache_max_entries(self):
+        """get maximum number of pictures in the exif metadata cache"""
+        return self._conf['cache_max_entries']
+
+    def get_cache_stats(self):
+        """get hit and miss counters of the exif metadata cache"""
+        return dict(self._cache['stats'])
+
+    def set_profile(self, profile: bool = True):
+        """count file operations (files opened, stat calls, renames, ...)"""
+        self._conf['profile'] = profile
+
+    def is_profile(self):
+        """are file operations counted?"""
+        return self._conf['profile']
+
+    def get_profile_stats(self):
+        """get seconds per phase and counters of the last run
+        (counters are only collected if self.set_profile() is on)"""
+        stats = {
+            'phases': dict(self._stats['phases']),
+            'counters': dict(self._stats['counters']),
+        }
+        if stats['phases']:
+            stats['phases']['total'] = sum(self._stats['phases'].values())
+        if self.get_cache_file():
+            stats['counters']['cache_hits'] = self._cache['stats']['hits']
+            stats['counters']['cache_misses'] = self._cache['stats']['misses']
+        return stats
+
+    def set_clean_data_after_run(self, clean: bool = True):
+        """for tests we wan't to analyze the dict,
+        but if used as a module, it needs to be cleaned up"""
+        self._conf['clean_data_after_run'] = clean
+
+    def do_clean_data_after_run(self):
+        """for tests we wan't to analyze the dict,
+        but if used as a module, it needs to be cleaned up"""
+        return self._conf['clean_data_after_run']
+
+    def set_use_date_dir(self, _use_date_dir: bool = True):
+        """write files to separate directory?"""
+        self._conf['date_dir'] = _use_date_dir
+
+    def use_date_dir(self):
+        """write files to separate directory?"""
+        return self._conf['date_dir']
+
+    def set_verbose(self, verbose: bool = True):
+        """set verbosity (bool)"""
+        self._conf['verbose'] = verbose
+
+    def is_verbose(self):
+        """get verbosity (bool)"""
+        return self._conf['verbose']
+
+    def set_debug(self, debug: bool = True):
+        """set debug (bool)"""
+        self._conf['debug'] = debug
+
+    def is_debug(self):
+        """get debug status (bool)"""
+        return self._conf['debug']
+
+    def set_silent(self, silent: bool = True):
+        """set silence (bool)"""
+        self._conf['silent'] = silent
+
+    def is_silent(self):
+        """get silence (bool)"""
+        return self._conf['silent']
+
+    def set_dry_run(self, dry_run: bool = True):
+        """set dry-run (simulation-mode status)"""
+        self._conf['dry_run'] = dry_run
+
+    def is_dry_run(self):
+        """get dry-run (simulation-mode status)"""
+        return self._conf['dry_run']
+
+    def set_use_serial(self, bool_use_serial: bool = True):
+        """include a serial number"""
+        self._conf['use_serial'] = bool_use_serial
+
+    def use_serial(self):
+        """should we include serial number?"""
+        return self._conf['use_serial']
+
+    def set_use_duplicate(self, bool_use_duplicate: bool = True):
+        """include a duplicate number if the same timestamp occurs"""
+        self._conf['use_duplicate'] = bool_use_duplicate
+
+    def use_duplicate(self):
+        """should we include a duplicate number?"""
+        return self._conf['use_duplicate']
+
+    def set_use_ooc(self, _use_ooc: bool = True):
+        """set use of ooc extension"""
+        self._conf['ooc'] = _use_ooc
+
+    def use_ooc(self):
+        """get use of ooc extension"""
+        return self._conf['ooc']
+
+    def set_raw_primary(self, raw_primary: bool = True):
+        """rename raw files (read their exif data), JPEG files with the
+        same name are associated files (like xmp files)"""
+        self._conf['raw_primary'] = raw_primary
+
+    def use_raw_primary(self):
+        """are raw files the pictures (JPEG files the associated files)?"""
+        return self._conf['raw_primary']
+
+    def _primary_extensions(self):
+        """extensions of the pictures (raw or JPEG)"""
+        if self.use_raw_primary():
+            return self.get_raw_extensions()
+        return self.get_jpg_input_extensions()
+
+    def _primary_kind(self):
+        """kind of the picture records: 'raw' or 'jpg'"""
+        return 'raw' if self.use_raw_primary() else 'jpg'
+
+    def set_verify(self, verify: bool = True):
+        """read all pictures, also the ones which are named like the settings
+        would name them already (they are skipped without reading otherwise)"""
+        self._conf['verify'] = verify
+
+    def is_verify(self):
+        """are pictures read if their name follows the naming settings already?"""
+        return self._conf['verify']
+
+    def set_short_names(self, short_names: bool = True):
+        """use short names (without camera exif)"""
+        self._conf['short_names'] = short_names
+
+    def use_short_names(self):
+        """get usage of short names (without camera exif)"""
+        return self._conf['short_names']
+
+    def set_template(self, template: str = None):
+        """set the template for new file names, e.g. '{datetime}__{serial}__{camera}__{lens}'
+        (fields: see TEMPLATE_FIELDS), None: default template
+        raises ValueError if the template is not valid"""
+        if template is not None:
+            compile_template(template)
+        self._conf['template'] = template
+
+    def get_template(self):
+        """get the template for new file names
+        (without own template: depending on short names and serial usage)"""
+        if self._conf['template'] is not None:
+            return self._conf['template']
+        template = "{datetime}__{serial}" if self.use_serial() else "{datetime}"
+        if not self.use_short_names():
+            template += "__{camera}__{focal}__{aperture}__t{exposure}__iso{iso}"
+        return template
+
+    def _format_settings(self):
+        """settings of the value formatters"""
+        return _FormatSettings(
+            self.get_zero_value_ersatz(), self.get_unwanted_character_ersatz(),
+            self.get_decimal_delimiter_ersatz(), self.get_camera_rename_csv_name(),
+            self._camera_csv_signature)
+
+    def _take_camera_csv_signature(self):
+        """size and mtime of the camera csv, taken once at the start of a run
+        (the camera names and the cache settings depend on them)"""
+        self._camera_csv_signature = _file_signature(self.get_camera_rename_csv_name())
+
+    def export_pic_dict(self):
+        """for tests: all file records as dictionaries
+        (a copy, only fields with a value are included),
+        to see what would happen use iter_plan()"""
+        return {key: record.as_dict() for key, record in self._pic_dict.items()}
+
+    def _count(self, counter, number=1):
+        """count a file operation for the profile statistics (if switched on)"""
+        if not self._conf['profile']:
+            return
+        with self._stats['lock']:
+            self._stats['counters'][counter] = self._stats['counters'].get(counter, 0) + number
+
+    @contextlib.contextmanager
+    def _phase(self, name):
+        """measure the time of one phase of the run (read, organize, rename)"""
+        start = time.perf_counter()
         try:
-            if filerecord['orig_basename'] == _basename \
-                    and filerecord['orig_extension'] == _ext \
-                    and filerecord['orig_dirname'] == _dir:
-                return True
-        except KeyError:
-            pass
-        return False
+            yield
+        finally:
+            self._stats['phases'][name] = \
+                self._stats['phases'].get(name, 0) + time.perf_counter() - start
+
+    def print_profile_stats(self):
+        """print table of seconds per phase and counters of the last run"""
+        stats = self.get_profile_stats()
+        print(f"{'phase':<20} {'seconds':>12}")
+        for phase, seconds in stats['phases'].items():
+            print(f"{phase:<20} {seconds:12.4f}")
+        if stats['counters']:
+            print(f"\n{'counter':<20} {'value':>12}")
+            for counter in sorted(stats['counters']):
+                print(f"{counter:<20} {stats['counters'][counter]:12}")
+
+    def _read_exif_with_pil(self, filepath):
+        """fallback: read exif tags with Pillow
+        returns a dict tag name -> value or None if there is no exif data
+        raises OSError if Pillow can't open the file"""
+        self._count('pillow_opened')
+        image, tags = _pillow()
+        with image.open(filepath, formats=_PILLOW_FORMATS) as img:
+            try:
+                pil_exif = img._getexif()  # pylint: disable=protected-access
+            except AttributeError:
+                # no JPEG (e.g. a TIFF file named .jpg)
+                return None
+        if not pil_exif:
+            return None
+        # fetch tagging from https://stackoverflow.com/a/4765242
+        return {
+            tags[k]: v
+            for k, v in pil_exif.items()
+            if k in tags
+        }
 
+    def _read_exif(self, filepath, wanted=None):
+        """read exif tags from picture file (wanted: see parse_tiff_exif),
+        the built-in header reader is used first, Pillow for files it can't handle
+        returns a dict tag name -> value or None if there is no exif data
+        raises OSError if the file can't be read as a picture"""
+        if self.use_raw_primary():
+            return self._read_raw_exif(filepath, wanted)
+        try:
+            with open(filepath, 'rb') as jpeg:
+                self._count('files_opened')
+                try:
+                    exif = _scan_jpeg_exif(jpeg, wanted)
+                finally:
+                    # position where the reader stopped: the skipped segments are
+                    # included, but not read (bytes_read counts only the read ones)
+                    self._count('bytes_scanned', jpeg.tell())
+        except (ValueError, struct.error):
+            exif = None
+        if exif:
+            return exif
+        return self._read_exif_with_pil(filepath)
+
+    def _read_raw_exif(self, filepath, wanted=None):
+        """read exif tags from a tiff based raw file (memory mapped),
+        returns a dict tag name -> value or None if there is no exif data
+        (e.g. not tiff based like CR3 or RAF, Pillow can't read raw files either)"""
+        with open(filepath, 'rb') as raw:
+            self._count('files_opened')
+            try:
+                return _map_tiff_exif(raw, wanted)
+            except (ValueError, struct.error):
+                return None
+
+    def _create_new_basename(self, exif, filename):
+        """create a new filename based on exif data and the template
+        (exif is a dict tag name -> value, from the built-in reader or from Pillow)"""
+        if not exif:
+            if self.is_verbose():
+                errorprint('NO exif info in ' + filename)
+            return None, None, None
+
+        format_string, formatters, _wanted = compile_template(self.get_template())
+        settings = self._format_settings()
+        try:
+            _parsed = parse_exif_datetime(exif['DateTimeOriginal'])
+            if _parsed is None:
+                if self.is_verbose():
+                    errorprint('DateTimeOriginal not set in ' + filename)
+                return None, None, None
+            _new_basename = format_string.format(
+                *[formatter(exif, _parsed, settings) for formatter in formatters])
+        except KeyError as err:
+            if self.is_verbose():
+                errorprint('(Some) exif tags missing in ' + filename, err)
+            return None, None, None
+        except ValueError as err:
+            if self.is_verbose():
+                errorprint('wrong DateTimeOriginal in ' + filename, err)
+            return None, None, None
+
+        return _parsed[0], _new_basename, _parsed[1]
+
+    def _picdict_set_serial_once(self, _pic, _serial, _serial_length):
+        """set serial number in a picture store entry (if not set yet or if empty)"""
+        # make a string out of "_serial", fill it up with 0 up to _serial_length
+        # include it into the new file base name
+        record = self._pic_dict[_pic]
+        if record.serial is not None:
+            return False
+
+        record.serial = _serial
+        if self.use_serial():
+            record.new_basename = \
+                record.new_basename.replace(_SERIAL_MARK, str(_serial).zfill(_serial_length))
+        else:
+            record.new_basename = record.new_basename.replace(_SERIAL_MARK, "")
+        return True
 
-def __rename_files():
-    """rename files (after check if we don't overwrite)"""
-    for k in sorted(__PIC_DICT):
+    def _picdict_add(self, key, record):
+        """add a file record to the picture store (and to the index of original paths)"""
+        self._pic_dict[key] = record
+        self._orig_path_index.add(
+            (record.orig_dirname, record.orig_basename, record.orig_extension))
 
-        oldname = "{}/{}{}".format(         # pylint: disable=consider-using-f-string
-            __PIC_DICT[k]["orig_dirname"],
-            __PIC_DICT[k]["orig_basename"],
-            __PIC_DICT[k]["orig_extension"],
-        )
+    def _picdict_remove(self, key):
+        """remove a file record from the picture store (and from the index of original paths)"""
+        record = self._pic_dict.pop(key)
+        self._orig_path_index.discard(
+            (record.orig_dirname, record.orig_basename, record.orig_extension))
 
-        newname = "{}/{}{}".format(         # pylint: disable=consider-using-f-string
-            __PIC_DICT[k]["new_dirname"],
-            __PIC_DICT[k]["new_basename"],
-            __PIC_DICT[k]["new_extension"],
-        )
+    def _picdict_has_orig_filepath(self, filepath):
+        """search if this filename is already recorded in the picture store"""
 
-        if oldname == newname:
-            continue
+        _dir, _filename = os.path.split(filepath)
+        _basename, _ext = splitext_all(_filename)
 
-        if not os.path.isfile(oldname) and not is_silent():
-            errorprint(f"WARNING: want to rename {oldname}\n"
-                       f"                     to {newname}\n"
-                       f"         but orig file not available any more")
-            continue
-        if os.path.isfile(newname) and not is_silent():
-            errorprint(f"WARNING: did not overwrite existing file\n"
-                       f"\t{newname}\n\twith:\n \t{oldname}")
-            continue
-            sys.exit()  # pylint: disable=unreachable
-            # we really really don't want to overwrite files
+        return (_dir, _basename, _ext) in self._orig_path_index
+
+    def _make_dir(self, dirname):
+        """create a target directory (if it doesn't exist yet),
+        every directory is checked only once"""
+        if dirname in self._known_dirs:
+            return
+
+        # is this directory already there
+        # is there something else what has this name but is no dir
+        # write the dir
+        # if problem, exit
 
+        self._count('stat_calls')
+        if not os.path.isdir(dirname):
+            try:
+                if self.is_dry_run():
+                    if self.is_verbose():
+                        verboseprint("INFO: create new directory:"
+                                     + f" {dirname} (SIMULATION MODE)")
+                else:
+                    if self.is_verbose():
+                        verboseprint(f"INFO: create new directory: {dirname}")
+
+                    os.makedirs(dirname)
+                    self._count('mkdirs')
+
+            except FileExistsError:
+                errorprint(f'ERROR: There is a {dirname}, but it is not a directory')
+                sys.exit()
+        self._known_dirs.add(dirname)
+
+    def _dir_has_file(self, dirname, filename):
+        """is there a file (or directory) with this name?
+        (looked up in the directory index, not on the disk)"""
+        return any(name == filename
+                   for name, _ in self._dir_index(dirname).get(filename.split('.', 1)[0], ()))
+
+    def _check_renames(self, operations):
+        """check all planned renames before anything is touched:
+        source still there, target name free on disk and not claimed by an
+        other file of this run, returns (good operations, error messages)"""
+        good = []
+        errors = []
+        claimed = {}    # new name -> old name
+        for number, oldname, newname in operations:
+            if newname in claimed:
+                errors.append(f"WARNING: did not rename {oldname}\n"
+                              f"         to {newname}\n"
+                              f"         this name is already used for {claimed[newname]}")
+                continue
+            if not self._dir_has_file(*os.path.split(oldname)):
+                errors.append(f"WARNING: want to rename {oldname}\n"
+                              f"                     to {newname}\n"
+                              f"         but orig file not available any more")
+                continue
+            if self._dir_has_file(*os.path.split(newname)):
+                # we really really don't want to overwrite files
+                errors.append(f"WARNING: did not overwrite existing file\n"
+                              f"\t{newname}\n\twith:\n \t{oldname}")
+                continue
+            claimed[newname] = oldname
+            good.append((number, oldname, newname))
+        return good, errors
+
+    def _rename_file(self, oldname, newname):
+        """rename one file (already checked by self._check_renames)
+        returns the messages as list of (is error, message)"""
+        messages = []
         msg = ""
-        if is_dry_run():
+        verb = 'rename' if self.get_transfer() == 'move' else self.get_transfer()
+        if self.is_dry_run():
             msg = "SIMULATION| "
-        if is_verbose() or (is_dry_run() and not is_silent()):
-            verboseprint(f"{msg}rename old: {oldname} ")
-            verboseprint(f"{msg}to NEW    : {newname} ")
+        if self.is_verbose() or (self.is_dry_run() and not self.is_silent()):
+            messages.append((False, f"{msg}{verb} old: {oldname} "))
+            messages.append((False, f"{msg}to NEW    : {newname} "))
+
+        if not self.is_dry_run():
+            try:
+                self._transfer_file(oldname, newname)
+            except OSError as err:
+                messages.append((True, f"ERROR: can't {verb} {oldname}\n"
+                                       f"                 to {newname}: {err}"))
+        return messages
+
+    def _transfer_file(self, oldname, newname):
+        """give a file its new name (see set_transfer), existing files are not overwritten
+        (a move to an other file system is a copy and a remove)
+        raises OSError"""
+        transfer = self.get_transfer()
+        if transfer == 'move':
+            # os.rename replaces an existing file, the directory index doesn't know
+            # about case insensitive file systems (NEW.JPG is NEW.jpg there)
+            self._count('stat_calls')
+            if os.path.lexists(newname):
+                raise FileExistsError(errno.EEXIST, "file exists already", newname)
+            try:
+                os.rename(oldname, newname)
+                self._count('renames')
+                return
+            except OSError as err:
+                if err.errno != errno.EXDEV:
+                    raise
+            # copy_file raises on a short copy, the original is removed only after a full copy
+            self._count('bytes_copied', copy_file(oldname, newname))
+            os.unlink(oldname)
+            self._count('cross_device_moves')
+        elif transfer == 'hardlink':
+            os.link(oldname, newname)
+            self._count('hardlinks')
+        else:
+            self._count('bytes_copied', copy_file(oldname, newname, transfer == 'reflink'))
+            self._count('copies')
+
+    def _transfer_tasks(self, operations):
+        """split the checked operations (number, oldname, newname) into the tasks
+        of the workers: renames in one file system are quick, they are grouped by
+        target directory; copies, links and moves to an other file system are
+        independent (the targets are distinct and never overwritten), one task per file"""
+        groups = {}     # target directory -> [(number, oldname, newname)]
+        tasks = []
+        devices = {}    # directory -> st_dev (None if unknown)
+        for operation in operations:
+            dirname = os.path.dirname(operation[2])
+            if self.get_transfer() == 'move' and self._same_file_system(
+                    os.path.dirname(operation[1]), dirname, devices):
+                groups.setdefault(dirname, []).append(operation)
+            else:
+                tasks.append([operation])
+        return list(groups.values()) + tasks
+
+    def _same_file_system(self, dirname, other, devices):
+        """True if both directories are on the same device (or if it is unknown,
+        e.g. in a dry run), devices caches the devices of the directories"""
+        for name in (dirname, other):
+            if name not in devices:
+                self._count('stat_calls')
+                try:
+                    devices[name] = os.stat(name or os.curdir).st_dev
+                except OSError:
+                    devices[name] = None
+        return None in (devices[dirname], devices[other]) or devices[dirname] == devices[other]
+
+    def _rename_group(self, operations):
+        """rename the files of one target directory one after the other
+        returns list of (number, messages)"""
+        return [(number, self._rename_file(oldname, newname))
+                for number, oldname, newname in operations]
+
+    def _rename_operations(self):
+        """(number, oldname, newname) of all files to rename, in sorted order"""
+        operations = []
+        for number, k in enumerate(sorted(self._pic_dict)):
+            oldname, newname = _record_paths(self._pic_dict[k])
+            if oldname == newname:
+                continue
+
+            operations.append((number, oldname, newname))
+        return operations
+
+    def _rename_files(self):
+        """rename all files of the picture store"""
+        self._apply_operations(self._rename_operations())
+
+    def _apply_operations(self, operations):
+        """rename files (after check if we don't overwrite)
+        operations is a list of (number, oldname, newname),
+        all renames are checked first against each other and against the
+        directory index (one scan per directory instead of a stat per file),
+        then the target directories are created (once per directory) and
+        the files are renamed by a pool of workers (see _transfer_tasks),
+        messages are printed in the order of the numbers"""
+        operations, errors = self._check_renames(operations)
+        if not self.is_silent():
+            for message in errors:
+                errorprint(message)
+
+        for dirname in sorted({os.path.dirname(operation[2]) for operation in operations}):
+            self._make_dir(dirname)
+
+        results = []
+        for _, group_results in _map_in_order(
+                self._rename_group, self._transfer_tasks(operations), self.get_jobs()):
+            results.extend(group_results)
+
+        for _, messages in sorted(results, key=lambda result: result[0]):
+            for is_error, message in messages:
+                if not is_error:
+                    verboseprint(message)
+                elif not self.is_silent():
+                    errorprint(message)
+
+    def _cache_settings(self):
+        """all settings which change the cached basename
+        (if one of them changes the cache entry is not valid any more)"""
+        return '|'.join(str(setting) for setting in (
+            version,
+            self.get_template(),
+            self.get_zero_value_ersatz(),
+            self.get_unwanted_character_ersatz(),
+            self.get_decimal_delimiter_ersatz(),
+            self.get_camera_rename_csv_name(),
+            self._camera_csv_signature,
+        ))
+
+    def _cache_open(self):
+        """open (or create) the exif metadata cache"""
+        for counter in self._cache['stats']:
+            self._cache['stats'][counter] = 0
+        self._cache['used'] = []
+        self._cache['settings'] = self._cache_settings()
+        import sqlite3  # pylint: disable=import-outside-toplevel
+        try:
+            database = sqlite3.connect(self.get_cache_file(), check_same_thread=False)
+            database.execute(
+                "CREATE TABLE IF NOT EXISTS exif_cache ("
+                " device INTEGER, inode INTEGER, size INTEGER, mtime_ns INTEGER,"
+                " settings TEXT, timestamp TEXT, new_basename TEXT, date TEXT,"
+                " last_used INTEGER,"
+                " PRIMARY KEY (device, inode))")
+            database.execute(
+                "CREATE INDEX IF NOT EXISTS exif_cache_last_used ON exif_cache (last_used)")
+            database.execute(
+                "CREATE TABLE IF NOT EXISTS hash_cache ("
+                " device INTEGER, inode INTEGER, size INTEGER, mtime_ns INTEGER,"
+                " partial TEXT, full TEXT,"
+                " last_used INTEGER,"
+                " PRIMARY KEY (device, inode))")
+        except sqlite3.Error as err:
+            errorprint(f"WARNING: can't use cache {self.get_cache_file()}: {err}")
+            return
+        self._cache['db'] = database
+
+    def _cache_close(self):
+        """write back usage, remove least recently used entries
+        if there are too many and close the exif metadata cache"""
+        database = self._cache['db']
+        if database is None:
+            return
+        self._cache['db'] = None
+        now = time.time_ns()
+        for table in ('exif_cache', 'hash_cache'):
+            database.executemany(
+                f"UPDATE {table} SET last_used = ? WHERE device = ? AND inode = ?",
+                ((now, device, inode) for device, inode in self._cache['used']))
+            entries = database.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            if entries > self.get_cache_max_entries():
+                evict = entries - self.get_cache_max_entries()
+                database.execute(
+                    f"DELETE FROM {table} WHERE rowid IN"
+                    f" (SELECT rowid FROM {table} ORDER BY last_used LIMIT ?)", (evict,))
+                if table == 'exif_cache':
+                    self._cache['stats']['evictions'] += evict
+        database.commit()
+        database.close()
+
+    def _cache_key(self, filepath):
+        """identity of a file for the cache: device, inode, size, mtime
+        (None if there is no such file)"""
+        self._count('stat_calls')
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            return None
+        return stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def _cache_lookup(self, key):
+        """get cached (timestamp, new_basename, date) for a file (or None)"""
+        if self._cache['db'] is None or key is None:
+            return None
+        device, inode, size, mtime_ns = key
+        with self._cache['lock']:
+            row = self._cache['db'].execute(
+                "SELECT size, mtime_ns, settings, timestamp, new_basename, date"
+                " FROM exif_cache WHERE device = ? AND inode = ?", (device, inode)).fetchone()
+            if row is None:
+                self._cache['stats']['misses'] += 1
+                return None
+            if row[:3] != (size, mtime_ns, self._cache['settings']):
+                # file (or settings) changed since it was cached
+                self._cache['stats']['misses'] += 1
+                self._cache['stats']['stale'] += 1
+                return None
+            self._cache['stats']['hits'] += 1
+            self._cache['used'].append((device, inode))
+        return row[3:]
+
+    def _cache_store(self, key, result):
+        """store (timestamp, new_basename, date) of a file in the cache"""
+        if self._cache['db'] is None or key is None:
+            return
+        with self._cache['lock']:
+            self._cache['db'].execute(
+                "INSERT OR REPLACE INTO exif_cache VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                key + (self._cache['settings'],) + tuple(result) + (time.time_ns(),))
+            self._cache['stats']['stored'] += 1
+
+    def _cache_lookup_hash(self, key, kind):
+        """get cached content hash ('partial' or 'full') of a file (or None)"""
+        if self._cache['db'] is None or key is None:
+            return None
+        device, inode, size, mtime_ns = key
+        with self._cache['lock']:
+            row = self._cache['db'].execute(
+                f"SELECT {kind} FROM hash_cache"
+                " WHERE device = ? AND inode = ? AND size = ? AND mtime_ns = ?",
+                (device, inode, size, mtime_ns)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def _cache_store_hash(self, key, kind, content_hash):
+        """store content hash ('partial' or 'full') of a file in the cache"""
+        if self._cache['db'] is None or key is None:
+            return
+        device, inode, size, mtime_ns = key
+        with self._cache['lock']:
+            row = self._cache['db'].execute(
+                "SELECT partial, full FROM hash_cache"
+                " WHERE device = ? AND inode = ? AND size = ? AND mtime_ns = ?",
+                (device, inode, size, mtime_ns)).fetchone()
+            hashes = dict(zip(('partial', 'full'), row or (None, None)))
+            hashes[kind] = content_hash
+            self._cache['db'].execute(
+                "INSERT OR REPLACE INTO hash_cache VALUES (?, ?, ?, ?, ?, ?, ?)",
+                key + (hashes['partial'], hashes['full'], time.time_ns()))
+
+    def print_cache_stats(self):
+        """print summary of the cache usage"""
+        stats = self.get_cache_stats()
+        print(f"cache {self.get_cache_file()}: {stats['hits']} hits, {stats['misses']} misses"
+              f" ({stats['stale']} outdated), {stats['stored']} stored,"
+              f" {stats['evictions']} evicted")
+
+    def iter_files(self, paths, recursive: bool = False):
+        """yield the file names in paths, with recursive=True the pictures (JPEG
+        or raw files, see set_raw_primary) in directories (and their sub-directories)
+        are yielded, too
+        (sorted by name per directory, symlinked directories are not followed)"""
+        for path in paths:
+            self._count('stat_calls')
+            if not os.path.isdir(path):
+                yield path
+                continue
+            if not recursive:
+                if not self.is_silent():
+                    errorprint(f"WARNING: {path} is a directory (use --recursive)")
+                continue
+
+            directories = [path]
+            while directories:
+                directory = directories.pop()
+                self._count('directory_scans')
+                try:
+                    with os.scandir(directory) as scan:
+                        entries = sorted(scan, key=lambda entry: entry.name)
+                except OSError as err:
+                    if not self.is_silent():
+                        errorprint(f"WARNING: can't read directory {directory}: {err}")
+                    continue
+                subdirectories = []
+                for entry in entries:
+                    # DirEntry knows the file type already, so no stat calls here
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirectories.append(entry.path)
+                    elif splitext_last(entry.name)[1] in self._primary_extensions() \
+                            and entry.is_file():
+                        yield entry.path
+                # depth first, in sorted order
+                directories.extend(reversed(subdirectories))
+
+    def _iter_picture_files(self, _filelist):
+        """yield (orig_dirname, orig_basename, orig_all_extensions) for every
+        picture file in _filelist which is not processed yet
+        (with a memory budget the same file is dropped later, see _load_timestamp_group)"""
+        seen = set() if self.get_memory_budget() is None else None
+        for orig_filepath in _filelist:
+            # ensure we only fetch jpg and jpeg and JPG and JPEG ... (or raw files)
+            _, extension = splitext_last(orig_filepath)
+            if extension not in self._primary_extensions():
+                continue
+
+            orig_dirname, origfilename = os.path.split(orig_filepath)
+            orig_basename, orig_all_extensions = splitext_all(origfilename)
+            # the orig_dirname might be empty->absolute path
+            orig_dirname = os.path.abspath(os.path.expanduser(orig_dirname))
+            orig_filepath = os.path.join(orig_dirname, orig_basename + orig_all_extensions)
+
+            # ensure we don't read the same picture twice
+
+            if (seen is not None and orig_filepath in seen) \
+                    or self._picdict_has_orig_filepath(orig_filepath):
+                if self.is_verbose():
+                    verboseprint(f"{orig_filepath} already processed")
+                continue
+            if seen is not None:
+                seen.add(orig_filepath)
+
+            if self._skip_conforming(orig_dirname, orig_basename, orig_all_extensions):
+                if self.is_verbose():
+                    verboseprint(f"{orig_filepath} is named already")
+                continue
 
-        if not is_dry_run():
-            os.rename(oldname, newname)
+            yield orig_dirname, orig_basename, orig_all_extensions
+
+    def _new_jpg_extension(self):
+        """extension of renamed JPEG files"""
+        if self.use_ooc():
+            return self.get_ooc_extension() + self.get_jpg_out_extension()
+        return self.get_jpg_out_extension()
+
+    def _new_primary_extension(self, orig_extension):
+        """extension of renamed pictures (raw files keep theirs in lower case)"""
+        if self.use_raw_primary():
+            return orig_extension.lower()
+        return self._new_jpg_extension()
+
+    def _skip_conforming(self, orig_dirname, orig_basename, orig_all_extensions):
+        """is the picture named like the settings would name it already?
+        (without reading it, only names with {datetime} are recognized)
+        the serial and duplicate numbers of such pictures are reserved,
+        new pictures get higher ones"""
+        template = self.get_template()
+        if self.is_verify() or self.get_target_root() or '{datetime}' not in template \
+                or orig_all_extensions != self._new_primary_extension(orig_all_extensions):
+            return False
+
+        suffix = r'(?:_(?P<duplicate>\d+))?' if self.use_duplicate() else ''
+        if self.get_duplicate_action() == 'mark':
+            suffix += f"(?:_{re.escape(self.get_duplicate_marker())})?"
+        match = _name_pattern(template, self.use_serial(), suffix).fullmatch(orig_basename)
+        if not match:
+            return False
+        timestamp = match['datetime']
+        date = f"{timestamp[:4]}-{timestamp[4:6]}-{timestamp[6:8]}"
+        parent, dirname = os.path.split(orig_dirname)
+        if self.get_duplicate_action() == 'move' and dirname == self.get_duplicate_dir():
+            # a copy in the duplicate directory of its date directory
+            dirname = os.path.basename(parent)
+        if self.use_date_dir() and dirname != date:
+            return False
+
+        self._count('named_already')
+        duplicate = int(match.groupdict().get('duplicate') or 0)
+        if self._spill is not None:
+            # with a memory budget the reserved numbers go to the runs, too
+            # (input order 0: before the pictures of the timestamp, see _load_timestamp_group)
+            self._spill_row((timestamp, 0, duplicate + 1))
+        else:
+            self._duplicate_counter[timestamp] = \
+                max(self._duplicate_counter.get(timestamp, 0), duplicate + 1)
+        if match.groupdict().get('serial'):
+            self._last_serial = max(self._last_serial, int(match['serial']))
+        return True
+
+    def _read_picture_file(self, picture):
+        """read exif data of one picture (runs in the worker pool)
+        returns (timestamp, new_basename, date), all None if not usable"""
+        orig_dirname, orig_basename, orig_all_extensions = picture
+        orig_filepath = os.path.join(orig_dirname, orig_basename + orig_all_extensions)
+
+        cache_key = self._cache_key(orig_filepath) if self._cache['db'] else None
+        result = self._cache_lookup(cache_key)
+        if result:
+            return result
+
+        try:
+            exif = self._read_exif(orig_filepath, compile_template(self.get_template())[2])
+        except OSError:
+            if not self.is_silent():
+                errorprint(f"{orig_filepath} can't be opened as image")
+            return None, None, None
+        result = self._create_new_basename(exif, orig_filepath)
+        if result[1]:
+            self._cache_store(cache_key, result)
+        return result
+
+    def _iter_read_pictures(self, _filelist):
+        """READ picture exif data, yield (picture, timestamp, new_basename, date)
+        for every usable picture in input order"""
+
+        if '{camera}' in self.get_template():
+            # load it before the workers need it
+            error = _camera_rules(self.get_camera_rename_csv_name(),
+                                  self._camera_csv_signature)[3]
+            if error and self.is_verbose():
+                verboseprint(error)
+
+        # merge the results in input order, so the duplicate numbers
+        # do not depend on the number of workers
+        for picture, (timestamp, new_basename, date) in _map_in_order(
+                self._read_picture_file, self._iter_picture_files(_filelist), self.get_jobs()):
+            if new_basename:
+                yield picture, timestamp, new_basename, date
+
+    def _add_picture(self, picture, timestamp, new_basename, date):
+        """put a picture in the picture store (with the next duplicate number of its timestamp)"""
+        orig_dirname, orig_basename, orig_all_extensions = picture
+
+        # There might be other jpg arround with the same timestamp
+        # these might be either:
+        # * serial shots (same camera same second) or
+        # * parallel shots (other camera, same second)
+        # * same camera after a clock reset
+        # so we NEED to check first if this date is already claimed by an other shot
+        # and save both (the second gets a number > 0 in duplicate
+        duplicate = self._duplicate_counter.get(timestamp, 0)
+        self._duplicate_counter[timestamp] = duplicate + 1
+
+        self._picdict_add(f"{timestamp}_{duplicate}", FileRecord(
+            self._primary_kind(), orig_dirname, orig_basename, orig_all_extensions,
+            timestamp=timestamp,
+            duplicate=duplicate,
+            new_basename=new_basename,
+            date=sys.intern(date),
+        ))
+
+    def _read_picture_data(self, _filelist):
+        """ READ picture exif data, put it in the picture store"""
+        for picture, timestamp, new_basename, date in self._iter_read_pictures(_filelist):
+            self._add_picture(picture, timestamp, new_basename, date)
+
+    def _spill_sorted_runs(self, _filelist, directory):
+        """READ picture exif data like _read_picture_data, but keep at most
+        the memory budget of pictures in memory: they are sorted by timestamp
+        (and input order) and written as runs to files in directory,
+        the reserved duplicate numbers of pictures which are named already, too
+        returns the paths of the runs and the number of pictures"""
+        self._spill = {'directory': directory, 'run': [], 'runs': []}
+        count = 0
+        try:
+            for count, (picture, timestamp, new_basename, date) in enumerate(
+                    self._iter_read_pictures(_filelist), 1):
+                self._spill_row((timestamp, count, *picture, new_basename, date))
+            self._write_run()
+            return self._spill['runs'], count
+        finally:
+            self._spill = None
+
+    def _spill_row(self, row):
+        """add a row (timestamp, input order, ...) to the current run,
+        the run is written if the memory budget is reached"""
+        self._spill['run'].append(row)
+        if len(self._spill['run']) >= self.get_memory_budget():
+            self._write_run()
+
+    def _write_run(self):
+        """write the current run sorted (newline delimited JSON) and start a new one"""
+        run = self._spill['run']
+        if not run:
+            return
+        run.sort()
+        path = os.path.join(self._spill['directory'], f"run{len(self._spill['runs'])}.ndjson")
+        with open(path, 'w', encoding='utf-8') as runfile:
+            for row in run:
+                runfile.write(json.dumps(row) + '\n')
+        self._count('spilled_runs')
+        self._spill['runs'].append(path)
+        self._spill['run'] = []
+
+    def _load_timestamp_group(self, timestamp, rows):
+        """put the pictures of one timestamp (merged rows) in the picture store,
+        in input order (a file which is given twice is stored once),
+        after the duplicate numbers of pictures which are named already (rows
+        (timestamp, 0, next free duplicate number), they come first)"""
+        for row in rows:
+            if row[1] == 0:
+                self._duplicate_counter[timestamp] = \
+                    max(self._duplicate_counter.get(timestamp, 0), row[2])
+                continue
+            picture = row[2:5]
+            if tuple(picture) in self._orig_path_index:
+                continue
+            self._add_picture(picture, timestamp, row[5], row[6])
+
+    def get_duplicate_histogram(self):
+        """how many pictures share the same timestamp (second)?
+        returns a dict number of pictures -> number of timestamps"""
+        histogram = {}
+        for count in self._duplicate_counter.values():
+            histogram[count] = histogram.get(count, 0) + 1
+        return histogram
+
+    def _print_duplicate_histogram(self):
+        """print the timestamps used by more than one picture (bursts)"""
+        histogram = self.get_duplicate_histogram()
+        if not any(count > 1 for count in histogram):
+            return
+        verboseprint("pictures with the same timestamp (per second):")
+        for count in sorted(histogram):
+            verboseprint(f"  {count:5} pictures: {histogram[count]:7} timestamps")
+        for timestamp in sorted(self._duplicate_counter):
+            if self._duplicate_counter[timestamp] > 1:
+                verboseprint(f"  {timestamp}: {self._duplicate_counter[timestamp]} pictures")
+
+    def _partial_hash(self, filepath, size):
+        """hash of the first and the last _HASH_PART_SIZE bytes of a file"""
+        content_hash = hashlib.blake2b()
+        with open(filepath, 'rb') as picture:
+            self._count('files_opened')
+            content_hash.update(picture.read(_HASH_PART_SIZE))
+            if size > _HASH_PART_SIZE:
+                picture.seek(max(_HASH_PART_SIZE, size - _HASH_PART_SIZE))
+                content_hash.update(picture.read(_HASH_PART_SIZE))
+        self._count('bytes_read', min(size, 2 * _HASH_PART_SIZE))
+        return content_hash.hexdigest()
+
+    def _full_hash(self, filepath, size):
+        """hash of the whole file (read with mmap if possible)"""
+        content_hash = hashlib.blake2b()
+        with open(filepath, 'rb') as picture:
+            self._count('files_opened')
+            try:
+                with mmap.mmap(picture.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    content_hash.update(mapped)
+            except (ValueError, OSError):
+                # e.g. empty files or file systems without mmap
+                for block in iter(lambda: picture.read(_HASH_BUFFER_SIZE), b''):
+                    content_hash.update(block)
+        self._count('bytes_read', size)
+        return content_hash.hexdigest()
+
+    def _content_hash(self, job):
+        """content hash of a file (runs in the worker pool)
+        job is (kind, filepath, identity), kind is 'partial' or 'full'"""
+        kind, filepath, identity = job
+        content_hash = self._cache_lookup_hash(identity, kind)
+        if content_hash is None:
+            try:
+                if kind == 'partial':
+                    content_hash = self._partial_hash(filepath, identity[2])
+                else:
+                    content_hash = self._full_hash(filepath, identity[2])
+            except OSError:
+                return None
+            self._cache_store_hash(identity, kind, content_hash)
+        return content_hash
+
+    def _find_content_duplicates(self):
+        """find pictures with the same timestamp and the same content
+        (same size -> same first and last part -> same hash of the whole file),
+        the oldest file (mtime) of such a group gets the lowest duplicate number,
+        the others are marked with duplicate_of"""
+        groups = {}
+        kind = self._primary_kind()
+        for key, record in self._pic_dict.items():
+            if record.kind == kind and self._duplicate_counter.get(record.timestamp, 0) > 1:
+                groups.setdefault(record.timestamp, []).append(key)
+        if not groups:
+            return
+
+        def filepath(key):
+            record = self._pic_dict[key]
+            return os.path.join(record.orig_dirname, record.orig_basename + record.orig_extension)
+
+        identity = {key: self._cache_key(filepath(key))
+                    for group in groups.values() for key in group}
+
+        def content_hashes(candidates, kind):
+            """content hashes of all pictures in candidates, key -> hash"""
+            keys = [key for group in candidates for key in group]
+            jobs = [(kind, filepath(key), identity[key]) for key in keys]
+            return dict(zip(keys, (content_hash for _, content_hash
+                                   in _map_in_order(self._content_hash, jobs, self.get_jobs()))))
+
+        # same size
+        candidates = _split_groups(
+            groups.values(), lambda key: identity[key] and identity[key][2])
+        # same first and last part
+        candidates = _split_groups(candidates, content_hashes(candidates, 'partial').get)
+        # small files are completely hashed already, the others need a full hash
+        identical = [group for group in candidates
+                     if identity[group[0]][2] <= 2 * _HASH_PART_SIZE]
+        candidates = [group for group in candidates
+                      if identity[group[0]][2] > 2 * _HASH_PART_SIZE]
+        candidates = _split_groups(candidates, content_hashes(candidates, 'full').get)
+
+        for group in identical + candidates:
+            self._mark_content_duplicates(group, identity)
+
+    def _mark_content_duplicates(self, group, identity):
+        """group of pictures with the same content: the oldest file takes
+        the lowest duplicate number, the others are marked as duplicates of it"""
+        group.sort(key=lambda key: self._pic_dict[key].duplicate)
+        first = self._pic_dict[group[0]]
+        oldest = min(group, key=lambda key: (identity[key][3], self._pic_dict[key].duplicate))
+        if oldest != group[0]:
+            # swap the files, not the records (timestamp and exif are the same)
+            other = self._pic_dict[oldest]
+            for field in ('orig_dirname', 'orig_basename', 'orig_extension'):
+                value = getattr(first, field)
+                setattr(first, field, getattr(other, field))
+                setattr(other, field, value)
+            identity[group[0]], identity[oldest] = identity[oldest], identity[group[0]]
+
+        for key in group[1:]:
+            self._pic_dict[key].duplicate_of = group[0]
+            if self.is_verbose():
+                record = self._pic_dict[key]
+                verboseprint(f"{record.orig_dirname}/{record.orig_basename}{record.orig_extension}"
+                             f" is a copy of {first.orig_dirname}/{first.orig_basename}"
+                             f"{first.orig_extension}")
+
+    def _organize_picture_data(self):
+        """analyse what jpg files we've got and find accociate files"""
+        for _ in self._iter_organized_pictures():
+            pass
+
+    def _iter_organized_pictures(self):
+        """analyse what jpg files we've got and find accociate files,
+        yield (picture key, keys of its associated files) as soon as
+        the new names of a picture are decided (in serial order)"""
+
+        self._handle_content_duplicates()
+
+        pic_list = sorted(self._pic_dict)
+        self._fit_serial_length(len(pic_list))
+
+        # first serial NUMBER to be included into the new picture name
+        # (after the ones of pictures which are named already)
+        yield from self._iter_organized_group(pic_list, self._last_serial + 1)
+
+    def _iter_merged_pictures(self, runs, count):
+        """like _iter_organized_pictures, but for the pictures in sorted runs
+        (see _spill_sorted_runs): the runs are merged in timestamp order, only the
+        pictures of one timestamp are in the picture store at a time, they get
+        their duplicate numbers (after the ones of pictures which are named already)
+        and serials here"""
+        self._fit_serial_length(count)
+        serial = self._last_serial + 1
+
+        with contextlib.ExitStack() as stack:
+            rows = heapq.merge(*[
+                map(json.loads, stack.enter_context(open(run, encoding='utf-8')))
+                for run in runs])
+            for timestamp, group in itertools.groupby(rows, key=lambda row: row[0]):
+                self._load_timestamp_group(timestamp, group)
+                self._handle_content_duplicates()
+                for pic, extras in self._iter_organized_group(sorted(self._pic_dict), serial):
+                    yield pic, extras
+                    serial += 1
+                self._pic_dict.clear()
+                self._orig_path_index.clear()
+                self._duplicate_counter.pop(timestamp, None)
+
+    def _handle_content_duplicates(self):
+        """find pictures with the same content (if the duplicate action is not 'number')
+        and drop them from the picture store (duplicate action 'skip')"""
+        if self.get_duplicate_action() != 'number':
+            self._find_content_duplicates()
+            if self.get_duplicate_action() == 'skip':
+                for pic in [pic for pic, record in self._pic_dict.items() if record.duplicate_of]:
+                    self._picdict_remove(pic)
+
+    def _fit_serial_length(self, count):
+        """is the serial length long enough (enough digits) for count pictures?"""
+        serial_min_length = (len(str(count + self._last_serial)))
+
+        if serial_min_length > self.get_serial_length():
+            self.set_serial_length(serial_min_length)
+
+    def _iter_organized_group(self, pic_list, serial):
+        """organize the pictures of pic_list (keys of the picture store), the first gets serial,
+        yield (picture key, keys of its associated files) like _iter_organized_pictures"""
+
+        # walk now through all pictures to process them
+        kind = self._primary_kind()
+        for pic in pic_list:
+            if self._pic_dict[pic].kind == kind:
+                self._organize_jpg_files(pic, serial)
+                yield pic, self._organize_extra_files(pic)
+                serial += 1
+
+    def _organize_jpg_files(self, pic, serial):
+        """organize new paths for the jpg files"""
+        record = self._pic_dict[pic]
+        orig_dirname = record.orig_dirname
+        duplicate = record.duplicate
+
+        # pictures with the same timestamp: first come first serve,
+        # if the content is compared (duplicate action not 'number')
+        # the oldest file (mtime) of the same content wins,
+        # the others are marked as duplicate_of (see self._find_content_duplicates)
+
+        self._picdict_set_serial_once(pic, serial, self.get_serial_length())
+
+        # move files to the target root (if there is one)
+        base_dirname = self.get_target_root() or orig_dirname
+
+        # move files to other directory
+        # (the directory is created later, just before the renaming starts)
+        if self.use_date_dir():
+            new_dirname = sys.intern(os.path.join(base_dirname, record.date))
+
+        # don't move files to an other directory
+        else:
+            new_dirname = base_dirname
+
+        if duplicate and self.use_duplicate():
+            record.new_basename = record.new_basename + f'_{duplicate}'
+
+        if record.duplicate_of:
+            # same content as an other picture
+            if self.get_duplicate_action() == 'mark':
+                record.new_basename = record.new_basename + f'_{self.get_duplicate_marker()}'
+            elif self.get_duplicate_action() == 'move':
+                new_dirname = sys.intern(os.path.join(new_dirname, self.get_duplicate_dir()))
+
+        record.new_dirname = new_dirname
 
+        record.new_extension = sys.intern(self._new_primary_extension(record.orig_extension))
 
-def __parse_args():
+    def _dir_index(self, dirname):
+        """index of a directory: basename (up to the first dot) -> sorted list of
+        (file name, is directory), built with one single scan per directory
+        (with a memory budget: per use, only the recently used indexes are kept)"""
+        try:
+            index = self._dir_indexes[dirname]
+        except KeyError:
+            pass
+        else:
+            self._dir_indexes.move_to_end(dirname)
+            return index
+
+        index = {}
+        self._count('directory_scans')
+        try:
+            with os.scandir(dirname) as entries:
+                for entry in entries:
+                    basename = entry.name.split('.', 1)[0]
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    index.setdefault(basename, []).append((entry.name, is_dir))
+        except FileNotFoundError:
+            # e.g. a date directory which is not created yet
+            pass
+        except OSError as err:
+            if not self.is_silent():
+                errorprint(f"WARNING: can't read directory {dirname}: {err}")
+        for names in index.values():
+            names.sort()
+        self._dir_indexes[dirname] = index
+        if self.get_memory_budget() is not None \
+                and len(self._dir_indexes) > _DIR_INDEX_CACHE_SIZE:
+            self._dir_indexes.popitem(last=False)
+        return index
+
+    def _companion_kind(self, extension):
+        """kind of an associated file which belongs to one picture only:
+        the raw file of a JPEG picture or the JPEG file of a raw picture (else None)"""
+        if self.use_raw_primary():
+            return 'jpg' if extension in self.get_jpg_input_extensions() else None
+        return 'raw' if extension in self.get_raw_extensions() else None
+
+    def _organize_extra_files(self, pic):
+        """organize new paths for the associated files,
+        returns the keys of the associated files"""
+        extracounter = 0
+        extras = []
+
+        record = self._pic_dict[pic]
+        orig_dirname = record.orig_dirname
+        orig_basename = record.orig_basename
+        orig_filename = orig_basename + record.orig_extension
+
+        # all files with the name {orig_basename}.* (not {orig_basename} without extension)
+        for extrafilename, is_dir in self._dir_index(orig_dirname).get(orig_basename, ()):
+            if extrafilename in (orig_filename, orig_basename) or is_dir:
+                continue  # next file
+            if self.get_memory_budget() is not None \
+                    and splitext_last(extrafilename)[1] in self._primary_extensions():
+                # a picture of its own (with a memory budget the path index
+                # knows only the pictures of the current timestamp)
+                continue
+            extrafile = os.path.join(orig_dirname, extrafilename)
+
+            _, extension = splitext_all(extrafilename)
+            new_extension = extension.lower()
+
+            # raw (or the JPEG of a raw picture)
+            kind = self._companion_kind(splitext_last(extrafilename)[1])
+            if kind:
+                extra = f"{pic}_{kind}"
+                if kind == 'jpg':
+                    new_extension = self._new_jpg_extension()
+                if record.duplicate:
+                    # check if the first picture (or a following) file
+                    # already "claimed" this raw file
+                    if self._picdict_has_orig_filepath(extrafile):
+                        continue
+
+                    # ok, we did look, nobody has this file so we keep it ...
+
+            else:  # xmp, xml, txt, ...
+                if self._picdict_has_orig_filepath(extrafile):
+                    continue
+
+                kind = 'sidecar'
+                extra = f"{pic}_{extracounter}"
+                extracounter += 1
+
+            self._picdict_add(extra, FileRecord(
+                kind, orig_dirname, orig_basename, extension,
+                new_dirname=record.new_dirname,
+                new_basename=record.new_basename,
+                new_extension=sys.intern(new_extension),
+            ))
+            extras.append(extra)
+        return extras
+
+    def clean_stored_data(self):
+        """cleanup stored data"""
+        self._pic_dict = {}
+        self._orig_path_index.clear()
+        self._dir_indexes.clear()
+        self._duplicate_counter.clear()
+        self._known_dirs.clear()
+        self._last_serial = 0
+
+    def _check_filelist(self, filelist):
+        """for single files we don't require a list (exits for other types)"""
+        if isinstance(filelist, str):
+            return [filelist]
+        if not isinstance(filelist, collections.abc.Iterable):
+            if not self.is_silent():
+                errorprint("Error: expected list of files ")
+            sys.exit(1)
+        return filelist
+
+    def exipicrename(self, filelist):
+        """Read exif data from (filelist) pictures,
+        rename them and associated files (e.g. raw files, xmp files, ... ).
+        input should be a list of filenames (one single filenames as string is also accepted),
+        any other iterable (e.g. iter_files()) is read lazily"""
+        # read exif data from picture files and store this data in the picture store
+        filelist = self._check_filelist(filelist)
+
+        # the settings and the picture store belong to this run until it is done
+        with self._lock:
+            self._stats['phases'].clear()
+            self._stats['counters'].clear()
+            self._take_camera_csv_signature()
+
+            if self.get_memory_budget() is not None:
+                self._exipicrename_in_runs(filelist)
+                return
+
+            if self.get_cache_file():
+                self._cache_open()
+            try:
+                with self._phase('read'):
+                    self._read_picture_data(filelist)
+
+                if self.is_verbose():
+                    self._print_duplicate_histogram()
+
+                # analyse what jpg files we've got and find accociate files
+                # write all to the picture store
+                with self._phase('organize'):
+                    self._organize_picture_data()
+            finally:
+                self._cache_close()
+
+            # now do the renaming (based on all stored data in the picture store)
+            with self._phase('rename'):
+                self._rename_files()
+
+            # the directory index is outdated after the renaming
+            self._dir_indexes.clear()
+
+            # for use as a module: clean up stored data from the picture store
+            if self.do_clean_data_after_run():
+                self.clean_stored_data()
+
+    def _exipicrename_in_runs(self, filelist):
+        """exipicrename() with a memory budget: the pictures are read into sorted runs,
+        the merged pictures are organized and renamed in steps of the memory budget"""
+        if self.get_cache_file():
+            self._cache_open()
+        try:
+            with tempfile.TemporaryDirectory(prefix='exipicrename-') as directory:
+                with self._phase('read'):
+                    runs, count = self._spill_sorted_runs(filelist, directory)
+                operations = self._iter_operations(self._iter_merged_pictures(runs, count))
+                number = 0
+                while True:
+                    with self._phase('organize'):
+                        step = list(itertools.islice(operations, self.get_memory_budget()))
+                    if not step:
+                        break
+                    with self._phase('rename'):
+                        self._apply_operations([
+                            (number + index, operation.old, operation.new)
+                            for index, operation in enumerate(step)])
+                    number += len(step)
+                    # the directory indexes of the renamed files are outdated
+                    for operation in step:
+                        self._dir_indexes.pop(os.path.dirname(operation.old), None)
+                        self._dir_indexes.pop(os.path.dirname(operation.new), None)
+        finally:
+            self._cache_close()
+            self.clean_stored_data()
+
+    def _iter_operations(self, pictures):
+        """yield the renames (RenameOperation) of the pictures (pairs of picture key
+        and keys of the associated files, see _iter_organized_pictures),
+        the records are dropped from the picture store once they are yielded"""
+        for pic, extras in pictures:
+            picture = self._pic_dict[pic]
+            for key in [pic] + extras:
+                record = self._pic_dict.pop(key)
+                oldname, newname = _record_paths(record)
+                if oldname != newname:
+                    yield RenameOperation(
+                        oldname, newname, record.kind, picture.serial, picture.duplicate)
+
+    def iter_plan(self, filelist):
+        """Read exif data from (filelist) pictures like exipicrename(), but rename nothing,
+        yield the planned renames of the pictures and their associated files
+        (RenameOperation) as soon as they are decided, in serial order
+        (with a memory budget: after the pictures are read into sorted runs).
+        The records of a picture are dropped from the picture store once they are yielded,
+        the renamer is locked until the iteration is done (see apply_plan)"""
+        filelist = self._check_filelist(filelist)
+
+        with self._lock:
+            self._stats['phases'].clear()
+            self._stats['counters'].clear()
+            self._take_camera_csv_signature()
+
+            if self.get_cache_file():
+                self._cache_open()
+            try:
+                if self.get_memory_budget() is not None:
+                    with tempfile.TemporaryDirectory(prefix='exipicrename-') as directory:
+                        with self._phase('read'):
+                            runs, count = self._spill_sorted_runs(filelist, directory)
+                        yield from self._iter_operations(self._iter_merged_pictures(runs, count))
+                    return
+
+                with self._phase('read'):
+                    self._read_picture_data(filelist)
+
+                if self.is_verbose():
+                    self._print_duplicate_histogram()
+
+                yield from self._iter_operations(self._iter_organized_pictures())
+            finally:
+                self._cache_close()
+                self.clean_stored_data()
+
+    def apply_plan(self, operations):
+        """rename the files of a plan: RenameOperation (e.g. a filtered iter_plan())
+        or (old path, new path) pairs (relative to the working directory or absolute),
+        no exif data is read. All sources must still exist and all targets must be free,
+        this is checked first (like in exipicrename()), the files of failed checks
+        are not renamed"""
+        with self._lock:
+            self._stats['phases'].clear()
+            self._stats['counters'].clear()
+
+            with self._phase('rename'):
+                self._apply_operations([
+                    (number, os.path.abspath(operation[0]), os.path.abspath(operation[1]))
+                    for number, operation in enumerate(operations)])
+
+            # the directory index is outdated after the renaming
+            self._dir_indexes.clear()
+            self._known_dirs.clear()
+
+    def watch(self, directory, interval: float = 1.0, stop: threading.Event = None):
+        """watch directory (a hot folder, not its sub-directories) and rename the pictures
+        (and associated files) which arrive there, the ones which are there already, too.
+        A file is renamed when its size and mtime did not change for interval seconds
+        (and no file with the same name is still changing). Serial and duplicate numbers
+        continue from one batch to the next, associated files which arrive after their
+        picture get its new name. Runs until stop is set (or KeyboardInterrupt)"""
+        directory = os.path.abspath(os.path.expanduser(directory))
+        stop = stop or threading.Event()
+        pending = {}    # file name -> ((size, mtime), time of the first look at it)
+        produced = set()    # new names in directory, they are no new files
+        renamed = {}    # original basename -> (new dirname, new basename)
+
+        with self._lock:
+            self._stats['phases'].clear()
+            self._stats['counters'].clear()
+            self.clean_stored_data()
+            self._take_camera_csv_signature()
+
+            watcher = _directory_watcher(directory)
+            if self.get_cache_file():
+                self._cache_open()
+            try:
+                while not stop.is_set():
+                    for name in watcher.changes(interval):
+                        if name in produced:
+                            produced.discard(name)
+                        else:
+                            pending[name] = (None, 0)
+                    ready = self._stable_files(directory, pending, interval)
+                    if ready:
+                        produced.update(self._rename_batch(directory, ready, renamed))
+            finally:
+                watcher.close()
+                self._cache_close()
+                self.clean_stored_data()
+
+    def _stable_files(self, directory, pending, settle):
+        """names of the pending files which did not change for settle seconds
+        (and no other file with the same basename did), they are removed from pending"""
+        now = time.monotonic()
+        stable = []
+        for name, (signature, since) in list(pending.items()):
+            self._count('stat_calls')
+            try:
+                stat = os.stat(os.path.join(directory, name))
+            except OSError:
+                # gone (e.g. renamed with its picture)
+                del pending[name]
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != signature:
+                pending[name] = ((stat.st_size, stat.st_mtime_ns), now)
+            elif now - since >= settle:
+                stable.append(name)
+
+        busy = {splitext_all(name)[0] for name in pending if name not in stable}
+        ready = sorted(name for name in stable if splitext_all(name)[0] not in busy)
+        for name in ready:
+            del pending[name]
+        return ready
+
+    def _rename_batch(self, directory, names, renamed):
+        """rename the new pictures in names (and their associated files),
+        the associated files in names which belong to pictures of earlier
+        batches (renamed: original basename -> (new dirname, new basename)) follow them,
+        returns the new file names in directory"""
+        pictures, late = [], []
+        for name in names:
+            if splitext_last(name)[1] in self._primary_extensions():
+                pictures.append(os.path.join(directory, name))
+            elif splitext_all(name)[0] in renamed:
+                late.append(name)
+
+        with self._phase('read'):
+            self._read_picture_data(pictures)
+        with self._phase('organize'):
+            for pic, _ in self._iter_organized_pictures():
+                record = self._pic_dict[pic]
+                self._last_serial = max(self._last_serial, record.serial)
+                renamed[record.orig_basename] = (record.new_dirname, record.new_basename)
+
+        operations = self._rename_operations()
+        for name in late:
+            basename, extension = splitext_all(name)
+            new_dirname, new_basename = renamed[basename]
+            if self._companion_kind(splitext_last(name)[1]) == 'jpg':
+                new_extension = self._new_jpg_extension()
+            else:
+                new_extension = extension.lower()
+            operations.append((len(operations), os.path.join(directory, name),
+                               f"{new_dirname}/{new_basename}{new_extension}"))
+        with self._phase('rename'):
+            self._apply_operations(operations)
+
+        # serial and duplicate numbers are kept for the next batch
+        self._pic_dict = {}
+        self._orig_path_index.clear()
+        self._dir_indexes.clear()
+        return {os.path.basename(newname) for _, _, newname in operations
+                if os.path.dirname(newname) == directory}
+
+
+# the module level functions use the default renamer
+_DEFAULT_RENAMER = Renamer()
+set_raw_extensions = _DEFAULT_RENAMER.set_raw_extensions
+get_raw_extensions = _DEFAULT_RENAMER.get_raw_extensions
+set_jpg_input_extensions = _DEFAULT_RENAMER.set_jpg_input_extensions
+get_jpg_input_extensions = _DEFAULT_RENAMER.get_jpg_input_extensions
+set_jpg_out_extension = _DEFAULT_RENAMER.set_jpg_out_extension
+get_jpg_out_extension = _DEFAULT_RENAMER.get_jpg_out_extension
+set_ooc_extension = _DEFAULT_RENAMER.set_ooc_extension
+get_ooc_extension = _DEFAULT_RENAMER.get_ooc_extension
+set_decimal_delimiter_ersatz = _DEFAULT_RENAMER.set_decimal_delimiter_ersatz
+get_decimal_delimiter_ersatz = _DEFAULT_RENAMER.get_decimal_delimiter_ersatz
+set_unwanted_character_ersatz = _DEFAULT_RENAMER.set_unwanted_character_ersatz
+get_unwanted_character_ersatz = _DEFAULT_RENAMER.get_unwanted_character_ersatz
+set_zero_value_ersatz = _DEFAULT_RENAMER.set_zero_value_ersatz
+get_zero_value_ersatz = _DEFAULT_RENAMER.get_zero_value_ersatz
+set_camera_rename_csv_name = _DEFAULT_RENAMER.set_camera_rename_csv_name
+get_camera_rename_csv_name = _DEFAULT_RENAMER.get_camera_rename_csv_name
+set_serial_length = _DEFAULT_RENAMER.set_serial_length
+get_serial_length = _DEFAULT_RENAMER.get_serial_length
+set_jobs = _DEFAULT_RENAMER.set_jobs
+get_jobs = _DEFAULT_RENAMER.get_jobs
+set_memory_budget = _DEFAULT_RENAMER.set_memory_budget
+get_memory_budget = _DEFAULT_RENAMER.get_memory_budget
+set_duplicate_action = _DEFAULT_RENAMER.set_duplicate_action
+get_duplicate_action = _DEFAULT_RENAMER.get_duplicate_action
+set_duplicate_marker = _DEFAULT_RENAMER.set_duplicate_marker
+get_duplicate_marker = _DEFAULT_RENAMER.get_duplicate_marker
+set_duplicate_dir = _DEFAULT_RENAMER.set_duplicate_dir
+set_target_root = _DEFAULT_RENAMER.set_target_root
+get_target_root = _DEFAULT_RENAMER.get_target_root
+set_transfer = _DEFAULT_RENAMER.set_transfer
+get_transfer = _DEFAULT_RENAMER.get_transfer
+get_duplicate_dir = _DEFAULT_RENAMER.get_duplicate_dir
+set_cache_file = _DEFAULT_RENAMER.set_cache_file
+get_cache_file = _DEFAULT_RENAMER.get_cache_file
+set_cache_max_entries = _DEFAULT_RENAMER.set_cache_max_entries
+get_cache_max_entries = _DEFAULT_RENAMER.get_cache_max_entries
+get_cache_stats = _DEFAULT_RENAMER.get_cache_stats
+set_profile = _DEFAULT_RENAMER.set_profile
+is_profile = _DEFAULT_RENAMER.is_profile
+get_profile_stats = _DEFAULT_RENAMER.get_profile_stats
+set_clean_data_after_run = _DEFAULT_RENAMER.set_clean_data_after_run
+do_clean_data_after_run = _DEFAULT_RENAMER.do_clean_data_after_run
+set_use_date_dir = _DEFAULT_RENAMER.set_use_date_dir
+use_date_dir = _DEFAULT_RENAMER.use_date_dir
+set_verbose = _DEFAULT_RENAMER.set_verbose
+is_verbose = _DEFAULT_RENAMER.is_verbose
+set_debug = _DEFAULT_RENAMER.set_debug
+is_debug = _DEFAULT_RENAMER.is_debug
+set_silent = _DEFAULT_RENAMER.set_silent
+is_silent = _DEFAULT_RENAMER.is_silent
+set_dry_run = _DEFAULT_RENAMER.set_dry_run
+is_dry_run = _DEFAULT_RENAMER.is_dry_run
+set_use_serial = _DEFAULT_RENAMER.set_use_serial
+use_serial = _DEFAULT_RENAMER.use_serial
+set_use_duplicate = _DEFAULT_RENAMER.set_use_duplicate
+use_duplicate = _DEFAULT_RENAMER.use_duplicate
+set_use_ooc = _DEFAULT_RENAMER.set_use_ooc
+use_ooc = _DEFAULT_RENAMER.use_ooc
+set_raw_primary = _DEFAULT_RENAMER.set_raw_primary
+use_raw_primary = _DEFAULT_RENAMER.use_raw_primary
+set_verify = _DEFAULT_RENAMER.set_verify
+is_verify = _DEFAULT_RENAMER.is_verify
+set_short_names = _DEFAULT_RENAMER.set_short_names
+use_short_names = _DEFAULT_RENAMER.use_short_names
+set_template = _DEFAULT_RENAMER.set_template
+get_template = _DEFAULT_RENAMER.get_template
+export_pic_dict = _DEFAULT_RENAMER.export_pic_dict
+print_profile_stats = _DEFAULT_RENAMER.print_profile_stats
+print_cache_stats = _DEFAULT_RENAMER.print_cache_stats
+iter_files = _DEFAULT_RENAMER.iter_files
+get_duplicate_histogram = _DEFAULT_RENAMER.get_duplicate_histogram
+clean_stored_data = _DEFAULT_RENAMER.clean_stored_data
+exipicrename = _DEFAULT_RENAMER.exipicrename
+iter_plan = _DEFAULT_RENAMER.iter_plan
+apply_plan = _DEFAULT_RENAMER.apply_plan
+watch = _DEFAULT_RENAMER.watch
+
+
+def _parse_args():  # pylint: disable=too-many-branches,too-many-statements
     "read and interpret commandline arguments with argparse"
 
     parser = argparse.ArgumentParser(
         description=__doc__,
         formatter_class=argparse.RawDescriptionHelpFormatter,
     )
-    parser.add_argument("file", nargs='+',
-                        help="jpeg files to rename")
+    parser.add_argument("file", nargs='*',
+                        help="jpeg files to rename (directories with --recursive)")
+    parser.add_argument("-r", "--recursive", action="store_true",
+                        help="rename the jpeg files in the given directories "
+                        "and their sub-directories")
+    parser.add_argument("--files-from", metavar="FILE",
+                        help="read names of files to rename from FILE ('-' for stdin), "
+                        "one per line or separated by NUL")
+    parser.add_argument("--plan-out", metavar="FILE",
+                        help="don't rename, write the rename plan as newline delimited "
+                        "JSON to FILE ('-' for stdout)")
+    parser.add_argument("--apply-plan", metavar="FILE",
+                        help="rename the files of a plan written by --plan-out "
+                        "(no exif data is read), FILE '-' for stdin")
+    parser.add_argument("--watch", metavar="DIR",
+                        help="watch DIR (not its sub-directories) and rename the pictures "
+                        "which arrive there until interrupted (Ctrl-C)")
+    parser.add_argument("--watch-interval", type=float, default=1.0, metavar="SECONDS",
+                        help="a file is renamed when it did not change for SECONDS "
+                        "(default: 1)")
+    parser.add_argument("--target-root", metavar="DIR",
+                        help="put the renamed pictures (and associated files) into DIR "
+                        "(or its date directories with --datedir) instead of their own directory")
+    parser.add_argument("--transfer", choices=TRANSFER_MODES,
+                        help="move (default), copy, hardlink or reflink (copy which shares the "
+                        "data blocks, if the file system can) the files to their new names")
     parser.add_argument("-d", "--datedir", action="store_true",
                         help="sort and store pictures to sub-directories"
                         "depending on DateTimeOriginal (YYYY-MM-DD)")
@@ -568,13 +2818,51 @@ def __parse_args():
     parser.add_argument("--oocstring", action="store",
                         help="use string as additional extension,"
                         " don't forget the '.' as delimiter")
+    parser.add_argument("--raw", "--raw-primary", action="store_true",
+                        help="rename tiff based raw files (ORF, NEF, ARW, CR2, DNG, ...) "
+                        "by their exif data, JPEG files with the same name are renamed with them")
     parser.add_argument("-s", "--short", "--short-names",
                         action="store_true",
                         help="use short names: only date + serial number, "
                         "no exhaustive camera data")
+    parser.add_argument("--template",
+                        help="template for new names (default depending on --short"
+                        + " and --no-serial), fields: "
+                        + ", ".join("{" + field + "}" for field in TEMPLATE_FIELDS))
+    parser.add_argument("--verify", action="store_true",
+                        help="read all pictures, also the ones which are named "
+                        "like this settings would name them already")
     parser.add_argument("-n", "--simulate", "--dry-run",
                         action="store_true",
                         help="don't rename, just show what would happen")
+    parser.add_argument("-j", "--jobs", type=int, metavar="N",
+                        help="number of worker threads to read exif data "
+                        "(default: depending on the number of cpus)")
+    parser.add_argument("--memory-budget", type=int, metavar="N",
+                        help="keep at most N pictures in memory (for archives larger than "
+                        "the memory): sort them in runs in temporary files, merge the runs "
+                        "and rename in steps of N files")
+    parser.add_argument("--duplicates", choices=DUPLICATE_ACTIONS,
+                        help="pictures with the same timestamp and the same content: "
+                        "number them like other pictures with the same timestamp (default), "
+                        "skip them, mark them with a string or move them aside")
+    parser.add_argument("--duplicate-string", metavar="STRING",
+                        help="string for --duplicates mark (default: DUPLICATE)")
+    parser.add_argument("--duplicate-dir", metavar="DIR",
+                        help="sub-directory for --duplicates move (default: duplicates)")
+    parser.add_argument("--cache", metavar="PATH",
+                        help="cache exif data in this sqlite file "
+                        "(unchanged pictures are not read again)")
+    parser.add_argument("--cache-size", type=int, metavar="N",
+                        help="keep at most N pictures in the cache (default: 1000000)")
+    parser.add_argument("--cache-stats", action="store_true",
+                        help="print cache hits and misses at the end")
+    parser.add_argument("--profile", "--stats", action="store_true",
+                        help="print seconds per phase and counters of file operations")
+    parser.add_argument("--profile-json", metavar="FILE",
+                        help="write the --profile statistics as JSON to FILE")
+    parser.add_argument("--cprofile", metavar="FILE",
+                        help="run with cProfile, write pstats data to FILE")
     parser.add_argument("--debug",
                         action="store_true",
                         help="debug")
@@ -592,6 +2880,16 @@ def __parse_args():
     group_verbose.add_argument("-v", "--verbose", action="store_true")
     group_verbose.add_argument("-q", "--quiet", "--silent", action="store_true")
     args = parser.parse_args()
+    if args.apply_plan:
+        if args.file or args.files_from or args.plan_out or args.watch:
+            parser.error("--apply-plan takes no files (and no --plan-out or --watch)")
+    elif args.watch:
+        if args.file or args.files_from or args.plan_out:
+            parser.error("--watch takes no files (and no --plan-out)")
+        if args.watch_interval <= 0:
+            parser.error("--watch-interval needs a positive number of seconds")
+    elif not args.file and not args.files_from:
+        parser.error("no files given")
     if args.no_serial:
         set_use_serial(False)
         set_use_duplicate(True)
@@ -610,8 +2908,44 @@ def __parse_args():
     if args.oocstring:
         set_ooc_extension(args.oocstring)
         set_use_ooc(True)
+    if args.raw:
+        set_raw_primary(True)
     if args.short:
         set_short_names(True)
+    if args.verify:
+        set_verify(True)
+    if args.template:
+        try:
+            set_template(args.template)
+        except ValueError as err:
+            parser.error(str(err))
+    if args.jobs is not None:
+        if args.jobs < 1:
+            parser.error("--jobs needs a number of at least 1")
+        set_jobs(args.jobs)
+    if args.memory_budget is not None:
+        try:
+            set_memory_budget(args.memory_budget)
+        except ValueError as err:
+            parser.error(str(err))
+    if args.duplicates:
+        set_duplicate_action(args.duplicates)
+    if args.duplicate_string:
+        set_duplicate_marker(args.duplicate_string)
+    if args.duplicate_dir:
+        set_duplicate_dir(args.duplicate_dir)
+    if args.target_root:
+        set_target_root(args.target_root)
+    if args.transfer:
+        set_transfer(args.transfer)
+    if args.cache:
+        set_cache_file(args.cache)
+    if args.cache_size is not None:
+        set_cache_max_entries(args.cache_size)
+    if args.cache_stats and not args.cache:
+        parser.error("--cache-stats needs --cache")
+    if args.profile or args.profile_json:
+        set_profile(True)
     if args.debug:
         logging.basicConfig(format='%(levelname)s:%(message)s', level=logging.DEBUG)
         set_debug(True)
@@ -627,252 +2961,70 @@ def __parse_args():
         dry_run: {is_dry_run()}
         use_date_dir: {use_date_dir()},
         use_ooc: {use_ooc()}
+        target_root: {get_target_root()}
+        transfer: {get_transfer()}
+        raw_primary: {use_raw_primary()}
         short_names: {use_short_names()}
+        template: {get_template()}
         use_serial: {use_serial()}
         use_duplicate: {use_duplicate()}
+        jobs: {get_jobs()}
         log_level: {logging.getLevelName(logging.getLogger().getEffectiveLevel())}
         """)
     if logging.getLogger().getEffectiveLevel() >= logging.INFO:
         logging.basicConfig(format='%(levelname)s:%(message)s')
-    return args.file
-
-
-def __read_picture_data(_filelist):
-    """ READ picture exif data, put it in dictionary __PIC_DICT"""
-
-    for orig_filepath in _filelist:
-        # ensure we only fetch jpg and jpeg and JPG and JPEG ...
-        _, extension = splitext_last(orig_filepath)
-        if extension not in get_jpg_input_extensions():
-            continue
-
-        orig_dirname, origfilename = os.path.split(orig_filepath)
-        orig_basename, orig_all_extensions = splitext_all(origfilename)
-        # the orig_dirname might be empty->absolute path
-        orig_dirname = os.path.abspath(os.path.expanduser(orig_dirname))
-        orig_filepath = os.path.join(orig_dirname, orig_basename + orig_all_extensions)
-
-        # ensure we don't read the same picture twice
-
-        if __picdict_has_orig_filepath(orig_filepath):
-            if is_verbose():
-                verboseprint(f"{orig_filepath} already processed")
-            continue
-
-        try:
-            with PIL.Image.open(orig_filepath) as picture:
-                timestamp, new_basename, date = __create_new_basename(picture)
-
-        except OSError:
-            if not is_silent():
-                errorprint(f"{orig_filepath} can't be opened as image")
-            continue
-
-        if new_basename:
-            duplicate = 0
-            # There might be other jpg arround with the same timestamp
-            # these might be either:
-            # * serial shots (same camera same second) or
-            # * parallel shots (other camera, same second)
-            # * same camera after a clock reset
-            # so we NEED to check first if this date is already claimed by an other shot
-            # and save both (the second gets a number > 0 in duplicate
-
-            while f"{timestamp}_{duplicate}" in __PIC_DICT:
-                duplicate += 1
+    return args
 
-            __PIC_DICT[f"{timestamp}_{duplicate}"] = {
-                'timestamp': timestamp,
-                'duplicate': duplicate,
-                'orig_basename': orig_basename,
-                'new_basename': new_basename,
-                'orig_dirname': orig_dirname,
-                'orig_extension': orig_all_extensions,
-                'date': date,
-            }
 
+def _write_plan_file(filename, filelist):
+    """write the rename plan of filelist to file filename ('-' for stdout)"""
+    if filename == '-':
+        write_plan(iter_plan(filelist), sys.stdout)
+        return
+    with open(filename, 'w', encoding='utf-8') as planfile:
+        number = write_plan(iter_plan(filelist), planfile)
+    verboseprint(f"{number} renames planned in {filename}")
 
-def __organize_picture_data():
-    """analyse what jpg files we've got and find accociate files"""
-
-    pic_list = sorted(__PIC_DICT)
-
-    # how long is my list? Is the default serial length long enough (do I have enough digits)?
-    serial_min_length = (len(str(len(pic_list))))
-
-    if serial_min_length > get_serial_length():
-        set_serial_length(serial_min_length)
-
-    # first serial NUMBER to be included into the new picture name
-    serial = 1
-
-    # walk now through all pictures to process them
-    for pic in pic_list:
-        orig_extension = __PIC_DICT[pic]['orig_extension']
-        extension = "." + orig_extension.split(".")[-1]
-
-        if extension in get_jpg_input_extensions():
-            __organize_jpg_files(pic, serial)
-            __organize_extra_files(pic)
-            serial += 1
-
-
-def __organize_jpg_files(pic, serial):
-    """organize new paths for the jpg files"""
-    orig_full_name = os.path.join(
-        __PIC_DICT[pic]['orig_dirname'],
-        __PIC_DICT[pic]['orig_basename'],
-    ) + \
-        __PIC_DICT[pic]['orig_extension']
-
-    duplicate = __PIC_DICT[pic]['duplicate']
-
-    # TODO BETTER DUBLICATE HANDLING            pylint: disable=fixme
-    # -> oldest file (mtime) should win "original without marker status"
-    # -> check if the content seems to be really the same
-    # -> real duplicates could be marked with a "DUPLICATE" string
-    # current status is first come first serve
-
-    __picdict_set_serial_once(pic, serial, get_serial_length())
-
-    orig_dirname, origfilename = os.path.split(orig_full_name)
-    orig_basename, orig_all_extensions = splitext_all(origfilename)
-    # the orig_dirname might be empty->expand to absolute path
-    orig_dirname = os.path.abspath(os.path.expanduser(orig_dirname))
-    __PIC_DICT[pic]['orig_dirname'] = orig_dirname
-    __PIC_DICT[pic]['orig_basename'] = orig_basename
-    __PIC_DICT[pic]['orig_extension'] = orig_all_extensions
-
-    # move files to other directory
-    if use_date_dir():
-
-        new_dirname = os.path.join(orig_dirname, __PIC_DICT[pic]['date'])
-
-        # is this directory already there
-        # is there something else what has this name but is no dir
-        # write the dir
-        # if problem, exit
-
-        if not os.path.isdir(new_dirname):
-            try:
-                if is_dry_run():
-                    if is_verbose():
-                        verboseprint("INFO: create new directory:"
-                                     + f" {new_dirname} (SIMULATION MODE)")
-                else:
-                    if is_verbose():
-                        verboseprint(f"INFO: create new directory: {new_dirname}")
-
-                    os.makedirs(new_dirname)
-
-            except FileExistsError:
-                errorprint(f'ERROR: There is a {new_dirname}, but it is not a directory')
-                sys.exit()
-
-    # don't move files to an other directory
-    else:
-        new_dirname = orig_dirname
-
-    __PIC_DICT[pic]['new_dirname'] = new_dirname
-
-    if duplicate and use_duplicate():
-        __PIC_DICT[pic]['new_basename'] = __PIC_DICT[pic]['new_basename'] + f'_{duplicate}'
-
-    if use_ooc():
-        __PIC_DICT[pic]['new_extension'] = get_ooc_extension() + get_jpg_out_extension()
-    else:
-        __PIC_DICT[pic]['new_extension'] = get_jpg_out_extension()
-
-
-def __organize_extra_files(pic):
-    """organize new paths for the associated files"""
-    extracounter = 0
-
-    orig_dirname = __PIC_DICT[pic]['orig_dirname']
-    new_dirname = __PIC_DICT[pic]['new_dirname']
-    orig_basename = __PIC_DICT[pic]['orig_basename']
-    orig_full_name = os.path.join(
-        __PIC_DICT[pic]['orig_dirname'],
-        __PIC_DICT[pic]['orig_basename'],
-    ) + \
-        __PIC_DICT[pic]['orig_extension']
-
-    duplicate = __PIC_DICT[pic]['duplicate']
-
-    for extrafile in glob.glob(f'{orig_dirname}/{orig_basename}.*'):
-        if extrafile == orig_full_name or os.path.isdir(extrafile):
-            continue  # next file
-
-        # raw
-        _, extension = splitext_last(extrafile)
-        if extension in get_raw_extensions():
-            extra = f"{pic}_raw"
-            if duplicate:
-                # check if the first jpg (or a following) file
-                # already "claimed" this raw file
-                if __picdict_has_orig_filepath(extrafile):
-                    continue
-
-                # ok, we did look, nobody has this file so we keep it ...
-
-        else:  # if not raw
-            if __picdict_has_orig_filepath(extrafile):
-                continue
-
-            extra = f"{pic}_{extracounter}"
-            _, extension = splitext_all(extrafile)
-
-        __PIC_DICT[extra] = {
-            'orig_dirname': orig_dirname,
-            'new_dirname': new_dirname,
-            'orig_basename': orig_basename,
-            'new_basename': __PIC_DICT[pic]['new_basename'],
-            'orig_extension': extension,
-            'new_extension': extension.lower(),
-        }
-
-        if extension not in get_raw_extensions():
-            extracounter += 1
-
-
-def clean_stored_data():
-    """cleanup stored data"""
-    global __PIC_DICT  # pylint: disable=global-statement
-    __PIC_DICT = {}
-
-
-def exipicrename(filelist):
-    """Read exif data from (filelist) pictures,
-    rename them and associated files (e.g. raw files, xmp files, ... ).
-    input should be a list of filenames (one single filenames as string is also accepted)"""
-    # read exif data from picture files and store this data in __PIC_DICT
-
-    # for single files we don't require a list
-    if not isinstance(filelist, list):
-        if isinstance(filelist, str):
-            filelist = [filelist]
-        else:
-            if not is_silent():
-                errorprint("Error: expected list of files ")
-            sys.exit(1)
-
-    __read_picture_data(filelist)
-
-    # analyse what jpg files we've got and find accociate files
-    # write all to __PIC_DICT
-    __organize_picture_data()
-
-    # now do the renaming (based on all stored data in __PIC_DICT)
-    __rename_files()
 
-    # for use as a module: clean up stored data from __PIC_DICT
-    if do_clean_data_after_run():
-        clean_stored_data()
+def _run_of_args(args):
+    """the function to run for the commandline arguments and its arguments"""
+    filelist = iter_files(args.file, args.recursive)
+    if args.files_from:
+        filelist = itertools.chain(filelist, iter_files_from(args.files_from))
+    if args.apply_plan:
+        return apply_plan, (read_plan(args.apply_plan),)
+    if args.watch:
+        return watch, (args.watch, args.watch_interval)
+    if args.plan_out:
+        return _write_plan_file, (args.plan_out, filelist)
+    return exipicrename, (filelist,)
 
 
 def main():
     """main - entry point for command line call"""
-    exipicrename(__parse_args())
+    args = _parse_args()
+    run, run_args = _run_of_args(args)
+    try:
+        if args.cprofile:
+            import cProfile  # pylint: disable=import-outside-toplevel
+            profiler = cProfile.Profile()
+            profiler.runcall(run, *run_args)
+            profiler.dump_stats(args.cprofile)
+        else:
+            run(*run_args)
+    except (OSError, ValueError) as err:
+        errorprint(f"ERROR: {err}")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        if not args.watch:
+            raise
+    if args.cache_stats and get_cache_file():
+        print_cache_stats()
+    if is_profile():
+        print_profile_stats()
+    if args.profile_json:
+        with open(args.profile_json, 'w', encoding='utf-8') as jsonfile:
+            json.dump(get_profile_stats(), jsonfile, indent=2)
 
 
 if __name__ == '__main__':
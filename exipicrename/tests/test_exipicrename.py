@@ -1,15 +1,31 @@
 #!/usr/bin/env python3
 
 """unittest for exipicrename"""
+# pylint: disable=too-many-lines
 import unittest
+import importlib
 import os
 import sys
+import threading
+import io
+import json
+import subprocess
+import struct
+import errno
+import filecmp
+import time
 from tempfile import TemporaryDirectory
 from shutil import copy
+from unittest import mock
+import PIL.Image
 # my test subject lives one dir up
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 import exipicrename   # pylint: disable=wrong-import-position
 
+# the module itself for its private names: exipicrename is the package under pytest,
+# it exports only the public names
+core = importlib.import_module(exipicrename.Renamer.__module__)
+
 # VERBOSE = True
 VERBOSE = False
 
@@ -163,6 +179,43 @@ class TestExipicrenameVirtual(unittest.TestCase):
         )
         exipicrename.clean_stored_data()
 
+    def test_rename_jobs(self):
+        """worker pool gives the same result as a sequential run (virtual)"""
+        exipicrename.set_dry_run(True)
+        exipicrename.set_silent(True)
+        exipicrename.set_clean_data_after_run(False)
+        results = []
+        for jobs in (1, 4):
+            exipicrename.set_jobs(jobs)
+            exipicrename.exipicrename(self.testfiles * 3)
+            results.append(exipicrename.export_pic_dict())
+            exipicrename.clean_stored_data()
+        exipicrename.set_jobs(None)
+        self.assertEqual(results[0], results[1])
+
+    def test_duplicate_histogram(self):
+        """count pictures with the same timestamp (virtual)"""
+        exipicrename.set_dry_run(True)
+        exipicrename.set_silent(True)
+        exipicrename.set_clean_data_after_run(False)
+        exipicrename.exipicrename(self.testfiles)
+        self.assertEqual(exipicrename.get_duplicate_histogram(), {1: 1, 2: 1})
+        exipicrename.clean_stored_data()
+        self.assertEqual(exipicrename.get_duplicate_histogram(), {})
+
+    def test_profile_stats(self):
+        """phase timing and counters (virtual)"""
+        exipicrename.set_dry_run(True)
+        exipicrename.set_silent(True)
+        exipicrename.set_profile(True)
+        exipicrename.exipicrename(self.testfiles)
+        exipicrename.set_profile(False)
+        stats = exipicrename.get_profile_stats()
+        self.assertEqual(list(stats['phases']), ['read', 'organize', 'rename', 'total'])
+        # x_test, y_test, yy_test and the empty z_test
+        self.assertEqual(stats['counters']['files_opened'], 4)
+        self.assertNotIn('renames', stats['counters'])
+
 
 def fill_tmpdir(temp_dir, source_dir, testfiles):
     """copy files to temporary testdir"""
@@ -368,6 +421,1234 @@ class TestExipicrenameReal(unittest.TestCase):
             tmpdirfiles.sort()
             self.assertEqual(defaultfiles, tmpdirfiles)
 
+    def test_rename_extra_files(self):
+        """associated files are found with special characters in the name,
+        directories with the same name are not renamed (real files in tmp env)"""
+
+        defaultfiles = [
+            "20090604_184453__001.jpg",
+            "20090604_184453__001.orf",
+            "20090604_184453__001.xml",
+            "x[1]_test.d",
+        ]
+
+        exipicrename.set_silent(True)
+        exipicrename.set_short_names(True)
+        exipicrename.set_use_ooc(False)
+        exipicrename.set_dry_run(False)
+        exipicrename.set_use_date_dir(False)
+        exipicrename.set_use_duplicate(True)
+        exipicrename.set_use_serial(True)
+
+        with TemporaryDirectory() as temp_dir:
+            for _file in ('x_test.jpg', 'x_test.orf', 'x_test.xml'):
+                copy(self.source_dir + _file, os.path.join(temp_dir, _file.replace('x_', 'x[1]_')))
+            os.mkdir(os.path.join(temp_dir, 'x[1]_test.d'))
+
+            exipicrename.exipicrename([os.path.join(temp_dir, 'x[1]_test.jpg')])
+
+            tmpdirfiles = os.listdir(temp_dir)
+            tmpdirfiles.sort()
+            self.assertEqual(defaultfiles, tmpdirfiles)
+
+    def test_file_without_extension(self):
+        """a file with the basename but without extension is no associated file"""
+        renamer = exipicrename.Renamer()
+        renamer.set_silent(True)
+        renamer.set_short_names(True)
+        with TemporaryDirectory() as temp_dir:
+            copy(self.source_dir + 'x_test.jpg', temp_dir)
+            copy(self.source_dir + 'x_test.xml', os.path.join(temp_dir, 'x_test'))
+            plan = list(renamer.iter_plan([os.path.join(temp_dir, 'x_test.jpg')]))
+            self.assertEqual([os.path.basename(operation.old) for operation in plan],
+                             ['x_test.jpg'])
+
+    def test_tiff_named_jpg(self):
+        """a TIFF file named .jpg has no exif info, the other pictures are renamed"""
+        renamer = exipicrename.Renamer()
+        renamer.set_silent(True)
+        renamer.set_short_names(True)
+        with TemporaryDirectory() as temp_dir:
+            for _file in ('tiff_test.jpg', 'x_test.jpg'):
+                copy(self.source_dir + _file, temp_dir)
+            renamer.exipicrename(renamer.iter_files([temp_dir], recursive=True))
+            self.assertEqual(sorted(os.listdir(temp_dir)),
+                             ['20090604_184453__001.jpg', 'tiff_test.jpg'])
+
+    def test_raw_claimed_once(self):
+        """a raw file belongs only to the first picture with the same basename"""
+
+        exipicrename.set_silent(True)
+        exipicrename.set_short_names(True)
+        exipicrename.set_dry_run(True)
+        exipicrename.set_use_date_dir(False)
+        exipicrename.set_clean_data_after_run(False)
+
+        with TemporaryDirectory() as temp_dir:
+            copy(self.source_dir + 'x_test.jpg', os.path.join(temp_dir, 'a.jpg'))
+            copy(self.source_dir + 'x_test.jpg', os.path.join(temp_dir, 'a.jpeg'))
+            copy(self.source_dir + 'x_test.orf', os.path.join(temp_dir, 'a.orf'))
+
+            exipicrename.exipicrename([os.path.join(temp_dir, 'a.jpg'),
+                                       os.path.join(temp_dir, 'a.jpeg')])
+            e_dict = exipicrename.export_pic_dict()
+
+        exipicrename.set_dry_run(False)
+        exipicrename.set_clean_data_after_run(True)
+        exipicrename.clean_stored_data()
+
+        self.assertIn('20090604_184453_0_raw', e_dict)
+        self.assertNotIn('20090604_184453_1_raw', e_dict)
+
+    def test_rename_silent_no_overwrite(self):
+        """existing files are not overwritten, also in silent mode,
+        all files are renamed with a pool of workers (real files in tmp env)"""
+
+        exipicrename.set_silent(True)
+        exipicrename.set_short_names(True)
+        exipicrename.set_use_ooc(False)
+        exipicrename.set_dry_run(False)
+        exipicrename.set_use_date_dir(True)
+        exipicrename.set_use_duplicate(True)
+        exipicrename.set_use_serial(True)
+        exipicrename.set_jobs(4)
+
+        with TemporaryDirectory() as temp_dir:
+            fill_tmpdir(temp_dir, self.source_dir, self.testfiles)
+            os.mkdir(os.path.join(temp_dir, '2009-06-04'))
+            with open(os.path.join(temp_dir, '2009-06-04', '20090604_184453__001.jpg'),
+                      'w', encoding='utf-8') as existing:
+                existing.write('do not overwrite')
+
+            realfiles = [temp_dir + "/" + e for e in os.listdir(temp_dir)]
+            exipicrename.exipicrename(realfiles)
+            exipicrename.set_jobs(None)
+
+            self.assertTrue(os.path.isfile(os.path.join(temp_dir, 'x_test.jpg')))
+            with open(os.path.join(temp_dir, '2009-06-04', '20090604_184453__001.jpg'),
+                      encoding='utf-8') as existing:
+                self.assertEqual(existing.read(), 'do not overwrite')
+            self.assertEqual(
+                sorted(os.listdir(os.path.join(temp_dir, '2017-11-23'))),
+                ['20171123_164006__002.jpg', '20171123_164006__003_1.jpg'])
+
+    def test_rename_same_new_name(self):
+        """two pictures which would get the same name:
+        only the first one is renamed (real files in tmp env)"""
+
+        defaultfiles = [
+            "20090604_184453__e-520__25mm__f2-8__t3200__iso100.jpg",
+            "20090604_184453__e-520__25mm__f2-8__t3200__iso100.orf",
+            "20090604_184453__e-520__25mm__f2-8__t3200__iso100.xml",
+            "20171123_164006__s4mini__3mm__f2-6__t17__iso125.jpg",
+            "yy_test.jpg",
+            'z_test.jpg'
+        ]
+
+        exipicrename.set_silent(True)
+        exipicrename.set_short_names(False)
+        exipicrename.set_use_ooc(False)
+        exipicrename.set_dry_run(False)
+        exipicrename.set_use_date_dir(False)
+        exipicrename.set_use_duplicate(False)
+        exipicrename.set_use_serial(False)
+
+        with TemporaryDirectory() as temp_dir:
+            fill_tmpdir(temp_dir, self.source_dir, self.testfiles)
+            realfiles = [temp_dir + "/" + e for e in sorted(os.listdir(temp_dir))]
+            exipicrename.exipicrename(realfiles)
+            exipicrename.set_use_duplicate(True)
+            exipicrename.set_use_serial(True)
+
+            tmpdirfiles = os.listdir(temp_dir)
+            tmpdirfiles.sort()
+            self.assertEqual(defaultfiles, tmpdirfiles)
+
+
+class TestExifReader(unittest.TestCase):
+    """unittest class for the built-in exif header reader"""
+
+    test_dir, _ = os.path.split(os.path.abspath(__file__))
+
+    def test_same_as_pillow(self):
+        """built-in reader returns the same values as Pillow"""
+        for testfile in ('x_test.jpg', 'y_test.jpg'):
+            filepath = os.path.join(self.test_dir, 'fixtures', testfile)
+            exif = exipicrename.read_jpeg_exif(filepath)
+            with PIL.Image.open(filepath) as img:
+                pil_exif = img._getexif()  # pylint: disable=protected-access
+            for tag, name in exipicrename.EXIF_TAGS.items():
+                if tag not in pil_exif:
+                    self.assertNotIn(name, exif, f"{testfile}: {name}")
+                    continue
+                value = pil_exif[tag]
+                if hasattr(value, 'denominator') and not isinstance(value, int):
+                    value = (value.numerator, value.denominator)
+                self.assertEqual(exif[name], value, f"{testfile}: {name}")
+
+    def test_no_exif(self):
+        """files without exif segment"""
+        for testfile in ('z_test.jpg', 'x_test.orf'):
+            filepath = os.path.join(self.test_dir, 'fixtures', testfile)
+            self.assertIsNone(exipicrename.read_jpeg_exif(filepath))
+
+    def test_parse_exif_datetime(self):
+        """single pass date time parser, same result as strptime"""
+        for value in ('2009:06:04 18:44:53', '2024:02:29 23:59:59', '2009:6:4 18:44:53'):
+            self.assertEqual(exipicrename.parse_exif_datetime(value), (
+                exipicrename.format_datetime(value), exipicrename.format_date(value)))
+        self.assertEqual(exipicrename.parse_exif_datetime('2009:06:04 18:44:53\x00'),
+                         ('20090604_184453', '2009-06-04'))
+        self.assertEqual(exipicrename.parse_exif_datetime('2009:06:04 18:44'),
+                         ('20090604_184400', '2009-06-04'))
+        self.assertIsNone(exipicrename.parse_exif_datetime('0000:00:00 00:00:00'))
+        self.assertIsNone(exipicrename.parse_exif_datetime('    :  :     :  :  '))
+        for value in ('2023:02:29 10:00:00', '2009:13:01 10:00:00', 'no date'):
+            with self.assertRaises(ValueError):
+                exipicrename.parse_exif_datetime(value)
+
+
+class TestExifCache(unittest.TestCase):
+    """unittest class for the exif metadata cache (virtual)"""
+
+    test_dir, _ = os.path.split(os.path.abspath(__file__))
+
+    testfiles = [
+        test_dir + '/fixtures/x_test.jpg',
+        test_dir + '/fixtures/y_test.jpg',
+        test_dir + '/fixtures/z_test.jpg',
+    ]
+
+    def setUp(self):
+        exipicrename.set_dry_run(True)
+        exipicrename.set_silent(True)
+        exipicrename.set_short_names(False)
+        exipicrename.set_clean_data_after_run(False)
+        exipicrename.set_jobs(1)
+
+    def tearDown(self):
+        exipicrename.set_cache_file(None)
+        exipicrename.set_cache_max_entries()
+        exipicrename.set_jobs(None)
+        exipicrename.set_dry_run(False)
+        exipicrename.set_clean_data_after_run(True)
+        exipicrename.clean_stored_data()
+
+    def __run(self):
+        exipicrename.exipicrename(self.testfiles)
+        result = exipicrename.export_pic_dict()
+        exipicrename.clean_stored_data()
+        return result
+
+    def test_cache_hits(self):
+        """second run takes the exif data from the cache"""
+        with TemporaryDirectory() as temp_dir:
+            exipicrename.set_cache_file(os.path.join(temp_dir, 'cache.sqlite'))
+            first = self.__run()
+            self.assertEqual(exipicrename.get_cache_stats()['hits'], 0)
+            self.assertEqual(exipicrename.get_cache_stats()['stored'], 2)
+            second = self.__run()
+            self.assertEqual(exipicrename.get_cache_stats()['hits'], 2)
+            self.assertEqual(exipicrename.get_cache_stats()['misses'], 1)
+            self.assertEqual(first, second)
+
+    def test_cache_settings_once(self):
+        """the settings of the cache entries are taken once per run, not per picture"""
+        cache_settings = exipicrename.Renamer._cache_settings  # pylint: disable=protected-access
+        with TemporaryDirectory() as temp_dir:
+            exipicrename.set_cache_file(os.path.join(temp_dir, 'cache.sqlite'))
+            with mock.patch.object(exipicrename.Renamer, '_cache_settings', autospec=True,
+                                   side_effect=cache_settings) as settings:
+                self.__run()
+                self.__run()
+            self.assertEqual(exipicrename.get_cache_stats()['hits'], 2)
+            self.assertEqual(settings.call_count, 2)
+
+    def test_cache_settings_changed(self):
+        """cache entries are not used after a change of the settings"""
+        with TemporaryDirectory() as temp_dir:
+            exipicrename.set_cache_file(os.path.join(temp_dir, 'cache.sqlite'))
+            self.__run()
+            exipicrename.set_short_names(True)
+            self.__run()
+            exipicrename.set_short_names(False)
+            self.assertEqual(exipicrename.get_cache_stats()['hits'], 0)
+            self.assertEqual(exipicrename.get_cache_stats()['stale'], 2)
+
+    def test_cache_camera_csv_changed(self):
+        """cache entries are not used after an edit of the camera translation csv"""
+        with TemporaryDirectory() as temp_dir:
+            csv_file = os.path.join(temp_dir, 'cameras.csv')
+            with open(csv_file, 'w', encoding='utf-8') as csvfile:
+                csvfile.write("# no rules yet\n")
+            exipicrename.set_camera_rename_csv_name(csv_file)
+            try:
+                exipicrename.set_cache_file(os.path.join(temp_dir, 'cache.sqlite'))
+                first = self.__run()
+                with open(csv_file, 'a', encoding='utf-8') as csvfile:
+                    csvfile.write("e-520,olympus\n")
+                os.utime(csv_file, ns=(0, os.stat(csv_file).st_mtime_ns + 10**9))
+                second = self.__run()
+                self.assertEqual(exipicrename.get_cache_stats()['hits'], 0)
+                self.assertEqual(exipicrename.get_cache_stats()['stale'], 2)
+                # the edited csv is read again, also by the cached entries
+                third = self.__run()
+                self.assertEqual(exipicrename.get_cache_stats()['hits'], 2)
+            finally:
+                exipicrename.set_camera_rename_csv_name(
+                    os.path.join(os.path.dirname(exipicrename.__file__),
+                                 "camera-model-rename.csv"))
+            self.assertIn('__e-520__', first['20090604_184453_0']['new_basename'])
+            self.assertIn('__olympus__', second['20090604_184453_0']['new_basename'])
+            self.assertEqual(second, third)
+
+    def test_cache_eviction(self):
+        """cache does not grow over its maximum size"""
+        with TemporaryDirectory() as temp_dir:
+            exipicrename.set_cache_file(os.path.join(temp_dir, 'cache.sqlite'))
+            exipicrename.set_cache_max_entries(1)
+            self.__run()
+            self.assertEqual(exipicrename.get_cache_stats()['evictions'], 1)
+            self.__run()
+            self.assertEqual(exipicrename.get_cache_stats()['hits'], 1)
+
+
+class TestInputFiles(unittest.TestCase):
+    """unittest class for the input file generators"""
+
+    def test_iter_files_recursive(self):
+        """JPEG files in directories and sub-directories"""
+        with TemporaryDirectory() as temp_dir:
+            os.makedirs(os.path.join(temp_dir, 'b', 'c'))
+            for _file in ('a.jpg', 'a.orf', 'b/b.JPG', 'b/c/c.jpeg', 'b/c/c.xml'):
+                with open(os.path.join(temp_dir, _file), 'w', encoding='utf-8'):
+                    pass
+            found = list(exipicrename.iter_files([temp_dir], recursive=True))
+            self.assertEqual(found, [os.path.join(temp_dir, _file)
+                                     for _file in ('a.jpg', 'b/b.JPG', 'b/c/c.jpeg')])
+            exipicrename.set_silent(True)
+            self.assertEqual(list(exipicrename.iter_files([temp_dir])), [])
+
+    def test_iter_files_from(self):
+        """file lists separated by newlines or NUL"""
+        with TemporaryDirectory() as temp_dir:
+            listfile = os.path.join(temp_dir, 'list')
+            for content in (b'a b.jpg\nc.jpg\n', b'a b.jpg\r\nc.jpg', b'a b.jpg\0c.jpg\0'):
+                with open(listfile, 'wb') as _file:
+                    _file.write(content)
+                self.assertEqual(list(exipicrename.iter_files_from(listfile)),
+                                 ['a b.jpg', 'c.jpg'])
+
+
+class TestCameraNames(unittest.TestCase):
+    """unittest class for the camera name translation csv (virtual)"""
+
+    test_dir, _ = os.path.split(os.path.abspath(__file__))
+
+    testfiles = [
+        test_dir + '/fixtures/x_test.jpg',   # e520
+        test_dir + '/fixtures/y_test.jpg',   # s4mini
+    ]
+
+    def setUp(self):
+        exipicrename.set_dry_run(True)
+        exipicrename.set_silent(True)
+        exipicrename.set_short_names(False)
+        exipicrename.set_clean_data_after_run(False)
+        self.csv_file = exipicrename.get_camera_rename_csv_name()
+
+    def tearDown(self):
+        exipicrename.set_camera_rename_csv_name(self.csv_file)
+        exipicrename.set_dry_run(False)
+        exipicrename.set_clean_data_after_run(True)
+        exipicrename.clean_stored_data()
+
+    def __cameras(self):
+        exipicrename.exipicrename(self.testfiles)
+        result = sorted(value['new_basename'].split('__')[2]
+                        for value in exipicrename.export_pic_dict().values()
+                        if value['orig_extension'] == '.jpg')
+        exipicrename.clean_stored_data()
+        return result
+
+    def test_csv_comments_and_patterns(self):
+        """comment rows are skipped, pattern rules are used after exact names"""
+        with TemporaryDirectory() as temp_dir:
+            csv_file = os.path.join(temp_dir, 'cameras.csv')
+            with open(csv_file, 'w', encoding='utf-8') as csv:
+                csv.write("# e-520,comment\n")
+                csv.write("re:e-[0-9]+,olympus\n")
+                csv.write("re:gt-i91[0-9]+,galaxy\n")
+                csv.write("gt-i9195,s4mini\n")
+            exipicrename.set_camera_rename_csv_name(csv_file)
+            self.assertEqual(self.__cameras(), ['olympus', 's4mini'])
+
+    def test_csv_missing_read_once(self):
+        """a missing csv is only tried once, names are not translated"""
+        exipicrename.set_camera_rename_csv_name(os.path.join(self.test_dir, 'missing.csv'))
+        with mock.patch('builtins.open', wraps=open) as mock_open:
+            self.assertEqual(self.__cameras(), ['e-520', 'gt-i9195'])
+            self.assertEqual(self.__cameras(), ['e-520', 'gt-i9195'])
+            opened = [call for call in mock_open.call_args_list
+                      if call.args[0].endswith('missing.csv')]
+        self.assertEqual(len(opened), 1)
+
+
+class TestPlan(unittest.TestCase):
+    """unittest class for iter_plan / apply_plan (real files in tmp env)"""
+
+    test_dir, _ = os.path.split(os.path.abspath(__file__))
+    source_dir = test_dir + "/fixtures/"
+
+    def setUp(self):
+        self.renamer = exipicrename.Renamer()
+        self.renamer.set_silent(True)
+        self.renamer.set_short_names(True)
+
+    def __plan(self, temp_dir):
+        for _file in ('x_test.jpg', 'x_test.orf', 'x_test.xml', 'y_test.jpg', 'yy_test.jpg'):
+            copy(self.source_dir + _file, temp_dir)
+        files = sorted(os.listdir(temp_dir))
+        plan = list(self.renamer.iter_plan(
+            [os.path.join(temp_dir, _file) for _file in files if _file.endswith('.jpg')]))
+        self.assertEqual(sorted(os.listdir(temp_dir)), files)
+        return plan
+
+    def test_iter_plan(self):
+        """the plan is yielded in serial order, nothing is renamed"""
+        with TemporaryDirectory() as temp_dir:
+            plan = self.__plan(temp_dir)
+            self.assertEqual([
+                (os.path.basename(operation.old), os.path.basename(operation.new),
+                 operation.kind, operation.serial, operation.duplicate)
+                for operation in plan], [
+                ('x_test.jpg', '20090604_184453__001.jpg', 'jpg', 1, 0),
+                ('x_test.orf', '20090604_184453__001.orf', 'raw', 1, 0),
+                ('x_test.xml', '20090604_184453__001.xml', 'sidecar', 1, 0),
+                ('y_test.jpg', '20171123_164006__002.jpg', 'jpg', 2, 0),
+                ('yy_test.jpg', '20171123_164006__003_1.jpg', 'jpg', 3, 1),
+            ])
+            self.assertEqual(self.renamer.export_pic_dict(), {})
+
+    def test_apply_plan(self):
+        """a filtered plan is applied, missing sources are not renamed"""
+        with TemporaryDirectory() as temp_dir:
+            plan = self.__plan(temp_dir)
+            os.remove(os.path.join(temp_dir, 'yy_test.jpg'))
+            self.renamer.apply_plan(
+                operation for operation in plan if operation.kind != 'sidecar')
+            self.assertEqual(sorted(os.listdir(temp_dir)), [
+                '20090604_184453__001.jpg',
+                '20090604_184453__001.orf',
+                '20171123_164006__002.jpg',
+                'x_test.xml',
+            ])
+
+    def test_apply_plan_relative(self):
+        """(old, new) pairs relative to the working directory"""
+        cwd = os.getcwd()
+        with TemporaryDirectory() as temp_dir:
+            copy(self.source_dir + 'x_test.jpg', os.path.join(temp_dir, 'a.jpg'))
+            os.chdir(temp_dir)
+            try:
+                self.renamer.apply_plan([('a.jpg', 'b.jpg')])
+            finally:
+                os.chdir(cwd)
+            self.assertEqual(os.listdir(temp_dir), ['b.jpg'])
+
+    def test_plan_file(self):
+        """a plan written as NDJSON is applied later"""
+        with TemporaryDirectory() as temp_dir:
+            plan_file = io.StringIO()
+            self.assertEqual(exipicrename.write_plan(self.__plan(temp_dir), plan_file), 5)
+            plan_path = os.path.join(temp_dir, 'plan.ndjson')
+            with open(plan_path, 'w', encoding='utf-8') as planfile:
+                planfile.write(plan_file.getvalue())
+            self.renamer.apply_plan(exipicrename.read_plan(plan_path))
+            self.assertEqual(sorted(os.listdir(temp_dir)), [
+                '20090604_184453__001.jpg',
+                '20090604_184453__001.orf',
+                '20090604_184453__001.xml',
+                '20171123_164006__002.jpg',
+                '20171123_164006__003_1.jpg',
+                'plan.ndjson',
+            ])
+
+            with open(plan_path, 'w', encoding='utf-8') as planfile:
+                planfile.write('{"old": "a.jpg", "new": "b.jpg", "kind": "jpg",'
+                               ' "serial": 1, "duplicate": 0}\n')
+            self.assertEqual([(operation.old, operation.new)
+                              for operation in exipicrename.read_plan(plan_path)],
+                             [(os.path.abspath('a.jpg'), os.path.abspath('b.jpg'))])
+
+            with open(plan_path, 'a', encoding='utf-8') as planfile:
+                planfile.write('{"old": "a.jpg"}\n')
+            with self.assertRaises(ValueError):
+                list(exipicrename.read_plan(plan_path))
+
+
+class TestNamedAlready(unittest.TestCase):
+    """unittest class for pictures which are named already (real files in tmp env)"""
+
+    test_dir, _ = os.path.split(os.path.abspath(__file__))
+    source_dir = test_dir + "/fixtures/"
+
+    def setUp(self):
+        self.renamer = exipicrename.Renamer()
+        self.renamer.set_silent(True)
+        self.renamer.set_short_names(True)
+        self.renamer.set_profile(True)
+
+    def __rename_twice(self, temp_dir):
+        """rename x_test, y_test, then again with yy_test (same timestamp as y_test)
+        returns the number of opened files of the second run"""
+        for _file in ('x_test.jpg', 'x_test.xml', 'y_test.jpg'):
+            copy(self.source_dir + _file, temp_dir)
+        self.renamer.exipicrename(self.renamer.iter_files([temp_dir], recursive=True))
+        copy(self.source_dir + 'yy_test.jpg', temp_dir)
+        self.renamer.exipicrename(self.renamer.iter_files([temp_dir], recursive=True))
+        return self.renamer.get_profile_stats()['counters'].get('files_opened', 0)
+
+    def test_skip_named_already(self):
+        """only the new picture is read, it gets the next serial and a duplicate number"""
+        with TemporaryDirectory() as temp_dir:
+            self.assertEqual(self.__rename_twice(temp_dir), 1)
+            self.assertEqual(sorted(os.listdir(temp_dir)), [
+                '20090604_184453__001.jpg',
+                '20090604_184453__001.xml',
+                '20171123_164006__002.jpg',
+                '20171123_164006__003_1.jpg',
+            ])
+
+    def test_other_settings(self):
+        """names of other settings (not short, date dir) are not skipped"""
+        with TemporaryDirectory() as temp_dir:
+            copy(self.source_dir + 'x_test.jpg', temp_dir)
+            self.renamer.exipicrename(self.renamer.iter_files([temp_dir], recursive=True))
+            self.renamer.set_use_date_dir(True)
+            self.renamer.exipicrename(self.renamer.iter_files([temp_dir], recursive=True))
+            self.assertEqual(self.renamer.get_profile_stats()['counters']['files_opened'], 1)
+            self.assertEqual(os.listdir(os.path.join(temp_dir, '2009-06-04')),
+                             ['20090604_184453__001.jpg'])
+
+    def test_verify(self):
+        """with verify all pictures are read"""
+        self.renamer.set_verify(True)
+        with TemporaryDirectory() as temp_dir:
+            self.assertEqual(self.__rename_twice(temp_dir), 3)
+            self.assertEqual(sorted(os.listdir(temp_dir)), [
+                '20090604_184453__001.jpg',
+                '20090604_184453__001.xml',
+                '20171123_164006__002.jpg',
+                '20171123_164006__003_1.jpg',
+            ])
+
+
+class TestRenamer(unittest.TestCase):
+    """unittest class for independent Renamer objects (virtual)"""
+
+    test_dir, _ = os.path.split(os.path.abspath(__file__))
+
+    testfiles = [
+        test_dir + '/fixtures/x_test.jpg',   # e520
+        test_dir + '/fixtures/y_test.jpg',   # s4mini
+    ]
+
+    @staticmethod
+    def __renamer(short_names):
+        renamer = exipicrename.Renamer()
+        renamer.set_dry_run(True)
+        renamer.set_silent(True)
+        renamer.set_short_names(short_names)
+        renamer.set_clean_data_after_run(False)
+        return renamer
+
+    def test_parallel_renamers(self):
+        """renamers with different settings run in parallel threads"""
+        renamers = [self.__renamer(index % 2 == 1) for index in range(8)]
+        results = [None] * len(renamers)
+
+        def run(index):
+            for _ in range(5):
+                renamers[index].clean_stored_data()
+                renamers[index].exipicrename(self.testfiles)
+                results[index] = renamers[index].export_pic_dict()
+
+        threads = [threading.Thread(target=run, args=(index,)) for index in range(len(renamers))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for index, result in enumerate(results):
+            basename = result['20090604_184453_0']['new_basename']
+            if index % 2:
+                self.assertEqual(basename, '20090604_184453__001')
+            else:
+                self.assertEqual(basename, '20090604_184453__001__e-520__25mm__f2-8__t3200__iso100')
+            self.assertEqual(len(result), len(results[index % 2]))
+
+    def test_default_renamer_untouched(self):
+        """own renamers don't change the module level settings"""
+        before = (exipicrename.use_short_names(), exipicrename.is_dry_run(),
+                  exipicrename.get_template(), exipicrename.export_pic_dict())
+        renamer = self.__renamer(not before[0])
+        renamer.set_dry_run(True)
+        renamer.set_template('{date}_{serial}')
+        renamer.exipicrename(self.testfiles)
+        self.assertTrue(renamer.export_pic_dict())
+        self.assertEqual((exipicrename.use_short_names(), exipicrename.is_dry_run(),
+                          exipicrename.get_template(), exipicrename.export_pic_dict()), before)
+
+
+class TestTemplate(unittest.TestCase):
+    """unittest class for templates of new names (virtual)"""
+
+    test_dir, _ = os.path.split(os.path.abspath(__file__))
+
+    def setUp(self):
+        exipicrename.set_dry_run(True)
+        exipicrename.set_silent(True)
+        exipicrename.set_short_names(False)
+        exipicrename.set_clean_data_after_run(False)
+
+    def tearDown(self):
+        exipicrename.set_template(None)
+        exipicrename.set_use_serial(True)
+        exipicrename.set_dry_run(False)
+        exipicrename.set_clean_data_after_run(True)
+        exipicrename.clean_stored_data()
+
+    def __names(self, filelist):
+        exipicrename.exipicrename(filelist)
+        result = sorted(value['new_basename']
+                        for value in exipicrename.export_pic_dict().values()
+                        if value['orig_extension'] == '.jpg')
+        exipicrename.clean_stored_data()
+        return result
+
+    def test_default_template(self):
+        """default template depends on short names and serial usage"""
+        self.assertEqual(exipicrename.get_template(),
+                         '{datetime}__{serial}__{camera}__{focal}__{aperture}'
+                         '__t{exposure}__iso{iso}')
+        exipicrename.set_short_names(True)
+        self.assertEqual(exipicrename.get_template(), '{datetime}__{serial}')
+        exipicrename.set_use_serial(False)
+        self.assertEqual(exipicrename.get_template(), '{datetime}')
+
+    def test_wanted_tags(self):
+        """only the tags of the used fields are read"""
+        self.assertEqual(exipicrename.compile_template('{datetime}__{serial}')[2],
+                         {0x9003: 'DateTimeOriginal'})
+        self.assertEqual(sorted(exipicrename.compile_template('{date}{lens}{iso}')[2]),
+                         [0x8827, 0x9003, 0xA434])
+
+    def test_unknown_field(self):
+        """unknown fields are refused"""
+        for template in ('{datetime}_{shutter}', '{datetime:>20}', '{datetime!r}'):
+            with self.assertRaises(ValueError):
+                exipicrename.set_template(template)
+
+    def test_path_separator(self):
+        """templates make file names, no paths"""
+        for template in ('{date}/{datetime}', os.path.join('{date}', '{datetime}')):
+            with self.assertRaises(ValueError):
+                exipicrename.Renamer().set_template(template)
+
+    def test_custom_template(self):
+        """own template with fields which are not in every picture"""
+        with TemporaryDirectory() as temp_dir:
+            lens_file = os.path.join(temp_dir, 'lens.jpg')
+            with PIL.Image.new('RGB', (8, 8)) as img:
+                exif = img.getexif()
+                exif[0x0110] = 'E-M5MarkIII'
+                exif_ifd = exif.get_ifd(0x8769)
+                exif_ifd[0x9003] = '2021:05:01 10:11:12'
+                exif_ifd[0xA434] = 'OLYMPUS M.12-40mm F2.8'
+                exif_ifd[0x9291] = '42'
+                img.save(lens_file, exif=exif)
+            exipicrename.set_template('{date}_{serial}-{camera}-{lens}-{subsec}{{x}}')
+            self.assertEqual(self.__names([
+                lens_file,
+                self.test_dir + '/fixtures/x_test.jpg',
+            ]), [
+                '2009-06-04_001-e-520-x-x{x}',
+                '2021-05-01_002-em5m3-olympus-m-12-40mm-f2-8-42{x}',
+            ])
+
+
+class TestContentDuplicates(unittest.TestCase):
+    """unittest class for pictures with the same content (real files in tmp env)"""
+
+    test_dir, _ = os.path.split(os.path.abspath(__file__))
+    source_dir = test_dir + "/fixtures/"
+
+    def setUp(self):
+        exipicrename.set_silent(True)
+        exipicrename.set_short_names(True)
+        exipicrename.set_use_ooc(False)
+        exipicrename.set_dry_run(False)
+        exipicrename.set_use_date_dir(False)
+        exipicrename.set_use_duplicate(True)
+        exipicrename.set_use_serial(True)
+
+    def tearDown(self):
+        exipicrename.set_duplicate_action()
+
+    def __rename(self, action, changed=False):
+        """rename x_test, y_test and an older copy of y_test,
+        return the file names after renaming"""
+        exipicrename.set_duplicate_action(action)
+        with TemporaryDirectory() as temp_dir:
+            copy(self.source_dir + 'x_test.jpg', temp_dir)
+            copy(self.source_dir + 'y_test.jpg', temp_dir)
+            copy(self.source_dir + 'y_test.jpg', os.path.join(temp_dir, 'y_copy.jpg'))
+            copy(self.source_dir + 'x_test.xml', os.path.join(temp_dir, 'y_copy.xml'))
+            if changed:
+                with open(os.path.join(temp_dir, 'y_copy.jpg'), 'r+b') as picture:
+                    picture.seek(-10, os.SEEK_END)
+                    picture.write(b'0123456789')
+            os.utime(os.path.join(temp_dir, 'y_copy.jpg'), (1000000000, 1000000000))
+            exipicrename.exipicrename([os.path.join(temp_dir, _file)
+                                       for _file in ('x_test.jpg', 'y_test.jpg', 'y_copy.jpg')])
+            return sorted(os.path.relpath(os.path.join(path, _file), temp_dir)
+                          for path, _, files in os.walk(temp_dir) for _file in files)
+
+    def test_duplicates_number(self):
+        """default: same content is not checked"""
+        self.assertEqual(self.__rename('number'), [
+            '20090604_184453__001.jpg',
+            '20171123_164006__002.jpg',
+            '20171123_164006__003_1.jpg',
+            '20171123_164006__003_1.xml',
+        ])
+
+    def test_duplicates_mark(self):
+        """the oldest file is the original, the copy is marked"""
+        self.assertEqual(self.__rename('mark'), [
+            '20090604_184453__001.jpg',
+            '20171123_164006__002.jpg',
+            '20171123_164006__002.xml',
+            '20171123_164006__003_1_DUPLICATE.jpg',
+        ])
+
+    def test_duplicates_skip(self):
+        """the copy is not renamed"""
+        self.assertEqual(self.__rename('skip'), [
+            '20090604_184453__001.jpg',
+            '20171123_164006__002.jpg',
+            '20171123_164006__002.xml',
+            'y_test.jpg',
+        ])
+
+    def test_duplicates_skip_store(self):
+        """the skipped copy is dropped from the picture store and its path index"""
+        renamer = exipicrename.Renamer()
+        renamer.set_silent(True)
+        renamer.set_dry_run(True)
+        renamer.set_clean_data_after_run(False)
+        renamer.set_duplicate_action('skip')
+        with TemporaryDirectory() as temp_dir:
+            copy(self.source_dir + 'y_test.jpg', temp_dir)
+            copy(self.source_dir + 'y_test.jpg', os.path.join(temp_dir, 'y_copy.jpg'))
+            os.utime(os.path.join(temp_dir, 'y_copy.jpg'), (1000000000, 1000000000))
+            renamer.exipicrename([os.path.join(temp_dir, _file)
+                                  for _file in ('y_test.jpg', 'y_copy.jpg')])
+            # pylint: disable=protected-access
+            self.assertEqual(len(renamer.export_pic_dict()), 1)
+            self.assertTrue(renamer._picdict_has_orig_filepath(
+                os.path.join(temp_dir, 'y_copy.jpg')))
+            self.assertFalse(renamer._picdict_has_orig_filepath(
+                os.path.join(temp_dir, 'y_test.jpg')))
+
+    def test_duplicates_move(self):
+        """the copy is moved to a sub-directory"""
+        self.assertEqual(self.__rename('move'), [
+            '20090604_184453__001.jpg',
+            '20171123_164006__002.jpg',
+            '20171123_164006__002.xml',
+            os.path.join('duplicates', '20171123_164006__003_1.jpg'),
+        ])
+
+    def test_duplicates_move_twice(self):
+        """a second run (with date directories) leaves the moved copy where it is"""
+        renamer = exipicrename.Renamer()
+        renamer.set_silent(True)
+        renamer.set_short_names(True)
+        renamer.set_use_date_dir(True)
+        renamer.set_duplicate_action('move')
+        with TemporaryDirectory() as temp_dir:
+            copy(self.source_dir + 'x_test.jpg', temp_dir)
+            copy(self.source_dir + 'x_test.jpg', os.path.join(temp_dir, 'x_copy.jpg'))
+            os.utime(os.path.join(temp_dir, 'x_copy.jpg'), (1000000000, 1000000000))
+            files = []
+            for _ in range(2):
+                renamer.exipicrename(renamer.iter_files([temp_dir], recursive=True))
+                files.append(sorted(os.path.relpath(os.path.join(path, _file), temp_dir)
+                                    for path, _, names in os.walk(temp_dir) for _file in names))
+            self.assertEqual(files[0], [
+                os.path.join('2009-06-04', '20090604_184453__001.jpg'),
+                os.path.join('2009-06-04', 'duplicates', '20090604_184453__002_1.jpg'),
+            ])
+            self.assertEqual(files[1], files[0])
+
+    def test_duplicates_different_content(self):
+        """same timestamp and size, but different content"""
+        self.assertEqual(self.__rename('mark', changed=True), [
+            '20090604_184453__001.jpg',
+            '20171123_164006__002.jpg',
+            '20171123_164006__003_1.jpg',
+            '20171123_164006__003_1.xml',
+        ])
+
+
+def write_tiff_raw(filepath, model, date_time):
+    """write a minimal tiff based raw file (olympus ORF magic) with exif tags,
+    IFD0 at 8 (2 entries), the exif sub ifd at 38 (5 entries), the values at 104"""
+    model = model.encode() + b'\0'
+    date_time = date_time.encode() + b'\0'
+    values = 104 + len(model) + len(date_time)
+    ifds = (
+        [(0x0110, 2, len(model), 104), (0x8769, 4, 1, 38)],
+        [(0x9003, 2, len(date_time), 104 + len(model)),
+         (0x829D, 5, 1, values), (0x829A, 5, 1, values + 8),
+         (0x920A, 5, 1, values + 16), (0x8827, 3, 1, 200)],
+    )
+    data = b'IIRO' + struct.pack('<L', 8)
+    for ifd in ifds:
+        data += struct.pack('<H', len(ifd))
+        data += b''.join(struct.pack('<HHLL', *entry) for entry in ifd)
+        data += struct.pack('<L', 0)
+    data += model + date_time + struct.pack('<6L', 28, 10, 1, 250, 12, 1)
+    with open(filepath, 'wb') as raw:
+        raw.write(data)
+
+
+class TestRawPrimary(unittest.TestCase):
+    """unittest class for raw files as pictures (real files in tmp env)"""
+
+    test_dir, _ = os.path.split(os.path.abspath(__file__))
+    source_dir = test_dir + "/fixtures/"
+
+    def setUp(self):
+        self.renamer = exipicrename.Renamer()
+        self.renamer.set_silent(True)
+        self.renamer.set_raw_primary(True)
+        self.renamer.set_template('{datetime}__{serial}__{camera}__{aperture}')
+        self.renamer.set_profile(True)
+
+    def test_read_tiff_exif(self):
+        """exif tags of the ifds, no tiff: None"""
+        with TemporaryDirectory() as temp_dir:
+            filepath = os.path.join(temp_dir, 'P1010001.ORF')
+            write_tiff_raw(filepath, 'Test Cam', '2021:05:01 10:11:12')
+            self.assertEqual(exipicrename.read_tiff_exif(filepath), {
+                'Model': 'Test Cam',
+                'DateTimeOriginal': '2021:05:01 10:11:12',
+                'FNumber': (28, 10),
+                'ExposureTime': (1, 250),
+                'FocalLength': (12, 1),
+                'ISOSpeedRatings': 200,
+            })
+        self.assertIsNone(exipicrename.read_tiff_exif(self.source_dir + 'x_test.jpg'))
+
+    def test_rename_raw_primary(self):
+        """the raw files are read, the JPEG and xml files are renamed with them"""
+        with TemporaryDirectory() as temp_dir:
+            write_tiff_raw(os.path.join(temp_dir, 'P1010001.ORF'), 'Test Cam',
+                           '2021:05:01 10:11:12')
+            copy(self.source_dir + 'x_test.jpg', os.path.join(temp_dir, 'P1010001.JPG'))
+            copy(self.source_dir + 'x_test.xml', os.path.join(temp_dir, 'P1010001.xml'))
+            # not tiff based (or no exif)
+            copy(self.source_dir + 'x_test.orf', temp_dir)
+            copy(self.source_dir + 'y_test.jpg', temp_dir)
+            self.renamer.set_use_ooc(True)
+            self.renamer.exipicrename(self.renamer.iter_files([temp_dir], recursive=True))
+            self.assertEqual(sorted(os.listdir(temp_dir)), [
+                '20210501_101112__001__test-cam__f2-8.ooc.jpg',
+                '20210501_101112__001__test-cam__f2-8.orf',
+                '20210501_101112__001__test-cam__f2-8.xml',
+                'x_test.orf',
+                'y_test.jpg',
+            ])
+            self.assertEqual(self.renamer.get_profile_stats()['counters']['files_opened'], 2)
+
+
+class TestMemoryBudget(unittest.TestCase):
+    """unittest class for sorted runs in temporary files (real files in tmp env)"""
+
+    test_dir, _ = os.path.split(os.path.abspath(__file__))
+    source_dir = test_dir + "/fixtures/"
+
+    @staticmethod
+    def __renamer(memory_budget, action='number'):
+        renamer = exipicrename.Renamer()
+        renamer.set_silent(True)
+        renamer.set_use_date_dir(True)
+        renamer.set_duplicate_action(action)
+        renamer.set_memory_budget(memory_budget)
+        renamer.set_profile(True)
+        return renamer
+
+    def __fill(self, temp_dir):
+        """pictures (x_test with raw and xml file), two with the same timestamp,
+        a copy of y_test, one without exif, returns the file list (x_test twice)"""
+        for _file in ('z_test.jpg', 'y_test.jpg', 'x_test.jpg', 'x_test.orf', 'x_test.xml',
+                      'yy_test.jpg', 'yy_test.jpg.xml'):
+            copy(self.source_dir + _file, temp_dir)
+        copy(self.source_dir + 'y_test.jpg', os.path.join(temp_dir, 'y_copy.jpg'))
+        os.utime(os.path.join(temp_dir, 'y_copy.jpg'), (1000000000, 1000000000))
+        return [os.path.join(temp_dir, _file) for _file in (
+            'z_test.jpg', 'y_test.jpg', 'x_test.jpg', 'yy_test.jpg', 'y_copy.jpg', 'x_test.jpg')]
+
+    def __rename(self, memory_budget, action):
+        with TemporaryDirectory() as temp_dir:
+            renamer = self.__renamer(memory_budget, action)
+            renamer.exipicrename(self.__fill(temp_dir))
+            return (sorted(os.path.relpath(os.path.join(path, _file), temp_dir)
+                           for path, _, files in os.walk(temp_dir) for _file in files),
+                    renamer.get_profile_stats()['counters'].get('spilled_runs', 0))
+
+    def test_same_as_in_memory(self):
+        """same names as with all pictures in memory, one run per picture"""
+        for action in ('number', 'mark'):
+            expected, runs = self.__rename(None, action)
+            self.assertEqual(runs, 0)
+            self.assertEqual(self.__rename(1, action), (expected, 5), action)
+            self.assertEqual(self.__rename(2, action), (expected, 3), action)
+
+    def test_iter_plan(self):
+        """the plan is the same, too"""
+        plans = []
+        for memory_budget in (None, 2):
+            with TemporaryDirectory() as temp_dir:
+                plans.append([
+                    (os.path.relpath(operation.old, temp_dir),
+                     os.path.relpath(operation.new, temp_dir), operation.serial)
+                    for operation in self.__renamer(memory_budget).iter_plan(
+                        self.__fill(temp_dir))])
+        self.assertEqual(plans[0], plans[1])
+        self.assertEqual(len(plans[0]), 7)
+
+    def test_directory_indexes_bounded(self):
+        """with a memory budget only the recently used directory indexes are kept"""
+        with TemporaryDirectory() as temp_dir:
+            for directory, files in (('a', ('x_test.jpg', 'x_test.orf')), ('b', ('y_test.jpg',)),
+                                     ('c', ('yy_test.jpg', 'yy_test.jpg.xml'))):
+                os.mkdir(os.path.join(temp_dir, directory))
+                for _file in files:
+                    copy(self.source_dir + _file, os.path.join(temp_dir, directory))
+            plans = []
+            for memory_budget in (None, 1):
+                renamer = self.__renamer(memory_budget)
+                indexes = []
+                plan = []
+                with mock.patch.object(core, '_DIR_INDEX_CACHE_SIZE', 1):
+                    for operation in renamer.iter_plan(
+                            renamer.iter_files([temp_dir], recursive=True)):
+                        indexes.append(len(renamer._dir_indexes))  # pylint: disable=protected-access
+                        plan.append(operation)
+                plans.append((plan, max(indexes)))
+        self.assertEqual(len(plans[0][0]), 5)
+        self.assertEqual(plans[0][1], 3)
+        self.assertEqual(plans[1], (plans[0][0], 1))
+
+    def test_named_already(self):
+        """the reserved duplicate numbers of pictures which are named already
+        go through the runs, too"""
+        renamer = self.__renamer(1)
+        renamer.set_use_date_dir(False)
+        renamer.set_short_names(True)
+        with TemporaryDirectory() as temp_dir:
+            for _file in ('x_test.jpg', 'x_test.xml', 'y_test.jpg'):
+                copy(self.source_dir + _file, temp_dir)
+            renamer.exipicrename(renamer.iter_files([temp_dir], recursive=True))
+            copy(self.source_dir + 'yy_test.jpg', temp_dir)
+            renamer.exipicrename(renamer.iter_files([temp_dir], recursive=True))
+            self.assertEqual(sorted(os.listdir(temp_dir)), [
+                '20090604_184453__001.jpg',
+                '20090604_184453__001.xml',
+                '20171123_164006__002.jpg',
+                '20171123_164006__003_1.jpg',
+            ])
+            # two reserved duplicate numbers and one picture
+            self.assertEqual(renamer.get_profile_stats()['counters']['spilled_runs'], 3)
+
+    def test_pictures_with_same_basename(self):
+        """pictures with the same basename (and other timestamps) are no associated files"""
+        results = []
+        for memory_budget in (None, 1):
+            with TemporaryDirectory() as temp_dir:
+                copy(self.source_dir + 'x_test.jpg', os.path.join(temp_dir, 'x.jpg'))
+                copy(self.source_dir + 'y_test.jpg', os.path.join(temp_dir, 'x.jpeg'))
+                self.__renamer(memory_budget).exipicrename(
+                    [os.path.join(temp_dir, 'x.jpg'), os.path.join(temp_dir, 'x.jpeg')])
+                results.append(sorted(os.path.relpath(os.path.join(path, _file), temp_dir)
+                                      for path, _, files in os.walk(temp_dir)
+                                      for _file in files))
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(len(results[0]), 2)
+
+    def test_invalid_budget(self):
+        """at least one picture"""
+        with self.assertRaises(ValueError):
+            exipicrename.Renamer().set_memory_budget(0)
+
+
+class TestTransfer(unittest.TestCase):
+    """unittest class for transfers into a target root (real files in tmp env)"""
+
+    test_dir, _ = os.path.split(os.path.abspath(__file__))
+    source_dir = test_dir + "/fixtures/"
+    card_files = ['x_test.jpg', 'x_test.orf', 'x_test.xml', 'y_test.jpg']
+
+    def __transfer(self, card, target_root, transfer):
+        """rename the card files into target root (date directories)
+        returns the renamer and the files in target root"""
+        for _file in self.card_files:
+            copy(self.source_dir + _file, card)
+        os.utime(os.path.join(card, 'x_test.jpg'), (1000000000, 1000000000))
+        renamer = exipicrename.Renamer()
+        renamer.set_silent(True)
+        renamer.set_short_names(True)
+        renamer.set_use_date_dir(True)
+        renamer.set_target_root(target_root)
+        renamer.set_transfer(transfer)
+        renamer.set_profile(True)
+        renamer.exipicrename(renamer.iter_files([card], recursive=True))
+        return renamer, sorted(os.path.relpath(os.path.join(path, _file), target_root)
+                               for path, _, files in os.walk(target_root) for _file in files)
+
+    def __check(self, transfer):
+        """the card is unchanged, the target root has the renamed copies"""
+        with TemporaryDirectory() as card, TemporaryDirectory() as target_root:
+            renamer, files = self.__transfer(card, target_root, transfer)
+            self.assertEqual(sorted(os.listdir(card)), self.card_files)
+            self.assertEqual(files, [
+                os.path.join('2009-06-04', '20090604_184453__001.jpg'),
+                os.path.join('2009-06-04', '20090604_184453__001.orf'),
+                os.path.join('2009-06-04', '20090604_184453__001.xml'),
+                os.path.join('2017-11-23', '20171123_164006__002.jpg'),
+            ])
+            target = os.path.join(target_root, files[0])
+            self.assertTrue(filecmp.cmp(os.path.join(card, 'x_test.jpg'), target, shallow=False))
+            self.assertEqual(os.stat(target).st_mtime, 1000000000)
+            return renamer, os.path.join(card, 'x_test.jpg'), target
+
+    def test_copy(self):
+        """copies with the same content and mtime"""
+        renamer, _, _ = self.__check('copy')
+        self.assertEqual(renamer.get_profile_stats()['counters']['copies'], 4)
+
+    def test_copy_tasks(self):
+        """copies into one target directory are independent tasks of the workers,
+        renames in one file system are grouped by target directory"""
+        rename_group = exipicrename.Renamer._rename_group  # pylint: disable=protected-access
+        for transfer, tasks in (('copy', 4), ('move', 2)):
+            with TemporaryDirectory() as card, TemporaryDirectory() as target_root, \
+                    mock.patch.object(exipicrename.Renamer, '_rename_group', autospec=True,
+                                      side_effect=rename_group) as group:
+                self.__transfer(card, target_root, transfer)
+                self.assertEqual(group.call_count, tasks, transfer)
+
+    def test_reflink(self):
+        """shared data blocks or a copy (depends on the file system of tmp)"""
+        self.__check('reflink')
+
+    def test_hardlink(self):
+        """the same file with a second name"""
+        with TemporaryDirectory() as card:
+            target_root = os.path.join(card, 'archive')
+            _, files = self.__transfer(card, target_root, 'hardlink')
+            self.assertEqual(len(files), 4)
+            self.assertTrue(os.path.samefile(
+                os.path.join(card, 'y_test.jpg'), os.path.join(target_root, files[3])))
+
+    def test_move_cross_device(self):
+        """a move to an other file system is a copy and a remove"""
+        def rename(_old, _new):
+            raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+        with TemporaryDirectory() as card, TemporaryDirectory() as target_root, \
+                mock.patch.object(exipicrename.os, 'rename', rename):
+            renamer, files = self.__transfer(card, target_root, 'move')
+            self.assertEqual(os.listdir(card), [])
+            self.assertEqual(len(files), 4)
+            self.assertEqual(renamer.get_profile_stats()['counters']['cross_device_moves'], 4)
+
+    def test_move_no_overwrite(self):
+        """a move never replaces a file, also if the directory index doesn't know it
+        (e.g. other case of the name on a case insensitive file system)"""
+        renamer = exipicrename.Renamer()
+        with TemporaryDirectory() as temp_dir:
+            oldname, newname = os.path.join(temp_dir, 'old.jpg'), os.path.join(temp_dir, 'NEW.jpg')
+            copy(self.source_dir + 'x_test.jpg', oldname)
+            copy(self.source_dir + 'y_test.jpg', newname)
+            with self.assertRaises(FileExistsError):
+                renamer._transfer_file(oldname, newname)  # pylint: disable=protected-access
+            self.assertTrue(filecmp.cmp(self.source_dir + 'x_test.jpg', oldname, shallow=False))
+            self.assertTrue(filecmp.cmp(self.source_dir + 'y_test.jpg', newname, shallow=False))
+            messages = renamer._rename_file(oldname, newname)  # pylint: disable=protected-access
+            self.assertTrue(messages[0][0])
+
+    def test_copy_file(self):
+        """no kernel copy: copy with a buffer, existing files are not overwritten"""
+        def no_kernel_copy(*_args):
+            raise OSError(errno.ENOSYS, os.strerror(errno.ENOSYS))
+        source = self.source_dir + 'x_test.jpg'
+        patch_os = mock.patch.object
+        with TemporaryDirectory() as temp_dir, \
+                patch_os(exipicrename.os, 'copy_file_range', no_kernel_copy, create=True), \
+                patch_os(exipicrename.os, 'sendfile', no_kernel_copy, create=True):
+            target = os.path.join(temp_dir, 'copy.jpg')
+            self.assertEqual(exipicrename.copy_file(source, target), os.path.getsize(source))
+            self.assertTrue(filecmp.cmp(source, target, shallow=False))
+            with self.assertRaises(FileExistsError):
+                exipicrename.copy_file(self.source_dir + 'y_test.jpg', target)
+            self.assertTrue(filecmp.cmp(source, target, shallow=False))
+
+    def test_copy_file_kernel_copy_ends_early(self):
+        """the buffer copies the rest if the kernel copy reports 0 bytes too early"""
+        def short_kernel_copy(src_fd, dst_fd, count):
+            if os.lseek(src_fd, 0, os.SEEK_CUR):
+                return 0
+            return os.write(dst_fd, os.read(src_fd, min(count, 100)))
+        source = self.source_dir + 'x_test.jpg'
+        patch_os = mock.patch.object
+        with TemporaryDirectory() as temp_dir, \
+                patch_os(exipicrename.os, 'copy_file_range', short_kernel_copy, create=True):
+            target = os.path.join(temp_dir, 'copy.jpg')
+            self.assertEqual(exipicrename.copy_file(source, target), os.path.getsize(source))
+            self.assertTrue(filecmp.cmp(source, target, shallow=False))
+
+    def test_move_cross_device_short_copy(self):
+        """the original is kept (and the partial copy removed) after a short copy"""
+        def rename(_old, _new):
+            raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+        renamer = exipicrename.Renamer()
+        patch = mock.patch.object
+        with TemporaryDirectory() as temp_dir, patch(exipicrename.os, 'rename', rename), \
+                patch(core, '_copy_data', lambda *_args: 100):
+            oldname, newname = os.path.join(temp_dir, 'old.jpg'), os.path.join(temp_dir, 'new.jpg')
+            copy(self.source_dir + 'x_test.jpg', oldname)
+            with self.assertRaises(OSError):
+                renamer._transfer_file(oldname, newname)  # pylint: disable=protected-access
+            self.assertTrue(filecmp.cmp(self.source_dir + 'x_test.jpg', oldname, shallow=False))
+            self.assertFalse(os.path.lexists(newname))
+
+
+class TestWatch(unittest.TestCase):
+    """unittest class for the watch mode (real files in tmp env)"""
+
+    test_dir, _ = os.path.split(os.path.abspath(__file__))
+    source_dir = test_dir + "/fixtures/"
+
+    def __wait_for(self, hot_folder, names):
+        """wait (up to 10 seconds) until the hot folder has these files"""
+        deadline = time.monotonic() + 10
+        while sorted(os.listdir(hot_folder)) != names and time.monotonic() < deadline:
+            time.sleep(0.02)
+        self.assertEqual(sorted(os.listdir(hot_folder)), names)
+
+    def __watch(self):
+        """files there already, new pictures, a late raw file"""
+        renamer = exipicrename.Renamer()
+        renamer.set_silent(True)
+        renamer.set_short_names(True)
+        stop = threading.Event()
+        with TemporaryDirectory() as hot_folder:
+            copy(self.source_dir + 'x_test.jpg', hot_folder)
+            copy(self.source_dir + 'x_test.xml', hot_folder)
+            watcher = threading.Thread(target=renamer.watch, args=(hot_folder, 0.05, stop))
+            watcher.start()
+            try:
+                self.__wait_for(hot_folder, [
+                    '20090604_184453__001.jpg', '20090604_184453__001.xml'])
+                copy(self.source_dir + 'y_test.jpg', hot_folder)
+                copy(self.source_dir + 'x_test.orf', hot_folder)
+                self.__wait_for(hot_folder, [
+                    '20090604_184453__001.jpg', '20090604_184453__001.orf',
+                    '20090604_184453__001.xml', '20171123_164006__002.jpg'])
+                copy(self.source_dir + 'yy_test.jpg', hot_folder)
+                self.__wait_for(hot_folder, [
+                    '20090604_184453__001.jpg', '20090604_184453__001.orf',
+                    '20090604_184453__001.xml', '20171123_164006__002.jpg',
+                    '20171123_164006__003_1.jpg'])
+            finally:
+                stop.set()
+                watcher.join()
+
+    def test_watch(self):
+        """inotify on linux"""
+        self.__watch()
+
+    def test_watch_scandir(self):
+        """scans of the directory"""
+        # pylint: disable=protected-access
+        with mock.patch.object(core, '_directory_watcher', core._ScandirWatcher):
+            self.__watch()
+
+    def test_stable_files_changing_raw(self):
+        """a stable picture waits while a file with the same basename still changes"""
+        renamer = exipicrename.Renamer()
+        with TemporaryDirectory() as hot_folder:
+            for _file in ('x_test.jpg', 'x_test.orf'):
+                copy(self.source_dir + _file, hot_folder)
+            stat = os.stat(os.path.join(hot_folder, 'x_test.jpg'))
+            settled = time.monotonic() - 10
+            pending = {'x_test.jpg': ((stat.st_size, stat.st_mtime_ns), settled),
+                       'x_test.orf': ((0, 0), settled)}
+            # pylint: disable=protected-access
+            self.assertEqual(renamer._stable_files(hot_folder, pending, 1), [])
+            self.assertEqual(sorted(pending), ['x_test.jpg', 'x_test.orf'])
+            # the raw file does not change any more
+            pending['x_test.orf'] = (pending['x_test.orf'][0], settled)
+            self.assertEqual(renamer._stable_files(hot_folder, pending, 1),
+                             ['x_test.jpg', 'x_test.orf'])
+            self.assertEqual(pending, {})
+
+
+class TestStartup(unittest.TestCase):
+    """unittest class for the modules imported at the start (in a new interpreter)"""
+
+    test_dir, _ = os.path.split(os.path.abspath(__file__))
+    source_dir = test_dir + "/fixtures/"
+    module_dir = os.path.dirname(test_dir)
+
+    def __modules(self, code):
+        """run code after import exipicrename in a new python,
+        returns the imported (top level) modules of Pillow, sqlite3 ..."""
+        code = (f"import sys, json\nsys.path.insert(0, {self.module_dir!r})\n"
+                f"import exipicrename\n{code}\n"
+                "print(json.dumps(sorted(name for name in sys.modules if name.split('.')[0]"
+                " in ('PIL', 'sqlite3', 'cProfile', 'ctypes'))))")
+        output = subprocess.run([sys.executable, '-c', code], check=True,
+                                capture_output=True, text=True).stdout
+        return json.loads(output.splitlines()[-1])
+
+    def test_version(self):
+        """--version works without Pillow"""
+        output = subprocess.run(
+            [sys.executable, os.path.join(self.module_dir, 'exipicrename.py'), '--version'],
+            check=True, capture_output=True, text=True).stdout
+        self.assertIn(exipicrename.version, output)
+
+    def test_no_pillow(self):
+        """no Pillow for plans and pictures the built-in reader can read"""
+        self.assertEqual(self.__modules(
+            "exipicrename.Renamer().apply_plan([])\n"
+            f"exipicrename.read_jpeg_exif({self.source_dir + 'x_test.jpg'!r})"), [])
+
+    def test_pillow_plugins(self):
+        """the Pillow fallback loads only the JPEG and TIFF plugins"""
+        modules = self.__modules(
+            "renamer = exipicrename.Renamer()\n"
+            "renamer.set_silent(True)\n"
+            f"list(renamer.iter_plan([{self.source_dir + 'z_test.jpg'!r}]))")
+        self.assertIn('PIL.JpegImagePlugin', modules)
+        self.assertNotIn('PIL.PngImagePlugin', modules)
+        self.assertNotIn('PIL.BmpImagePlugin', modules)
+
 
 if __name__ == '__main__':
     unittest.main()